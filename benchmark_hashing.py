@@ -0,0 +1,73 @@
+"""
+RNGP Patcher - Hashing Benchmark
+Compares the original whole-file text hashing with rngp_hashing
+
+Hashes every file in a folder (default: patch_files) with both methods,
+checks that every digest is identical and prints the throughput of each.
+Run it twice in a row so both methods read from a warm disk cache.
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from pathlib import Path
+
+from rngp_hashing import TEXT_EXTENSIONS, file_md5
+
+
+def legacy_md5(file_path):
+    """The hashing used before rngp_hashing: whole text files decoded in memory, 4 KB binary reads"""
+    hash_md5 = hashlib.md5()
+    if Path(file_path).suffix.lower() in TEXT_EXTENSIONS:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read().replace('\r\n', '\n')
+            hash_md5.update(content.encode('utf-8'))
+    else:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(4096), b""):
+                hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+
+def run(files, method):
+    """Hash all files with method, returning ({path: md5}, seconds)"""
+    start = time.perf_counter()
+    digests = {path: method(path) for path in files}
+    return digests, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark file hashing for the patcher")
+    parser.add_argument("folder", nargs="?", default="patch_files", help="folder of files to hash")
+    parser.add_argument("--rounds", type=int, default=3, help="best of this many rounds is reported")
+    args = parser.parse_args()
+
+    files = [Path(root) / name for root, _, names in os.walk(args.folder) for name in names]
+    if not files:
+        print(f"No files found in {args.folder}")
+        return
+    text_files = [f for f in files if f.suffix.lower() in TEXT_EXTENSIONS]
+    groups = [("all files", files), ("text files", text_files)]
+
+    for label, group in groups:
+        if not group:
+            continue
+        total = sum(os.path.getsize(f) for f in group)
+        print(f"{label}: {len(group)} files, {total / (1024 * 1024):.1f} MB")
+        results = {}
+        for name, method in (("legacy", legacy_md5), ("rngp_hashing", file_md5)):
+            best = None
+            for _ in range(args.rounds):
+                digests, seconds = run(group, method)
+                best = seconds if best is None else min(best, seconds)
+            results[name] = digests
+            print(f"  {name:<13} {best:7.3f} s  {total / (1024 * 1024) / best:8.1f} MB/s")
+        mismatches = [f for f in group if results["legacy"][f] != results["rngp_hashing"][f]]
+        print(f"  digests: {'identical' if not mismatches else f'{len(mismatches)} MISMATCHES'}")
+        for f in mismatches:
+            print(f"    {f}")
+
+
+if __name__ == "__main__":
+    main()
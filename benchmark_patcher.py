@@ -0,0 +1,560 @@
+"""
+RNGP Patcher - Patching Benchmark
+Runs the patch engine against a local stand-in for the download server
+
+The stand-in serves patch_files/ and a copy of patch_manifest.json whose
+download URLs point at it. It can add latency to every request, cap the
+bandwidth, ignore Range requests and fail requests, so the engine can be
+measured under conditions close to a real player's connection.
+
+Scenarios (each with a fresh PatchEngine, like a new patcher session):
+    fresh_install          empty game directory
+    noop_check             check() right after the install
+    changed_s3d            the server publishes a modified .s3d, then patch()
+    interrupted_download   the largest file drops halfway, then a second patch() resumes
+
+Wall time, bytes and requests seen by the server, and peak Python memory
+(tracemalloc) of every scenario are written to a JSON file. Peak memory
+comes from a second pass over the scenarios, because tracemalloc slows
+Python down far too much to time the first one with it (--no-memory skips
+that pass). Pass an earlier results file with --compare to see the
+difference per scenario.
+
+Usage:
+    python benchmark_patcher.py --latency 0.05 --bandwidth 10 --output before.json
+    python benchmark_patcher.py --latency 0.05 --bandwidth 10 --compare before.json
+"""
+
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+
+from generate_manifest import scan_file
+from rngp_engine import DEFAULT_DOWNLOAD_WORKERS, PatchEngine
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+RESULTS_FILE = "benchmark_results.json"
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """GET/HEAD with optional single byte Range, ETag on the manifest, and injected faults"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # The client hung up mid-response, e.g. on a segment another mirror delivered first
+            pass
+
+    def do_HEAD(self):
+        self.do_GET(head_only=True)
+
+    def do_GET(self, head_only=False):
+        server = self.server.stand_in
+        url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        server.count_request()
+        if server.latency:
+            time.sleep(server.latency)
+
+        if url_path == StandInServer.MANIFEST_PATH:
+            etag = server.manifest_etag
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self._send_bytes(server.manifest_data, {'ETag': etag, 'Content-Type': 'application/json'}, head_only)
+            return
+
+        file_path = server.resolve(url_path)
+        if file_path is None:
+            self._send_bytes(b"Not Found", {}, head_only, status=404)
+            return
+        if server.should_fail():
+            self._send_bytes(b"Service Unavailable", {}, head_only, status=503)
+            return
+
+        size = os.path.getsize(file_path)
+        start, end, status = 0, size, 200
+        headers = {'Content-Type': 'application/octet-stream'}
+        requested = self.headers.get('Range')
+        if requested and server.ranges:
+            byte_range = self._parse_range(requested, size)
+            if byte_range is None:
+                self._send_bytes(b"", {'Content-Range': f"bytes */{size}"}, head_only, status=416)
+                return
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end - 1}/{size}"
+        if server.ranges:
+            headers['Accept-Ranges'] = 'bytes'
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        if head_only:
+            return
+
+        drop_after = server.take_drop(url_path)
+        sent = 0
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining:
+                block = f.read(min(SEND_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                if drop_after is not None and sent + len(block) >= drop_after:
+                    block = block[:drop_after - sent]
+                    self._write(block)
+                    self._drop_connection()
+                    return
+                self._write(block)
+                sent += len(block)
+                remaining -= len(block)
+
+    def _parse_range(self, value, size):
+        """(start, end) for a single "bytes=a-b" / "bytes=a-" range, or None if unsatisfiable"""
+        try:
+            first, last = value.split('=', 1)[1].split('-', 1)
+            start = int(first)
+            end = int(last) + 1 if last else size
+        except (IndexError, ValueError):
+            return 0, size
+        if start >= size:
+            return None
+        return start, min(end, size)
+
+    def _send_bytes(self, data, headers, head_only, status=200):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not head_only:
+            self._write(data)
+
+    def _write(self, data):
+        self.server.stand_in.throttle(len(data))
+        self.wfile.write(data)
+        self.server.stand_in.count_bytes(len(data))
+
+    def _drop_connection(self):
+        """Cut the connection mid-body, like a dropped Wi-Fi link"""
+        self.close_connection = True
+        try:
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class StandInServer:
+    """
+    Local HTTP server standing in for the GitHub download URLs.
+
+    latency: seconds added before every response
+    bandwidth: bytes/s shared by all connections (None = unlimited)
+    ranges: honour Range requests (False answers 200 with the whole file)
+    error_rate: fraction of file requests answered with 503
+    """
+
+    MANIFEST_PATH = "/patch_manifest.json"
+    FILES_PATH = "/patch_files/"
+
+    def __init__(self, files_folder, latency=0.0, bandwidth=None, ranges=True, error_rate=0.0, seed=0):
+        self.files_folder = Path(files_folder).resolve()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        self.error_rate = error_rate
+        self.manifest_data = b"{}"
+        self.manifest_etag = '"0"'
+        self.overrides = {}         # URL path -> local file served instead
+        self.drops = {}             # URL path -> body bytes sent before dropping (once)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_send = 0.0
+        self._counters = {'requests': 0, 'bytes_sent': 0}
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stand_in = self
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @property
+    def manifest_url(self):
+        return self.base_url + self.MANIFEST_PATH
+
+    def file_url(self, relative_path):
+        return self.base_url + self.FILES_PATH + urllib.parse.quote(relative_path)
+
+    def publish(self, manifest):
+        """Serve manifest (a dict) as the current release"""
+        self.manifest_data = json.dumps(manifest, indent=2).encode('utf-8')
+        self.manifest_etag = '"' + hashlib.md5(self.manifest_data).hexdigest() + '"'
+
+    def resolve(self, url_path):
+        """Local file for a URL path, or None"""
+        if url_path in self.overrides:
+            return self.overrides[url_path]
+        if not url_path.startswith(self.FILES_PATH):
+            return None
+        file_path = (self.files_folder / url_path[len(self.FILES_PATH):]).resolve()
+        if self.files_folder not in file_path.parents or not file_path.is_file():
+            return None
+        return file_path
+
+    def count_request(self):
+        with self._lock:
+            self._counters['requests'] += 1
+
+    def count_bytes(self, count):
+        with self._lock:
+            self._counters['bytes_sent'] += count
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset_counters(self):
+        with self._lock:
+            self._counters = {'requests': 0, 'bytes_sent': 0}
+
+    def should_fail(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def take_drop(self, url_path):
+        with self._lock:
+            return self.drops.pop(url_path, None)
+
+    def throttle(self, count):
+        """Wait for this block's share of the bandwidth cap"""
+        if not self.bandwidth:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next_send = max(now, self._next_send) + count / self.bandwidth
+            delay = self._next_send - now
+        time.sleep(delay)
+
+
+def local_manifest(manifest_path, files_folder, server):
+    """The manifest with download URLs moved to the stand-in and missing files dropped"""
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    files = []
+    for file_info in manifest['files']:
+        if not (Path(files_folder) / file_info['path']).is_file():
+            continue
+        file_info = dict(file_info, url=server.file_url(file_info['path']))
+        # Deltas, compressed variants and bundles live outside patch_files/
+        for key in ('deltas', 'compressed'):
+            file_info.pop(key, None)
+        files.append(file_info)
+    skipped = len(manifest['files']) - len(files)
+    manifest['files'] = files
+    manifest.pop('bundles', None)
+    return manifest, skipped
+
+
+def modified_copy(file_path, work_folder):
+    """Copy of file_path with 4 KB in the middle overwritten (same name and size)"""
+    copy_path = Path(work_folder) / "changed" / Path(file_path).name
+    copy_path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(file_path, copy_path)
+    size = copy_path.stat().st_size
+    with open(copy_path, 'r+b') as f:
+        f.seek(max(size // 2 - 2048, 0))
+        f.write(os.urandom(min(4096, size)))
+    return copy_path
+
+
+def git_commit():
+    """Short hash of the checked out commit, or None"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+class Benchmark:
+    """Runs the scenarios against one StandInServer"""
+
+    def __init__(self, server, manifest, work_folder, workers, verbose=False):
+        self.server = server
+        self.manifest = manifest
+        self.work_folder = Path(work_folder)
+        self.workers = workers
+        self.verbose = verbose
+        # Trace peak memory instead of timing (wall_time is meaningless under tracemalloc)
+        self.trace_memory = False
+
+    def _on_event(self, event):
+        if self.verbose and event['event'] == 'log':
+            print(f"    [{event['level']}] {event['message']}")
+
+    def measure(self, game_path, action):
+        """Run engine.check() or engine.patch() on a fresh engine and record its cost"""
+        engine = PatchEngine(game_path=str(game_path), manifest_url=self.server.manifest_url,
+                             download_workers=self.workers, on_event=self._on_event)
+        self.server.reset_counters()
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            result = getattr(engine, action)()
+            error = None
+        except Exception as e:
+            result = None
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            wall_time = time.perf_counter() - started
+            if self.trace_memory:
+                peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            engine.close()
+
+        counters = self.server.counters()
+        run = {
+            'action': action,
+            'wall_time': round(wall_time, 3),
+            'bytes_transferred': counters['bytes_sent'],
+            'requests': counters['requests']
+        }
+        if self.trace_memory:
+            run['peak_memory'] = peak_memory
+        if error:
+            run['error'] = error
+        elif action == 'check':
+            run.update(up_to_date=result['up_to_date'], files_to_update=len(result['files_to_update']))
+        else:
+            run.update(up_to_date=result['up_to_date'], files=result['files'], failed=result['failed'])
+        return run
+
+    def fresh_install(self):
+        game_path = self.work_folder / "game"
+        shutil.rmtree(game_path, ignore_errors=True)
+        game_path.mkdir(parents=True)
+        run = self.measure(game_path, 'patch')
+        return run, run.get('failed') == 0
+
+    def noop_check(self):
+        run = self.measure(self.work_folder / "game", 'check')
+        return run, run.get('up_to_date') is True
+
+    def changed_s3d(self, s3d_path=None):
+        """Publish a release where one .s3d changed; the game directory has the old one"""
+        candidates = [f for f in self.manifest['files'] if f['path'].lower().endswith('.s3d')]
+        if s3d_path:
+            candidates = [f for f in candidates if f['path'] == s3d_path]
+        if not candidates:
+            return {'error': "no .s3d file in the manifest"}, False
+        old_entry = max(candidates, key=lambda f: f['size'])
+
+        copy_path = modified_copy(self.server.files_folder / old_entry['path'], self.work_folder)
+        md5_hash, segments, chunks, _ = scan_file(
+            str(copy_path), with_pfs_entries='pfs_entries' in old_entry, with_chunks='chunks' in old_entry
+        )
+        new_entry = {key: value for key, value in old_entry.items() if key not in ('pfs_entries', 'chunks')}
+        new_entry.update(md5=md5_hash, url=self.server.base_url + "/changed/" + urllib.parse.quote(old_entry['path']))
+        if segments:
+            new_entry['pfs_entries'] = segments
+        if chunks:
+            new_entry['chunks'] = chunks
+
+        release = dict(self.manifest, files=[new_entry if f is old_entry else f for f in self.manifest['files']])
+        self.server.overrides[urllib.parse.unquote(urllib.parse.urlsplit(new_entry['url']).path)] = copy_path
+        self.server.publish(release)
+        try:
+            run = self.measure(self.work_folder / "game", 'patch')
+        finally:
+            self.server.publish(self.manifest)
+        run['changed_file'] = old_entry['path']
+        run['changed_file_size'] = old_entry['size']
+        return run, run.get('failed') == 0 and run.get('files') == 1
+
+    def interrupted_download(self):
+        """Drop the largest file halfway through, then patch again"""
+        game_path = self.work_folder / "interrupted"
+        shutil.rmtree(game_path, ignore_errors=True)
+        game_path.mkdir(parents=True)
+        largest = max(self.manifest['files'], key=lambda f: f['size'])
+        self.server.drops[StandInServer.FILES_PATH + largest['path']] = largest['size'] // 2
+
+        first = self.measure(game_path, 'patch')
+        self.server.drops.clear()
+        second = self.measure(game_path, 'patch')
+        run = {
+            'interrupted_file': largest['path'],
+            'interrupted_file_size': largest['size'],
+            'wall_time': round(first['wall_time'] + second['wall_time'], 3),
+            'bytes_transferred': first['bytes_transferred'] + second['bytes_transferred'],
+            'requests': first['requests'] + second['requests'],
+            'runs': [first, second]
+        }
+        if self.trace_memory:
+            run['peak_memory'] = max(first['peak_memory'], second['peak_memory'])
+        return run, first.get('failed') == 1 and second.get('failed') == 0
+
+
+SCENARIOS = ["fresh_install", "noop_check", "changed_s3d", "interrupted_download"]
+
+
+def run_scenarios(benchmark, names, s3d_path=None):
+    """Run the named scenarios in order; yields (name, run, ok)"""
+    # Later scenarios patch the install made by fresh_install
+    wanted = set(names)
+    if wanted & {"noop_check", "changed_s3d"}:
+        wanted.add("fresh_install")
+    for name in SCENARIOS:
+        if name not in wanted:
+            continue
+        print(f"{name}...")
+        if name == "changed_s3d":
+            run, ok = benchmark.changed_s3d(s3d_path)
+        else:
+            run, ok = getattr(benchmark, name)()
+        yield name, run, ok
+
+
+def compare(results, previous):
+    """Print the change of every shared scenario metric against an earlier results file"""
+    print(f"\nCompared with {previous.get('commit') or 'previous run'} ({previous.get('date', '?')}):")
+    for name, scenario in results['scenarios'].items():
+        before = previous.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for metric in ('wall_time', 'bytes_transferred', 'requests', 'peak_memory'):
+            old, new = before.get(metric), scenario.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            changes.append(f"{metric} {change}")
+        print(f"  {name:<22} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the patcher against a local stand-in server")
+    parser.add_argument("--manifest", default="patch_manifest.json", help="manifest to serve")
+    parser.add_argument("--files", default="patch_files", help="folder the manifest's files are served from")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="bandwidth cap in MB/s (0 = unlimited)")
+    parser.add_argument("--no-ranges", action="store_true", help="server ignores Range requests")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of file requests failing with 503")
+    parser.add_argument("--workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="parallel downloads")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--s3d", help="path of the .s3d to change (default: the largest)")
+    parser.add_argument("--output", default=RESULTS_FILE, help="results file")
+    parser.add_argument("--compare", metavar="RESULTS", help="earlier results file to compare with")
+    parser.add_argument("--no-memory", action="store_true", help="skip the second pass that measures peak memory")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary game directories")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print engine log messages")
+    args = parser.parse_args()
+
+    settings = {
+        'latency': args.latency,
+        'bandwidth': args.bandwidth * 1024 * 1024 or None,
+        'ranges': not args.no_ranges,
+        'error_rate': args.error_rate,
+        'workers': args.workers
+    }
+    server = StandInServer(args.files, latency=settings['latency'], bandwidth=settings['bandwidth'],
+                           ranges=settings['ranges'], error_rate=settings['error_rate']).start()
+    manifest, skipped = local_manifest(args.manifest, args.files, server)
+    server.publish(manifest)
+    if skipped:
+        print(f"Skipping {skipped} manifest files missing from {args.files}")
+
+    work_folder = tempfile.mkdtemp(prefix="rngp_benchmark_")
+    benchmark = Benchmark(server, manifest, work_folder, args.workers, args.verbose)
+    results = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': settings,
+        'files': len(manifest['files']),
+        'total_size': sum(f['size'] for f in manifest['files']),
+        'scenarios': {}
+    }
+
+    try:
+        for name, run, ok in run_scenarios(benchmark, args.scenarios, args.s3d):
+            run['ok'] = ok
+            results['scenarios'][name] = run
+            print(f"  {run.get('wall_time', 0):8.3f} s  {run.get('bytes_transferred', 0) / (1024 * 1024):9.1f} MB  "
+                  f"{run.get('requests', 0):5} requests  {'OK' if ok else 'UNEXPECTED RESULT'}")
+
+        if not args.no_memory:
+            print("\nPeak memory (second pass under tracemalloc):")
+            benchmark.trace_memory = True
+            for name, run, ok in run_scenarios(benchmark, args.scenarios, args.s3d):
+                if 'peak_memory' in run:
+                    results['scenarios'][name]['peak_memory'] = run['peak_memory']
+                    print(f"  peak {run['peak_memory'] / (1024 * 1024):6.1f} MB")
+    finally:
+        server.stop()
+        if args.keep:
+            print(f"Game directories kept in {work_folder}")
+        else:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    if RESOURCE_AVAILABLE:
+        # Whole process including the server threads; ru_maxrss is KB on Linux
+        results['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
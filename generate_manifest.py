@@ -6,31 +6,93 @@ Automatically creates patch_manifest.json from a folder of files
 import os
 import json
 import hashlib
+import gzip
+import argparse
+import fnmatch
 import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+from rngp_chunking import file_chunks
+from rngp_delta import make_delta
+from rngp_hashing import READ_SIZE, TEXT_EXTENSIONS, file_md5
+from rngp_manifest import deleted_entries
+from rngp_pfs import PFS_EXTENSIONS, PFSError, entry_segments
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+DEFAULT_BASE_URL = "https://raw.githubusercontent.com/printbeast/rngp-patcher/master/patch_files"
+MANIFEST_FILE = "patch_manifest.json"
+
+# Size/mtime of every file at the last run, for --incremental
+STAT_CACHE_FILE = ".manifest_stat_cache.json"
+
+DEFAULT_HASH_JOBS = os.cpu_count() or 1
+
+# Compressed variants of the payload files
+COMPRESSED_FOLDER = "patch_compressed"
+COMPRESS_MAX_RATIO = 0.9        # Only publish variants that save at least 10%
+# Already-compressed formats; not worth trying
+COMPRESS_SKIP_EXTENSIONS = {'.s3d', '.eqg', '.mp3', '.jpg', '.jpeg', '.png', '.zip', '.gz'}
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Binary deltas against the previous release
+DELTA_FOLDER = "patch_deltas"
+DELTA_MIN_SIZE = 256 * 1024     # Smaller files aren't worth a delta
+DELTA_MAX_RATIO = 0.5           # Only publish deltas smaller than half the full file
+
+# Content-defined chunks of large files
+CHUNK_MIN_FILE_SIZE = 1024 * 1024
+
+# Bundles of small files, fetched with one request instead of one per file
+BUNDLE_FOLDER = "patch_bundles"
+BUNDLE_MEMBER_MAX_SIZE = 64 * 1024      # Files up to this size go into bundles
+BUNDLE_TARGET_SIZE = 4 * 1024 * 1024    # Start a new bundle past this size
+
+# Files the game can start without; the patcher downloads them last, after
+# announcing "ready to play". (lowercase pattern, group)
+OPTIONAL_PATTERNS = [
+    ("uifiles/*/loadscreens/*", "loadscreens"),
+    ("maps/*", "maps"),
+    ("*.mp3", "music"),
+    ("*.xmi", "music"),
+    ("*.md", "docs"),
+]
+# Top-level files belonging to one zone, grouped by zone short name
+ZONE_EXTENSIONS = {'.s3d', '.eqg', '.zon', '.emt', '.map', '.eff', '.txc', '.cfg'}
+ZONE_TEXT_SUFFIXES = ("_chr.txt", "_assets.txt", "_environmentemitters.txt")
+
+
+def classify(relative_path):
+    """
+    Return (priority, group) for a file: priority is "required" or "optional".
+    
+    Required files are grouped by top folder, by zone short name
+    (gfaydark.s3d, gfaydark_chr.txt -> "gfaydark"), as "global" (global*.s3d,
+    gequip*.s3d) or as "core" (eqclient.ini, spells_us.txt, ...).
+    """
+    lowered = relative_path.replace("\\", "/").lower()
+    for pattern, group in OPTIONAL_PATTERNS:
+        if fnmatch.fnmatchcase(lowered, pattern):
+            return "optional", group
+    if "/" in lowered:
+        return "required", lowered.split("/", 1)[0]
+    if lowered.startswith(("global", "gequip")):
+        return "required", "global"
+    if os.path.splitext(lowered)[1] in ZONE_EXTENSIONS or lowered.endswith(ZONE_TEXT_SUFFIXES):
+        return "required", lowered.replace(".", "_").split("_", 1)[0]
+    return "required", "core"
+
 
 def calculate_md5(filepath):
-    """Calculate MD5 hash of a file"""
-    # Define text file extensions that should have line ending normalization
-    # These are files where Git might normalize line endings
-    text_extensions = {'.txt', '.md', '.cfg', '.emt', '.map', '.eff', '.ini', '.opt', '.edd', '.zon', '.xmi'}
-    
-    hash_md5 = hashlib.md5()
+    """Calculate MD5 hash of a file (text files with normalized line endings, see rngp_hashing)"""
     try:
-        ext = Path(filepath).suffix.lower()
-        if ext in text_extensions:
-            # Read as text, replace CRLF with LF, encode as UTF-8
-            with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read().replace('\r\n', '\n')
-                hash_md5.update(content.encode('utf-8'))
-        else:
-            # Binary mode for everything else (images, audio, executables, etc.)
-            with open(filepath, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        return file_md5(filepath, READ_SIZE)
     except Exception as e:
         print(f"Error calculating MD5 for {filepath}: {e}")
         return ""
@@ -44,7 +106,319 @@ def get_file_size(filepath):
         return 0
 
 
-def generate_manifest(source_folder, base_url_path="https://raw.githubusercontent.com/printbeast/rngp-patcher/master/patch_files", version="1.0.0"):
+def scan_file(file_path, with_pfs_entries=False, with_chunks=False):
+    """
+    Hash one file for the manifest (runs in a worker process)
+    
+    Returns (md5, pfs entry segments or None, chunks or None, note) - md5
+    is "" on error.
+    """
+    md5_hash = calculate_md5(file_path)
+    segments = None
+    chunks = None
+    note = ""
+    if md5_hash and with_pfs_entries:
+        try:
+            segments = entry_segments(file_path)
+        except PFSError as e:
+            note = f"not a PFS archive: {e}"
+    if md5_hash and with_chunks:
+        chunks = file_chunks(file_path)
+    return md5_hash, segments, chunks, note
+
+
+def hash_files(jobs_list, jobs=DEFAULT_HASH_JOBS):
+    """
+    Run scan_file over (file_path, with_pfs_entries, with_chunks) tuples, in a
+    process pool if jobs > 1
+    
+    Results are yielded in input order.
+    """
+    if jobs <= 1 or len(jobs_list) < 2:
+        for args in jobs_list:
+            yield scan_file(*args)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        yield from pool.map(scan_file, *zip(*jobs_list), chunksize=4)
+
+
+def _stat_cache_entry(st, md5_hash):
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "md5": md5_hash}
+
+
+def load_stat_cache(cache_path, source_path):
+    """Return {path: {"size", "mtime_ns", "md5"}} saved for source_path, or {}"""
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("source") == str(Path(source_path).absolute()):
+            return cache.get("files", {})
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def save_stat_cache(cache_path, source_path, entries):
+    """Write the stat cache used by the next --incremental run"""
+    try:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"source": str(Path(source_path).absolute()), "files": entries}, f)
+    except OSError as e:
+        print(f"WARNING: Could not save stat cache: {e}")
+
+
+def count_duplicates(files):
+    """Return (file count, bytes) of entries whose MD5 already appeared earlier"""
+    seen = set()
+    duplicate_count = 0
+    duplicate_bytes = 0
+    for entry in files:
+        if entry["md5"] in seen:
+            duplicate_count += 1
+            duplicate_bytes += entry["size"]
+        else:
+            seen.add(entry["md5"])
+    return duplicate_count, duplicate_bytes
+
+
+def compress_data(data, encoding):
+    """Compress data with the given encoding ("gzip" or "zstd")"""
+    if encoding == "gzip":
+        # mtime=0 keeps the output identical between runs
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def build_compressed_variant(entry, file_path, encoding, compressed_base_url):
+    """
+    Write a compressed copy of file_path and record it in the manifest entry
+    
+    The variant is only kept if it is meaningfully smaller than the file.
+    Returns the number of bytes saved (0 if no variant was made).
+    """
+    if file_path.suffix.lower() in COMPRESS_SKIP_EXTENSIONS:
+        return 0
+    
+    compressed = compress_data(file_path.read_bytes(), encoding)
+    if len(compressed) > entry["size"] * COMPRESS_MAX_RATIO:
+        return 0
+    
+    variant_path = Path(COMPRESSED_FOLDER) / (entry["path"] + COMPRESSED_SUFFIXES[encoding])
+    variant_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(variant_path, "wb") as f:
+        f.write(compressed)
+    
+    encoded_path = urllib.parse.quote(entry["path"] + COMPRESSED_SUFFIXES[encoding])
+    entry["compressed"] = {
+        "encoding": encoding,
+        "url": f"{compressed_base_url}/{encoded_path}",
+        "size": len(compressed),
+        "md5": hashlib.md5(compressed).hexdigest()
+    }
+    return entry["size"] - len(compressed)
+
+
+def load_previous_manifest(manifest_path):
+    """Return {path: entry} from an older patch_manifest.json"""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return {entry["path"]: entry for entry in manifest.get("files", [])}
+
+
+def build_deleted(files, previous_manifest):
+    """
+    Work out the manifest "deleted" section by diffing against the previous release
+    
+    Files of previous_manifest that are gone from files are added with the
+    hash they had, on top of the previous manifest's own deleted entries
+    (so players who skip releases are cleaned up too). Paths that are back
+    in the release are dropped. An entry without "md5s" deletes any content.
+    
+    Returns (deleted entries, number of files newly deleted).
+    """
+    current = {entry["path"].lower() for entry in files}
+    merged = {}
+    
+    def add(path, md5s):
+        key = path.lower()
+        if key in current:
+            return
+        if key not in merged:
+            merged[key] = {"path": path, "md5s": list(md5s)} if md5s else {"path": path}
+        elif "md5s" in merged[key]:
+            if md5s:
+                merged[key]["md5s"] += [md5 for md5 in md5s if md5 not in merged[key]["md5s"]]
+            else:
+                del merged[key]["md5s"]
+    
+    previous_manifest = previous_manifest or {}
+    for entry in deleted_entries(previous_manifest):
+        add(entry["path"], entry.get("md5s"))
+    carried = len(merged)
+    for entry in previous_manifest.get("files", []):
+        add(entry["path"], [entry["md5"]] if entry.get("md5") else None)
+    return sorted(merged.values(), key=lambda entry: entry["path"].lower()), len(merged) - carried
+
+
+def build_deltas(files, source_path, previous, delta_folder=DELTA_FOLDER, delta_base_url=None):
+    """
+    Attach binary deltas from previous releases to the manifest entries
+    
+    Args:
+        files: Manifest file entries (modified in place)
+        source_path: Folder with the new release files
+        previous: List of previous release folders (deltas are computed
+            against their files) and/or previous patch_manifest.json files
+            (their deltas are kept for files that haven't changed since)
+        delta_folder: Where new .rdelta files are written
+        delta_base_url: Download URL of delta_folder
+    
+    Returns:
+        (number of deltas, total delta bytes, total full-file bytes they replace)
+    """
+    delta_count = 0
+    delta_bytes = 0
+    full_bytes = 0
+    
+    for prev in previous:
+        prev_path = Path(prev)
+        
+        if prev_path.is_file():
+            # Carry forward deltas whose target is still the current version
+            old_entries = load_previous_manifest(prev_path)
+            for entry in files:
+                old_entry = old_entries.get(entry["path"])
+                if not old_entry or old_entry.get("md5") != entry["md5"]:
+                    continue
+                known = {d["from_md5"] for d in entry.get("deltas", [])}
+                for delta_info in old_entry.get("deltas", []):
+                    if delta_info["from_md5"] not in known:
+                        entry.setdefault("deltas", []).append(delta_info)
+                        known.add(delta_info["from_md5"])
+            continue
+        
+        if not prev_path.is_dir():
+            print(f"WARNING: Previous release not found: {prev}")
+            continue
+        
+        for entry in files:
+            old_file = prev_path / entry["path"]
+            new_file = source_path / entry["path"]
+            # Text files are hashed after line ending normalization, so their
+            # raw bytes on a player's disk may not match the delta base
+            if entry["size"] < DELTA_MIN_SIZE or new_file.suffix.lower() in TEXT_EXTENSIONS:
+                continue
+            if not old_file.is_file():
+                continue
+            
+            old_md5 = calculate_md5(old_file)
+            if not old_md5 or old_md5 == entry["md5"]:
+                continue
+            if any(d["from_md5"] == old_md5 for d in entry.get("deltas", [])):
+                continue
+            
+            print(f"  Delta: {entry['path']} ({old_md5[:8]} -> {entry['md5'][:8]})...", end=" ")
+            delta = make_delta(old_file.read_bytes(), new_file.read_bytes())
+            if len(delta) > entry["size"] * DELTA_MAX_RATIO:
+                print(f"SKIPPED ({len(delta) * 100 // entry['size']}% of full size)")
+                continue
+            
+            delta_name = f"{old_md5}_{entry['md5']}.rdelta"
+            Path(delta_folder).mkdir(parents=True, exist_ok=True)
+            with open(Path(delta_folder) / delta_name, "wb") as f:
+                f.write(delta)
+            
+            entry.setdefault("deltas", []).append({
+                "from_md5": old_md5,
+                "url": f"{delta_base_url}/{delta_name}",
+                "size": len(delta),
+                "md5": hashlib.md5(delta).hexdigest()
+            })
+            delta_count += 1
+            delta_bytes += len(delta)
+            full_bytes += entry["size"]
+            print(f"OK ({len(delta) / 1024:.0f} KB, {len(delta) * 100 // entry['size']}% of full size)")
+    
+    return delta_count, delta_bytes, full_bytes
+
+
+def build_bundles(files, source_path, bundle_folder=BUNDLE_FOLDER, bundle_base_url=None,
+                  member_max_size=BUNDLE_MEMBER_MAX_SIZE, target_size=BUNDLE_TARGET_SIZE):
+    """
+    Pack small files into bundle archives
+    
+    A bundle is the raw bytes of its members stored back to back. Files
+    are packed in manifest order so neighbouring files (same zone, same
+    folder) share a bundle and a partial update needs few Range slices.
+    Identical files are stored once and listed at the same offset.
+    
+    Returns the manifest "bundles" list: {"name", "url", "size", "md5",
+    "members": [{"path", "offset", "size", "md5"}]}
+    """
+    bundles = []
+    current = None
+    data = bytearray()
+    offsets = {}
+    
+    def finish():
+        bundle_path = Path(bundle_folder) / f"{current['name']}.bin"
+        bundle_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(bundle_path, "wb") as f:
+            f.write(data)
+        current["size"] = len(data)
+        current["md5"] = hashlib.md5(data).hexdigest()
+        bundles.append(current)
+    
+    for entry in files:
+        if entry["size"] > member_max_size:
+            continue
+        if current is None or len(data) >= target_size:
+            if current is not None:
+                finish()
+            name = f"bundle_{len(bundles):03d}"
+            current = {"name": name, "url": f"{bundle_base_url}/{name}.bin", "members": []}
+            data = bytearray()
+            offsets = {}
+        
+        offset = offsets.get(entry["md5"])
+        if offset is None:
+            content = (source_path / entry["path"]).read_bytes()
+            if len(content) != entry["size"]:
+                continue
+            offset = offsets[entry["md5"]] = len(data)
+            data += content
+        current["members"].append({
+            "path": entry["path"],
+            "offset": offset,
+            "size": entry["size"],
+            "md5": entry["md5"]
+        })
+    
+    if current is not None and current["members"]:
+        finish()
+    return bundles
+
+
+def make_urls_relative(manifest, release_root):
+    """Strip release_root from every download URL in the manifest (files, variants, deltas, bundles)"""
+    def relative(url):
+        return url[len(release_root):] if url.startswith(release_root) else url
+
+    for entry in manifest["files"]:
+        entry["url"] = relative(entry["url"])
+        if "compressed" in entry:
+            entry["compressed"]["url"] = relative(entry["compressed"]["url"])
+        for delta in entry.get("deltas", []):
+            delta["url"] = relative(delta["url"])
+    for bundle in manifest.get("bundles", []):
+        bundle["url"] = relative(bundle["url"])
+
+
+def generate_manifest(source_folder, base_url_path=DEFAULT_BASE_URL, version="1.0.0", previous=None,
+                      pfs_entries=False, compress=None, bundle_small_files=False, incremental=False,
+                      jobs=DEFAULT_HASH_JOBS, chunk_large_files=False, mirrors=None):
     """
     Generate a patch manifest from a folder of files
     
@@ -52,6 +426,22 @@ def generate_manifest(source_folder, base_url_path="https://raw.githubuserconten
         source_folder: Path to folder containing files to patch
         base_url_path: Base path for downloads (GitHub raw URL)
         version: Version number for this patch
+        previous: Optional list of previous release folders / manifests
+            to build binary deltas from (see build_deltas)
+        pfs_entries: Record the entries of PFS archives (.s3d/.eqg) so the
+            patcher can fetch only the entries that changed
+        compress: Optional "gzip" or "zstd" - write compressed variants of
+            files that compress well to patch_compressed/
+        bundle_small_files: Pack small files into bundles in patch_bundles/
+            so they can be fetched with a few requests
+        incremental: Only rehash files whose size/mtime changed since the
+            last run (uses patch_manifest.json and the stat cache)
+        jobs: Number of processes hashing files in parallel
+        chunk_large_files: Record content-defined chunks of large binary
+            files so the patcher can fetch only the chunks a player lacks
+        mirrors: Optional list of other base URLs serving a copy of the
+            release (the folder above source_folder). The manifest then
+            lists them after the GitHub root and uses relative URLs
     """
 
     source_path = Path(source_folder)
@@ -60,6 +450,11 @@ def generate_manifest(source_folder, base_url_path="https://raw.githubuserconten
         print(f"ERROR: Source folder does not exist: {source_folder}")
         return None
 
+    if compress == "zstd" and not ZSTD_AVAILABLE:
+        print("ERROR: zstd compression needs the 'zstandard' package (pip install zstandard)")
+        return None
+    compressed_base_url = f"{base_url_path.rsplit('/', 1)[0]}/{COMPRESSED_FOLDER}"
+
     print("=" * 60)
     print("RNGP Patcher - Manifest Generator")
     print("=" * 60)
@@ -69,47 +464,150 @@ def generate_manifest(source_folder, base_url_path="https://raw.githubuserconten
     print()
 
     # Collect all files recursively
-    files = []
-    file_count = 0
-    total_size = 0
-
     print("Scanning files...")
+    scanned = []
     for root, dirs, filenames in os.walk(source_path):
         for filename in filenames:
             file_path = Path(root) / filename
 
-            # Get relative path from source folder
-            relative_path = file_path.relative_to(source_path)
-
-            # Convert Windows paths to forward slashes for consistency
-            relative_path_str = str(relative_path).replace("\\", "/")
-
-            print(f"  Processing: {relative_path_str}...", end=" ")
-
-            # Calculate MD5
-            md5_hash = calculate_md5(file_path)
-            file_size = get_file_size(file_path)
-
-            if md5_hash and file_size > 0:
-                # Build GitHub URL path with proper encoding for spaces
-                encoded_path = urllib.parse.quote(relative_path_str)
-                github_url = f"{base_url_path}/{encoded_path}"
-
-                file_entry = {
-                    "path": relative_path_str,
-                    "url": github_url,
-                    "size": file_size,
-                    "md5": md5_hash,
-                    "description": f"{filename}"
-                }
-
-                files.append(file_entry)
-                file_count += 1
-                total_size += file_size
+            # Get relative path from source folder, with forward slashes for consistency
+            relative_path_str = str(file_path.relative_to(source_path)).replace("\\", "/")
+            try:
+                scanned.append((relative_path_str, file_path, file_path.stat()))
+            except OSError as e:
+                print(f"  SKIPPED {relative_path_str} ({e})")
+
+    # Incremental mode: files whose size/mtime match the stat cache keep
+    # the hash (and archive entries) recorded in the previous manifest
+    stat_cache = {}
+    previous_entries = {}
+    if incremental:
+        stat_cache = load_stat_cache(STAT_CACHE_FILE, source_path)
+        if Path(MANIFEST_FILE).is_file():
+            previous_entries = load_previous_manifest(MANIFEST_FILE)
+
+    reused = {}
+    to_hash = []
+    for relative_path_str, file_path, st in scanned:
+        cached = stat_cache.get(relative_path_str)
+        old_entry = previous_entries.get(relative_path_str)
+        wants_pfs = pfs_entries and file_path.suffix.lower() in PFS_EXTENSIONS
+        # Text files are hashed after line ending normalization, so their
+        # raw bytes on a player's disk may not chunk the same way
+        wants_chunks = chunk_large_files and st.st_size >= CHUNK_MIN_FILE_SIZE and \
+            file_path.suffix.lower() not in TEXT_EXTENSIONS
+        if cached and old_entry and cached == _stat_cache_entry(st, cached["md5"]) and \
+                old_entry.get("md5") == cached["md5"] and (not wants_pfs or "pfs_entries" in old_entry) and \
+                (not wants_chunks or "chunks" in old_entry):
+            reused[relative_path_str] = old_entry
+        else:
+            to_hash.append((file_path, wants_pfs, wants_chunks))
+
+    if incremental:
+        print(f"  {len(reused)} unchanged files (stat cache), {len(to_hash)} to hash")
+    hashed = {}
+    for (file_path, _, _), result in zip(to_hash, hash_files(to_hash, jobs)):
+        relative_path_str = str(file_path.relative_to(source_path)).replace("\\", "/")
+        md5_hash, segments, chunks, note = result
+        print(f"  Hashed: {relative_path_str} " + (f"(MD5: {md5_hash[:8]}...)" if md5_hash else "SKIPPED (error)")
+              + (f" ({note})" if note else ""))
+        hashed[relative_path_str] = result
 
-                print(f"OK (MD5: {md5_hash[:8]}...)")
+    files = []
+    file_count = 0
+    total_size = 0
+    compressed_count = 0
+    compressed_saved = 0
+    new_stat_cache = {}
+
+    for relative_path_str, file_path, st in scanned:
+        file_size = st.st_size
+        old_entry = reused.get(relative_path_str)
+        if old_entry is not None:
+            md5_hash = old_entry["md5"]
+            segments = old_entry.get("pfs_entries") if pfs_entries else None
+            chunks = old_entry.get("chunks") if chunk_large_files else None
+        elif relative_path_str in hashed:
+            md5_hash, segments, chunks, _ = hashed[relative_path_str]
+        else:
+            continue
+
+        if not md5_hash or file_size <= 0:
+            continue
+
+        # Build GitHub URL path with proper encoding for spaces
+        encoded_path = urllib.parse.quote(relative_path_str)
+        github_url = f"{base_url_path}/{encoded_path}"
+        priority, group = classify(relative_path_str)
+
+        file_entry = {
+            "path": relative_path_str,
+            "url": github_url,
+            "size": file_size,
+            "md5": md5_hash,
+            "description": f"{file_path.name}",
+            "priority": priority,
+            "group": group
+        }
+        if segments is not None:
+            file_entry["pfs_entries"] = segments
+        if chunks is not None:
+            file_entry["chunks"] = chunks
+        if old_entry is not None and old_entry.get("deltas"):
+            # Deltas target this exact content, so they stay valid
+            file_entry["deltas"] = old_entry["deltas"]
+
+        if compress:
+            old_variant = old_entry.get("compressed") if old_entry else None
+            variant_path = Path(COMPRESSED_FOLDER) / (relative_path_str + COMPRESSED_SUFFIXES[compress])
+            if old_variant and old_variant.get("encoding") == compress and variant_path.is_file() and \
+                    variant_path.stat().st_size == old_variant.get("size"):
+                file_entry["compressed"] = dict(old_variant, url=f"{compressed_base_url}/"
+                                                f"{urllib.parse.quote(relative_path_str + COMPRESSED_SUFFIXES[compress])}")
+                saved = file_size - old_variant["size"]
             else:
-                print("SKIPPED (error)")
+                saved = build_compressed_variant(file_entry, file_path, compress, compressed_base_url)
+            if saved:
+                compressed_count += 1
+                compressed_saved += saved
+
+        files.append(file_entry)
+        file_count += 1
+        total_size += file_size
+        new_stat_cache[relative_path_str] = _stat_cache_entry(st, md5_hash)
+
+    # Files with identical content are downloaded once by the patcher
+    duplicate_count, duplicate_bytes = count_duplicates(files)
+
+    # Binary deltas from older releases
+    delta_count = 0
+    if previous:
+        print()
+        print("Building deltas...")
+        delta_base_url = f"{base_url_path.rsplit('/', 1)[0]}/{DELTA_FOLDER}"
+        delta_count, delta_bytes, delta_full_bytes = build_deltas(
+            files, source_path, previous, DELTA_FOLDER, delta_base_url
+        )
+
+    # Files removed since the manifest this run replaces
+    previous_manifest = None
+    if Path(MANIFEST_FILE).is_file():
+        try:
+            with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+                previous_manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: Could not read the previous {MANIFEST_FILE} ({e}) - deleted files start over")
+    deleted, newly_deleted = build_deleted(files, previous_manifest)
+
+    # Bundles of small files
+    bundles = []
+    if bundle_small_files:
+        print()
+        print("Building bundles...")
+        bundle_base_url = f"{base_url_path.rsplit('/', 1)[0]}/{BUNDLE_FOLDER}"
+        bundles = build_bundles(files, source_path, BUNDLE_FOLDER, bundle_base_url)
+        for bundle in bundles:
+            print(f"  {bundle['name']}: {len(bundle['members'])} files, {bundle['size'] / 1024:.0f} KB")
 
     # Create manifest
     manifest = {
@@ -117,18 +615,26 @@ def generate_manifest(source_folder, base_url_path="https://raw.githubuserconten
         "patch_date": datetime.now().strftime("%Y-%m-%d"),
         "description": f"RNGP Server Patch v{version}",
         "files": files,
+        "deleted": deleted,
         "notes": [
             "This patch was automatically generated",
             f"Contains {file_count} files",
             f"Total size: {total_size / (1024*1024):.2f} MB"
         ]
     }
+    if bundles:
+        manifest["bundles"] = bundles
+    if mirrors:
+        release_root = base_url_path.rsplit('/', 1)[0] + "/"
+        manifest["mirrors"] = [release_root] + [m if m.endswith("/") else m + "/" for m in mirrors]
+        make_urls_relative(manifest, release_root)
 
     # Save manifest
-    manifest_path = "patch_manifest.json"
+    manifest_path = MANIFEST_FILE
     try:
         with open(manifest_path, "w", encoding="utf-8") as f:
             json.dump(manifest, f, indent=2)
+        save_stat_cache(STAT_CACHE_FILE, source_path, new_stat_cache)
 
         print()
         print("=" * 60)
@@ -136,12 +642,40 @@ def generate_manifest(source_folder, base_url_path="https://raw.githubuserconten
         print("=" * 60)
         print(f"Files: {file_count}")
         print(f"Total Size: {total_size / (1024*1024):.2f} MB")
+        if duplicate_count:
+            print(f"Duplicates: {duplicate_count} files share content with another file "
+                  f"({duplicate_bytes / (1024*1024):.2f} MB saved, "
+                  f"{(total_size - duplicate_bytes) / (1024*1024):.2f} MB unique)")
+        if compressed_count:
+            print(f"Compressed: {compressed_count} {compress} variants in {COMPRESSED_FOLDER}/ "
+                  f"({compressed_saved / (1024*1024):.2f} MB saved)")
+        chunked = [f for f in files if "chunks" in f]
+        if chunked:
+            print(f"Chunks: {len(chunked)} large files split into "
+                  f"{sum(len(f['chunks']) for f in chunked)} content-defined chunks")
+        if bundles:
+            print(f"Bundles: {sum(len(b['members']) for b in bundles)} small files packed into "
+                  f"{len(bundles)} bundles in {BUNDLE_FOLDER}/")
+        optional = [f for f in files if f["priority"] == "optional"]
+        if optional:
+            print(f"Optional: {len(optional)} files ({sum(f['size'] for f in optional) / (1024*1024):.2f} MB) "
+                  f"downloaded after the game is ready to play")
+        if deleted:
+            print(f"Deleted: {len(deleted)} files removed by this or earlier releases"
+                  + (f" ({newly_deleted} since the previous manifest)" if newly_deleted else ""))
+        if mirrors:
+            print(f"Mirrors: {len(manifest['mirrors'])} ({', '.join(manifest['mirrors'])})")
+        if delta_count:
+            print(f"Deltas: {delta_count} new ({delta_bytes / (1024*1024):.2f} MB replacing "
+                  f"{delta_full_bytes / (1024*1024):.2f} MB of full downloads) in {DELTA_FOLDER}/")
         print(f"Output: {manifest_path}")
         print()
         print("Next steps:")
         print("1. Review the generated patch_manifest.json")
-        print("2. Upload all files to your GitHub repository")
+        print("2. Upload all files (and any new deltas/compressed variants/bundles) to your GitHub repository")
         print("3. Upload patch_manifest.json to repository root")
+        if mirrors:
+            print("   (and copy the same files and manifest to every mirror)")
         print("4. Test the patcher!")
         print()
 
@@ -153,6 +687,32 @@ def generate_manifest(source_folder, base_url_path="https://raw.githubuserconten
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="Generate patch_manifest.json from a folder of files")
+    parser.add_argument("source_folder", nargs="?", default="patch_files",
+                        help="folder containing the files to patch (default: patch_files)")
+    parser.add_argument("--version", default="1.0.0", help="version number for this patch")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="download URL of the source folder")
+    parser.add_argument("--previous", action="append", default=[], metavar="PATH",
+                        help="previous release folder to build binary deltas against, or previous "
+                             "patch_manifest.json whose deltas should be kept (may be repeated)")
+    parser.add_argument("--pfs-entries", action="store_true",
+                        help="record per-entry hashes of .s3d/.eqg archives for entry-level patching")
+    parser.add_argument("--compress", choices=["gzip", "zstd"],
+                        help="also publish compressed variants of files that compress well")
+    parser.add_argument("--chunk-large-files", action="store_true",
+                        help="record content-defined chunks of files over 1 MB for chunk-level patching")
+    parser.add_argument("--bundle-small-files", action="store_true",
+                        help="pack small files into bundles so a fresh install needs far fewer requests")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only rehash files whose size or modification time changed since the last run")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_HASH_JOBS,
+                        help=f"processes hashing files in parallel (default: {DEFAULT_HASH_JOBS})")
+    parser.add_argument("--mirror", action="append", default=[], metavar="URL",
+                        help="base URL of another copy of the release (the folder above the source folder); "
+                             "download URLs become relative to the mirrors (may be repeated)")
+    parser.add_argument("--no-pause", action="store_true", help="don't wait for Enter before exiting")
+    args = parser.parse_args()
+
     print()
     print("RNGP Patcher - Manifest Generator v1.0")
     print("=" * 40)
@@ -162,7 +722,7 @@ def main():
     print("This tool will scan a folder and generate patch_manifest.json")
     print()
 
-    source_folder = "patch_files"
+    source_folder = args.source_folder
 
     if not source_folder:
         print("ERROR: No folder specified")
@@ -170,23 +730,26 @@ def main():
         return
 
     print()
-    version = "1.0.0"
+    version = args.version
 
     print()
-    base_url = "https://raw.githubusercontent.com/printbeast/rngp-patcher/master/patch_files"
+    base_url = args.base_url
 
     print()
     print("Generating manifest...")
     print()
 
-    manifest = generate_manifest(source_folder, base_url, version)
+    manifest = generate_manifest(source_folder, base_url, version, args.previous, args.pfs_entries,
+                                 args.compress, args.bundle_small_files, args.incremental, args.jobs,
+                                 args.chunk_large_files, args.mirror)
 
     if manifest:
         print("Done!")
     else:
         print("Failed to generate manifest")
 
-    input("\nPress Enter to exit...")
+    if not args.no_pause:
+        input("\nPress Enter to exit...")
 
 if __name__ == "__main__":
     main()
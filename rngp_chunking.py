@@ -0,0 +1,79 @@
+"""
+RNGP Patcher - Content-Defined Chunking
+Split large files into chunks whose boundaries follow the content
+
+A chunk ends right after the first occurrence of a two byte marker past
+the minimum chunk size (or at the maximum size). Because a boundary only
+depends on the bytes at it, inserting or removing data early in a file
+moves the boundaries after the edit along with the data instead of
+shifting every fixed-size block. Two versions of a file therefore share
+most of their chunks, whatever versions they are. The files that get
+chunked (.s3d/.eqg archives, music) hold compressed data, so the marker
+turns up about once every 64 KB.
+
+Finding the marker is a bytes.find() in C, and files are streamed through
+a buffer of READ_SIZE, so chunking costs little more than hashing and
+doesn't hold the GIL against the download threads for long.
+
+The manifest generator records the chunks of large files (offset, length
+and MD5). The patcher chunks the player's current copy the same way,
+reuses every chunk it already has and fetches the rest from the normal
+file URL with HTTP Range requests (see rngp_transport.plan_segments).
+"""
+
+import hashlib
+
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# A chunk ends after this marker; in compressed data any two byte sequence
+# appears about once every 64 KB (on top of the minimum size)
+BOUNDARY_MARKER = b"\x8f\x3a"
+
+# Bytes read from the file at a time
+READ_SIZE = 1024 * 1024
+
+
+def iter_chunks(f):
+    """Yield the content-defined chunks of binary file f as (offset, memoryview)"""
+    buf = b""
+    pos = 0
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buf) - pos < MAX_CHUNK_SIZE:
+            data = f.read(READ_SIZE)
+            eof = not data
+            buf = buf[pos:] + data
+            pos = 0
+            continue
+        if pos == len(buf):
+            return
+        end = min(pos + MAX_CHUNK_SIZE, len(buf))
+        found = buf.find(BOUNDARY_MARKER, pos + MIN_CHUNK_SIZE - len(BOUNDARY_MARKER), end)
+        cut = found + len(BOUNDARY_MARKER) if found >= 0 else end
+        yield offset, memoryview(buf)[pos:cut]
+        offset += cut - pos
+        pos = cut
+
+
+def file_chunks(path):
+    """
+    Manifest description of a file's chunks.
+
+    Returns a list of {"offset", "length", "md5"} dicts in file order.
+    """
+    with open(path, 'rb') as f:
+        return [{
+            "offset": offset,
+            "length": len(chunk),
+            "md5": hashlib.md5(chunk).hexdigest()
+        } for offset, chunk in iter_chunks(f)]
+
+
+def local_chunk_index(path):
+    """Map MD5 of each chunk of a local file -> (offset, length)"""
+    index = {}
+    for chunk in file_chunks(path):
+        index.setdefault(chunk["md5"], (chunk["offset"], chunk["length"]))
+    return index
@@ -0,0 +1,113 @@
+"""
+RNGP Patcher - Command Line
+Check or patch game directories without a window, with JSON progress output
+
+Usage:
+    python rngp_cli.py check  GAME_DIR [GAME_DIR ...]
+    python rngp_cli.py patch  GAME_DIR [GAME_DIR ...]
+    python rngp_cli.py verify GAME_DIR [GAME_DIR ...]   (check with a full rehash)
+
+check and patch use --verify-mode (default: standard, see rngp_engine).
+
+Every engine event is written to stdout as one JSON object per line, with
+the game directory and a timestamp added, e.g.
+    {"event": "log", "level": "INFO", "message": "...", "game_path": "...", "time": 1700000000.0}
+    {"event": "progress", "done": 3, "failed": 0, "total": 40, ...}
+    {"event": "verify", "done": 120, "total": 900, ...}   (hashing local files)
+    {"event": "ready", "optional_files": 55, ...}   (required files installed)
+Each directory ends with a "result" event carrying the summary returned by
+PatchEngine.check()/patch(), or an "error" event.
+
+Exit code: 0 if every directory is (now) up to date, 2 if a check found
+updates or some files failed to patch, 1 if a directory could not be
+checked or patched at all.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+from rngp_engine import (DEFAULT_DOWNLOAD_WORKERS, DEFAULT_MANIFEST_URL, MAX_DOWNLOAD_WORKERS, VERIFY_FULL,
+                         VERIFY_MODES, VERIFY_STANDARD, PatchEngine)
+
+
+class JsonEventWriter:
+    """Writes engine events as JSON lines (events arrive from several threads)"""
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self.game_path = None
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        event = dict(event, game_path=self.game_path, time=round(time.time(), 3))
+        line = json.dumps(event)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+
+def run(command, game_path, engine, writer, verify_mode=VERIFY_STANDARD):
+    """Run one command on one game directory and return its exit code"""
+    writer.game_path = game_path
+    engine.game_path = game_path
+    engine.verify_mode = VERIFY_FULL if command == "verify" else verify_mode
+    try:
+        if command == "patch":
+            result = engine.patch()
+            code = 2 if result['failed'] else 0
+        else:
+            result = engine.check()
+            code = 0 if result['up_to_date'] else 2
+    except Exception as e:
+        writer({'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+        return 1
+    writer(dict(result, event='result', command=command))
+    return code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or patch RNGP game directories")
+    parser.add_argument("command", choices=["check", "patch", "verify"])
+    parser.add_argument("game_paths", nargs="+", metavar="GAME_DIR")
+    parser.add_argument("--manifest-url", default=DEFAULT_MANIFEST_URL,
+                        help="manifest to patch against (\"patch_manifest.json\" for a local file)")
+    parser.add_argument("--manifest-mirror", action="append", default=[], metavar="URL",
+                        help="other copy of the manifest, tried if --manifest-url fails (may be repeated)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS,
+                        help=f"parallel downloads (1-{MAX_DOWNLOAD_WORKERS})")
+    parser.add_argument("--verify-mode", choices=VERIFY_MODES, default=VERIFY_STANDARD,
+                        help="how check/patch compare files: quick (sizes and the hash cache only, "
+                             "escalates to standard on any mismatch), standard or full (rehash everything)")
+    parser.add_argument("--link-duplicates", action="store_true",
+                        help="hardlink files with identical content instead of copying them")
+    parser.add_argument("--trace", action="store_true",
+                        help="write phase and per-file timings to rngp_trace.jsonl in each game directory")
+    parser.add_argument("--optional-rate-limit", type=float, default=0, metavar="MB_PER_S",
+                        help="throttle optional files (loadscreens, music), which are downloaded after "
+                             "the required ones (default: unlimited)")
+    args = parser.parse_args()
+
+    writer = JsonEventWriter()
+    engine = PatchEngine(manifest_url=args.manifest_url,
+                         download_workers=max(1, min(args.workers, MAX_DOWNLOAD_WORKERS)),
+                         link_duplicates=args.link_duplicates, trace=args.trace, on_event=writer,
+                         manifest_mirrors=args.manifest_mirror,
+                         optional_rate_limit=args.optional_rate_limit * 1024 * 1024 or None)
+    codes = set()
+    try:
+        for game_path in args.game_paths:
+            codes.add(run(args.command, game_path, engine, writer, args.verify_mode))
+    except KeyboardInterrupt:
+        # The engine has stopped its downloads; partial files resume on the next run
+        writer({'event': 'error', 'error': "cancelled"})
+        codes.add(1)
+    finally:
+        engine.close()
+    sys.exit(1 if 1 in codes else max(codes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+RNGP Patcher - Binary Deltas
+Create and apply copy/add deltas between two versions of a file
+
+A delta is a list of operations that rebuild the new file from the old one:
+COPY a byte range from the old file, or ADD literal bytes carried in the
+delta. The operation stream is LZMA compressed, so the literal data costs
+roughly what the changed bytes would cost in a compressed archive.
+
+Format:
+    b"RNGPDLT1" | old_size (u64) | new_size (u64) | lzma(ops)
+    ops: b"C" offset (u64) length (u32)   copy from old file
+         b"A" length (u32) data           literal bytes
+         b"E"                              end of delta
+
+Only the standard library is used so the patcher stays a single exe.
+"""
+
+import lzma
+import struct
+
+MAGIC = b"RNGPDLT1"
+HEADER = struct.Struct("<QQ")
+COPY_OP = struct.Struct("<QI")
+ADD_OP = struct.Struct("<I")
+
+# Size of the old-file blocks that are indexed for matching. Shorter
+# blocks find more matches but make the index bigger and slower to build.
+BLOCK_SIZE = 64
+
+# Longest single COPY/ADD operation (keeps lengths within u32)
+MAX_OP_LENGTH = 1 << 30
+
+COPY_BUFFER_SIZE = 256 * 1024
+
+
+class DeltaError(Exception):
+    """The delta is corrupt or does not belong to the given old file"""
+
+
+def _match_length(old, old_pos, new, new_pos):
+    """Length of the common run starting at old[old_pos] and new[new_pos]"""
+    limit = min(len(old) - old_pos, len(new) - new_pos, MAX_OP_LENGTH)
+    length = 0
+    step = 4096
+    while step:
+        while length + step <= limit and \
+                old[old_pos + length:old_pos + length + step] == new[new_pos + length:new_pos + length + step]:
+            length += step
+        step //= 8
+    while length < limit and old[old_pos + length] == new[new_pos + length]:
+        length += 1
+    return length
+
+
+def make_delta(old, new, block_size=BLOCK_SIZE):
+    """Return a delta (bytes) that turns old into new"""
+    # Index every aligned block of the old file by its content
+    index = {}
+    for offset in range(0, len(old) - block_size + 1, block_size):
+        index.setdefault(old[offset:offset + block_size], offset)
+
+    ops = bytearray()
+    literal_start = 0
+    pos = 0
+    last_old_end = None
+
+    def emit_literal(end):
+        start = literal_start
+        while start < end:
+            length = min(end - start, MAX_OP_LENGTH)
+            ops.extend(b"A" + ADD_OP.pack(length))
+            ops.extend(new[start:start + length])
+            start += length
+
+    end = len(new) - block_size
+    while pos <= end:
+        # Cheap guess first: edits rarely move the data that follows them
+        old_pos = None
+        if last_old_end is not None and new[pos:pos + block_size] == old[last_old_end:last_old_end + block_size]:
+            old_pos = last_old_end
+        else:
+            old_pos = index.get(new[pos:pos + block_size])
+        if old_pos is None:
+            pos += 1
+            continue
+
+        # Grow the match backwards into pending literal bytes, then forwards
+        back = 0
+        while pos - back > literal_start and old_pos - back > 0 and \
+                new[pos - back - 1] == old[old_pos - back - 1]:
+            back += 1
+        pos -= back
+        old_pos -= back
+        length = _match_length(old, old_pos, new, pos)
+
+        emit_literal(pos)
+        ops.extend(b"C" + COPY_OP.pack(old_pos, length))
+        pos += length
+        literal_start = pos
+        last_old_end = old_pos + length
+
+    emit_literal(len(new))
+    ops.extend(b"E")
+
+    return MAGIC + HEADER.pack(len(old), len(new)) + lzma.compress(bytes(ops), preset=6)
+
+
+def apply_delta(old_file, delta, out_file, hasher=None):
+    """
+    Rebuild the new file from old_file (binary file object) and delta (bytes).
+
+    Output is written to out_file and, if given, fed to hasher. Raises
+    DeltaError if the delta is malformed or was made for a different old file.
+    """
+    header_end = len(MAGIC) + HEADER.size
+    if delta[:len(MAGIC)] != MAGIC:
+        raise DeltaError("not an RNGP delta")
+    old_size, new_size = HEADER.unpack(delta[len(MAGIC):header_end])
+
+    old_file.seek(0, 2)
+    if old_file.tell() != old_size:
+        raise DeltaError(f"delta expects a {old_size} byte base file")
+
+    try:
+        ops = lzma.decompress(delta[header_end:])
+    except lzma.LZMAError as e:
+        raise DeltaError(f"corrupt delta: {e}")
+
+    def write(data):
+        out_file.write(data)
+        if hasher is not None:
+            hasher.update(data)
+
+    written = 0
+    pos = 0
+    try:
+        while True:
+            op = ops[pos:pos + 1]
+            pos += 1
+            if op == b"C":
+                offset, length = COPY_OP.unpack_from(ops, pos)
+                pos += COPY_OP.size
+                if offset + length > old_size:
+                    raise DeltaError("copy outside of base file")
+                old_file.seek(offset)
+                while length:
+                    data = old_file.read(min(length, COPY_BUFFER_SIZE))
+                    if not data:
+                        raise DeltaError("base file ended early")
+                    write(data)
+                    written += len(data)
+                    length -= len(data)
+            elif op == b"A":
+                (length,) = ADD_OP.unpack_from(ops, pos)
+                pos += ADD_OP.size
+                data = ops[pos:pos + length]
+                if len(data) != length:
+                    raise DeltaError("truncated literal data")
+                pos += length
+                write(data)
+                written += length
+            elif op == b"E":
+                break
+            else:
+                raise DeltaError(f"unknown operation {op!r}")
+    except struct.error:
+        raise DeltaError("truncated delta")
+
+    if written != new_size:
+        raise DeltaError(f"delta produced {written} bytes, expected {new_size}")
+    return written
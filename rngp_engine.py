@@ -0,0 +1,1484 @@
+"""
+RNGP Patcher - Patch Engine
+Fetch manifest -> plan -> download -> verify -> clean up, without any UI
+
+PatchEngine does all of the patcher's work on a game directory and reports
+what it is doing through a single callback, so the same code drives the Tk
+window (rngp_patcher.py), the command line (rngp_cli.py) and scripts that
+verify many installs at once.
+
+The callback receives one dict per event:
+    {"event": "log", "level": "INFO", "message": "..."}
+        level is INFO, SUCCESS, WARNING or ERROR
+    {"event": "progress", "done": 12, "failed": 0, "total": 40,
+     "bytes_done": ..., "bytes_total": ..., "rate": ..., "eta": ...}
+        during patch(): files finished, bytes written out of the manifest
+        sizes of the files being updated, network throughput (bytes/s,
+        averaged over the last few seconds) and seconds left (None until
+        known). Sent at most every PROGRESS_INTERVAL and after each file.
+    {"event": "verify", "done": 120, "total": 900, "bytes_done": ..., "bytes_total": ...}
+        while local files are being hashed (files and bytes hashed so far),
+        at most every PROGRESS_INTERVAL and once at the end
+    {"event": "ready", "optional_files": 55, "optional_bytes": ...}
+        during patch(), once every required file is installed and
+        verified: the game can be started while the optional files
+        (manifest "priority": "optional") keep downloading, throttled to
+        optional_rate_limit bytes/s if set
+
+check() and patch() return a summary dict and raise on fatal errors
+(urllib.error.HTTPError/URLError for network failures, ManifestError for
+an unreadable manifest), or PatchCancelled once cancel() is called from
+another thread. Callbacks run on whichever thread is doing the
+work, including the download pool threads.
+
+With trace enabled, every check()/patch() also writes its phase and
+per-file timings to rngp_trace.jsonl in the game directory (rngp_trace).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from rngp_chunking import local_chunk_index
+from rngp_delta import DeltaError, apply_delta
+from rngp_hashing import StreamingMD5, file_md5, is_text_path
+from rngp_manifest import deleted_entries
+from rngp_mirrors import MirrorSet
+from rngp_pfs import PFSError, local_segment_index
+from rngp_trace import TRACE_FILE, Tracer
+from rngp_transport import (PART_SUFFIX, SUPPORTED_ENCODINGS, ConnectionPool, HashMismatchError, RateLimiter,
+                            iter_bundle_members, plan_bundle_fetches, discard_partial, download_compressed,
+                            download_multi_source, download_resumable, download_segments, plan_segments)
+
+DEFAULT_MANIFEST_URL = "https://raw.githubusercontent.com/printbeast/rngp-patcher/master/patch_manifest.json"
+
+# A manifest_url equal to this loads the manifest from the working directory
+LOCAL_MANIFEST = "patch_manifest.json"
+
+# Local hash cache stored in the game directory (see HashIndex)
+HASH_INDEX_FILE = ".rngp_hash_index.json"
+
+# Last downloaded manifest plus its ETag/Last-Modified, for conditional requests
+MANIFEST_CACHE_FILE = ".rngp_manifest_cache.json"
+
+# Read size when streaming downloads to disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Files at least this big are fetched from several mirrors at once (when
+# the manifest lists more than one mirror with Range support)
+MULTI_SOURCE_MIN_SIZE = 8 * 1024 * 1024
+MULTI_SOURCE_MAX_MIRRORS = 4
+
+# Required files in these manifest groups are downloaded before other required files
+FIRST_GROUPS = ("core", "global")
+
+# Progress events are sent at most this often (plus once per finished file)
+PROGRESS_INTERVAL = 0.25
+
+# Throughput and ETA are averaged over this many seconds
+THROUGHPUT_WINDOW = 5.0
+
+# Entry-level archive patching is skipped when more than this fraction of
+# the archive would have to be downloaded anyway
+SEGMENT_MAX_RATIO = 0.75
+
+# How thoroughly check()/patch() compare the game directory with the manifest:
+#   quick    - stat only: size and the hash index's record of each file; any
+#              file that doesn't match escalates to standard. Never reads a file
+#   standard - hash the files whose size/mtime/inode changed since they were
+#              last hashed (hash index)
+#   full     - rehash every file, ignoring the hash index ("repair install")
+VERIFY_QUICK = "quick"
+VERIFY_STANDARD = "standard"
+VERIFY_FULL = "full"
+VERIFY_MODES = (VERIFY_QUICK, VERIFY_STANDARD, VERIFY_FULL)
+
+# Threads hashing local files (hashlib releases the GIL on large reads)
+HASH_WORKERS = min(os.cpu_count() or 1, 8)
+
+# Number of parallel downloads (override with download_workers in patcher_config.ini)
+DEFAULT_DOWNLOAD_WORKERS = 4
+MAX_DOWNLOAD_WORKERS = 16
+
+
+
+LocalStat = namedtuple('LocalStat', 'st_size st_mtime_ns st_ino')
+
+
+class HashIndex:
+    """
+    Persistent cache of local file hashes, keyed by manifest-relative path.
+    
+    Each entry remembers the size, mtime_ns and inode the file had when it
+    was last hashed. If all three still match, the stored MD5 is reused
+    instead of reading the whole file again.
+    
+    clean_manifest holds the digest of the manifest the install was last
+    fully verified against (nothing to update, nothing failed). It is
+    cleared as soon as a comparison finds files to update.
+    
+    With trusted set to False (full verify) lookups miss and the install
+    never counts as clean, but the entries are still loaded and saved, so
+    a full verify only refreshes the index instead of truncating it.
+    """
+    VERSION = 1
+    
+    def __init__(self, game_path):
+        self.index_path = Path(game_path) / HASH_INDEX_FILE
+        self.entries = {}
+        self.clean_manifest = None
+        self.trusted = True
+        self.dirty = False
+        self.lock = threading.Lock()
+    
+    def load(self):
+        """Load the index from disk, starting empty if it is missing or unreadable"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.entries = data.get('files', {})
+                self.clean_manifest = data.get('clean_manifest')
+        except (OSError, ValueError):
+            self.entries = {}
+            self.clean_manifest = None
+        self.dirty = False
+    
+    def save(self):
+        """Write the index back to disk if anything changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'version': self.VERSION, 'clean_manifest': self.clean_manifest, 'files': self.entries}
+            tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.index_path)
+                self.dirty = False
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _stat_key(st):
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+    
+    def lookup(self, rel_path, st):
+        """Return the cached MD5 for rel_path if its stat data is unchanged"""
+        if not self.trusted:
+            return None
+        with self.lock:
+            entry = self.entries.get(rel_path)
+        if entry and entry.get('stat') == self._stat_key(st):
+            return entry.get('md5')
+        return None
+    
+    def record(self, rel_path, st, md5):
+        """Remember the MD5 computed for rel_path at the given stat"""
+        with self.lock:
+            self.entries[rel_path] = {'stat': self._stat_key(st), 'md5': md5}
+            self.dirty = True
+    
+    def forget(self, rel_path):
+        """Drop rel_path from the index (e.g. after deleting the file)"""
+        with self.lock:
+            if self.entries.pop(rel_path, None) is not None:
+                self.dirty = True
+    
+    def is_clean_for(self, manifest_digest):
+        """True if the install was last verified up to date against this manifest"""
+        return self.trusted and manifest_digest is not None and self.clean_manifest == manifest_digest
+    
+    def mark_clean(self, manifest_digest):
+        with self.lock:
+            if self.clean_manifest != manifest_digest:
+                self.clean_manifest = manifest_digest
+                self.dirty = True
+    
+    def mark_dirty(self):
+        self.mark_clean(None)
+
+
+def is_optional(file_info):
+    """True for manifest files the game can start without (loadscreens, music, ...)"""
+    return file_info.get('priority') == 'optional'
+
+
+def format_size(num_bytes):
+    """Human readable size, e.g. 532 KB or 12.4 MB"""
+    if num_bytes < 1024 * 1024:
+        return f"{num_bytes / 1024:.0f} KB"
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def format_duration(seconds):
+    """Seconds as m:ss or h:mm:ss"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class _CountingHasher:
+    """Feeds a hasher and reports the bytes it sees as download progress"""
+    
+    def __init__(self, hasher, on_bytes):
+        self._hasher = hasher
+        self._on_bytes = on_bytes
+    
+    def update(self, data):
+        self._hasher.update(data)
+        self._on_bytes(len(data))
+    
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+class ManifestError(Exception):
+    """The patch manifest could not be loaded"""
+
+
+class PatchCancelled(BaseException):
+    """
+    check()/patch() was stopped by cancel().
+    
+    Derives from BaseException, like KeyboardInterrupt, so the per-file
+    "except Exception" fallbacks let it through instead of trying the next
+    mirror or download method.
+    """
+
+
+class PatchEngine:
+    """
+    Patches one game directory against a manifest.
+    
+    Settings are plain attributes and may be changed between runs. The
+    result of check() is kept and reused by the next patch() as long as
+    nothing relevant changed in between.
+    """
+    
+    def __init__(self, game_path="", manifest_url=DEFAULT_MANIFEST_URL, download_workers=DEFAULT_DOWNLOAD_WORKERS,
+                 link_duplicates=False, verify_mode=VERIFY_STANDARD, trace=False, on_event=None, manifest_mirrors=(),
+                 optional_rate_limit=None):
+        self.game_path = game_path
+        self.manifest_url = manifest_url
+        # Other copies of the manifest, tried in order if manifest_url fails
+        self.manifest_mirrors = list(manifest_mirrors)
+        self.download_workers = download_workers
+        self.link_duplicates = link_duplicates
+        # One of VERIFY_MODES
+        self.verify_mode = verify_mode
+        self.trace = trace
+        # Bytes/s for optional files once the game is ready to play (None = unlimited)
+        self.optional_rate_limit = optional_rate_limit
+        self.on_event = on_event
+        self.hash_index = None
+        
+        # Timing trace of the current run (disabled unless trace is set)
+        self.tracer = Tracer()
+        
+        # Result of the last check(), reused by patch()
+        self.session_plan = None
+        
+        # Keep-alive HTTP connections shared by manifest and file downloads
+        self.http = ConnectionPool()
+        
+        # Download mirrors of the current manifest (see rngp_mirrors)
+        self.mirrors = MirrorSet()
+        
+        # Throttles optional files during patch() when optional_rate_limit is set
+        self._optional_limiter = None
+        
+        # Set by cancel(); checked between files and between received chunks
+        self._cancelled = threading.Event()
+    
+    def emit(self, event, **fields):
+        """Send an event to the on_event callback"""
+        if self.on_event is not None:
+            fields['event'] = event
+            self.on_event(fields)
+    
+    def log(self, message, level="INFO"):
+        self.emit('log', level=level, message=message)
+    
+    def close(self):
+        """Close the pooled HTTP connections"""
+        self.http.close()
+    
+    def cancel(self):
+        """
+        Stop the running check()/patch() soon (safe to call from any thread).
+        
+        Downloads stop within one chunk, files already installed stay, and
+        partly downloaded files keep their .part file so the next patch()
+        resumes them. The run raises PatchCancelled.
+        
+        The cancel stays in effect until reset_cancel(), so a run that
+        hasn't started yet (e.g. still queued behind a check) is stopped too.
+        """
+        self._cancelled.set()
+    
+    def reset_cancel(self):
+        """Forget an earlier cancel() so the next check()/patch() runs (call it when queueing a run)"""
+        self._cancelled.clear()
+    
+    def _check_cancelled(self):
+        if self._cancelled.is_set():
+            raise PatchCancelled()
+    
+    @contextmanager
+    def _trace_run(self, action):
+        """Trace one check()/patch() run into the game directory if tracing is on"""
+        if self.trace and self.game_path and os.path.isdir(self.game_path):
+            self.tracer = Tracer(Path(self.game_path) / TRACE_FILE)
+            self.log(f"Writing timing trace to {TRACE_FILE} (session {self.tracer.session})")
+        try:
+            with self.tracer.span(action, "run", workers=self.download_workers, verify_mode=self.verify_mode,
+                                  manifest_url=self.manifest_url) as span:
+                yield span
+        finally:
+            self.tracer.close()
+            self.tracer = Tracer()
+    
+    def _load_manifest(self):
+        """
+        Fetch and parse the manifest.
+        
+        Returns (manifest, digest of the manifest text, unchanged since the
+        cached copy).
+        """
+        if self.manifest_url == LOCAL_MANIFEST:
+            # Load local manifest file
+            try:
+                with open(self.manifest_url, 'r') as f:
+                    manifest_data = f.read()
+                manifest = json.loads(manifest_data)
+            except Exception as e:
+                raise ManifestError(f"Could not load local manifest: {e}")
+            manifest_unchanged = False
+            manifest_url = None
+        else:
+            # Load from remote URL (or the local cache if it hasn't changed)
+            manifest_urls = [self.manifest_url] + [url for url in self.manifest_mirrors if url != self.manifest_url]
+            for n, manifest_url in enumerate(manifest_urls):
+                try:
+                    manifest_data, manifest_unchanged = self._fetch_remote_manifest(manifest_url)
+                    break
+                except urllib.error.URLError as e:
+                    if n + 1 == len(manifest_urls):
+                        raise
+                    self.log(f"Manifest download from {urllib.parse.urlsplit(manifest_url).netloc} failed ({e}) "
+                             f"- trying {urllib.parse.urlsplit(manifest_urls[n + 1]).netloc}", "WARNING")
+            try:
+                manifest = json.loads(manifest_data)
+            except ValueError as e:
+                raise ManifestError(f"Manifest is not valid JSON: {e}")
+        self._configure_mirrors(manifest, manifest_url)
+        manifest_digest = hashlib.md5(manifest_data.encode('utf-8')).hexdigest()
+        return manifest, manifest_digest, manifest_unchanged
+    
+    def _configure_mirrors(self, manifest, manifest_url):
+        """Take the manifest's mirror list; relative URLs otherwise resolve against manifest_url"""
+        probe_path = None
+        sized = [f for f in manifest.get('files', []) if f.get('size', 0) > 0 and f.get('url')]
+        if sized:
+            probe_path = min(sized, key=lambda f: f['size'])['url']
+        self.mirrors.configure(manifest.get('mirrors'), manifest_url)
+        if probe_path is not None:
+            self.mirrors.probe_path = self.mirrors.relative(probe_path)
+    
+    def _probe_mirrors(self):
+        """Measure the mirrors once per session, before the first download"""
+        if len(self.mirrors.mirrors) < 2 or self.mirrors.probed:
+            return
+        with self.tracer.span('probe_mirrors'):
+            self.mirrors.probe(self.http)
+        self.log(f"Mirrors: {self.mirrors.describe()}")
+    
+    def _with_mirrors(self, url, fetch, what):
+        """
+        Run fetch(absolute url) on each mirror of url, best first, until one succeeds.
+        
+        Any error (connection, HTTP status, hash mismatch from a stale
+        mirror) moves on to the next mirror; the last error is raised when
+        every mirror failed.
+        """
+        candidates = self.mirrors.candidates(url)
+        for n, candidate in enumerate(candidates):
+            try:
+                return fetch(candidate)
+            except Exception as e:
+                self.mirrors.report_failure(candidate)
+                if n + 1 == len(candidates):
+                    raise
+                self.log(f"{what}: {urllib.parse.urlsplit(candidate).netloc} failed ({e}) "
+                         f"- trying {urllib.parse.urlsplit(candidates[n + 1]).netloc}", "WARNING")
+    
+    def check(self):
+        """
+        Compare the game directory with the manifest without changing any game file.
+        
+        Returns {"up_to_date", "files_to_update" (paths), "download_bytes",
+        "optional_bytes" (part of download_bytes that is optional),
+        "old_files" (paths that patch() would delete)}.
+        """
+        self._check_cancelled()
+        with self._trace_run('check'):
+            return self._check()
+    
+    def _check(self):
+        self.log("Fetching manifest...")
+        with self.tracer.span('manifest'):
+            manifest, manifest_digest, manifest_unchanged = self._load_manifest()
+        
+        self._open_hash_index()
+        with self.tracer.span('scan_game_dir') as span:
+            snapshot = self._scan_game_dir(manifest)
+            span['files'] = len(snapshot)
+        if manifest_unchanged and self._install_is_clean(manifest, manifest_digest, snapshot):
+            self.log("Manifest unchanged since the last verified check - skipping file comparison")
+            self.log("Your game is up to date!", "SUCCESS")
+            return {'up_to_date': True, 'files_to_update': [], 'download_bytes': 0, 'optional_bytes': 0, 'old_files': []}
+        
+        # Check for old files that will be deleted (smart check with hashes)
+        with self.tracer.span('find_old_files'):
+            found_old_files = self._find_old_files(manifest, snapshot)
+        
+        if found_old_files:
+            self.log(f"Found {len(found_old_files)} old files that will be deleted during patching", "WARNING")
+        
+        # Get list of files that need updating
+        with self.tracer.span('compare') as span:
+            files_to_update = self._compare_files(manifest, snapshot)
+            span['files_to_update'] = len(files_to_update)
+        if not files_to_update and not found_old_files:
+            self.hash_index.mark_clean(manifest_digest)
+        self.hash_index.save()
+        
+        # Keep the result so patch() doesn't have to redo all of this
+        self.session_plan = {
+            'game_path': self.game_path,
+            'manifest': manifest,
+            'manifest_digest': manifest_digest,
+            'files_to_update': files_to_update,
+            'old_files': found_old_files,
+            'verify_mode': self.verify_mode,
+            'stats': snapshot
+        }
+        
+        total_size = sum(f['size'] for f in files_to_update)
+        optional_size = sum(f['size'] for f in files_to_update if is_optional(f))
+        if not files_to_update and not found_old_files:
+            self.log("Your game is up to date!", "SUCCESS")
+        elif files_to_update:
+            self.log(f"Found {len(files_to_update)} files to update ({total_size / (1024 * 1024):.2f} MB)", "SUCCESS")
+        
+        return {
+            'up_to_date': not files_to_update and not found_old_files,
+            'files_to_update': [f['path'] for f in files_to_update],
+            'download_bytes': total_size,
+            'optional_bytes': optional_size,
+            'old_files': found_old_files
+        }
+    
+    def patch(self):
+        """
+        Bring the game directory up to date with the manifest.
+        
+        Returns {"up_to_date" (nothing had to be done), "files" (files
+        installed or attempted), "failed"}.
+        """
+        self._check_cancelled()
+        with self._trace_run('patch'):
+            return self._patch()
+    
+    def _patch(self):
+        # Download manifest from GitHub
+        self.log("Downloading manifest...")
+        with self.tracer.span('manifest'):
+            manifest, manifest_digest, manifest_unchanged = self._load_manifest()
+        
+        self._open_hash_index()
+        with self.tracer.span('scan_game_dir') as span:
+            snapshot = self._scan_game_dir(manifest)
+            span['files'] = len(snapshot)
+        if manifest_unchanged and self._install_is_clean(manifest, manifest_digest, snapshot):
+            self.log("Manifest unchanged since the last verified patch - nothing to do", "SUCCESS")
+            return {'up_to_date': True, 'files': 0, 'failed': 0}
+        
+        plan = self._take_session_plan(manifest_digest, snapshot)
+        if plan is not None:
+            self.log("Using the results of the last update check")
+            
+            # Delete the old files the check found, then download its file list
+            with self.tracer.span('delete_old_files'):
+                self._delete_old_files(manifest, plan['old_files'])
+            files_to_update = plan['files_to_update']
+            if files_to_update:
+                self.hash_index.mark_dirty()
+        else:
+            # Delete old files first (now checks hashes before deleting)
+            with self.tracer.span('delete_old_files'):
+                self._delete_old_files(manifest, snapshot=snapshot)
+            
+            # Get files to update (deleting never touches manifest files, so the snapshot still holds)
+            with self.tracer.span('compare') as span:
+                files_to_update = self._compare_files(manifest, snapshot)
+                span['files_to_update'] = len(files_to_update)
+        self.hash_index.save()
+        
+        if not files_to_update:
+            self.hash_index.mark_clean(manifest_digest)
+            self.hash_index.save()
+            self.log("No files need updating!", "SUCCESS")
+            return {'up_to_date': True, 'files': 0, 'failed': 0}
+        
+        # Group files with identical content so each unique blob is fetched once
+        groups = {}
+        for file_info in files_to_update:
+            groups.setdefault(file_info.get('md5') or file_info['path'], []).append(file_info)
+        
+        # Up-to-date local files can seed identical files without any download
+        stale_paths = {f['path'] for f in files_to_update}
+        self._local_sources = {}
+        for file_info in manifest.get('files', []):
+            if file_info.get('md5') and file_info['path'] not in stale_paths:
+                self._local_sources.setdefault(file_info['md5'], file_info['path'])
+        
+        # Small files packed into bundles are fetched a bundle at a time
+        bundle_jobs, single_groups = self._plan_bundle_jobs(manifest, groups)
+        
+        required_jobs, optional_jobs = self._schedule_jobs(bundle_jobs, single_groups)
+        
+        total_files = len(files_to_update)
+        workers = min(self.download_workers, len(required_jobs) + len(optional_jobs))
+        self.log(f"Downloading {total_files} files ({len(groups)} unique) from GitHub ({workers} at a time)...")
+        if bundle_jobs:
+            bundled = sum(len(members) for _, members in bundle_jobs)
+            self.log(f"{bundled} small files will be unpacked from {len(bundle_jobs)} bundles")
+        optional_files = [f for f in files_to_update if is_optional(f)]
+        if optional_files and len(optional_files) < total_files:
+            self.log(f"{total_files - len(optional_files)} required files first, then {len(optional_files)} optional files")
+        
+        # Shared counters for the download workers (guarded by progress_lock)
+        self._download_state = {
+            'started': 0, 'done': 0, 'failed': 0, 'total': total_files,
+            'bytes_done': 0, 'bytes_total': sum(f['size'] for f in files_to_update),
+            'file_bytes': {},           # bytes counted so far per path
+            'samples': deque(),         # (time, network bytes, bytes_done) for throughput
+            'last_emit': 0.0
+        }
+        self._progress_lock = threading.Lock()
+        
+        self._probe_mirrors()
+        
+        # Optional files wait for the required ones, then share a bandwidth cap
+        required_done = threading.Event()
+        self._optional_limiter = RateLimiter(self.optional_rate_limit) if self.optional_rate_limit else None
+        
+        def optional_job(func, *args):
+            required_done.wait()
+            return func(*args)
+        
+        # Download files from GitHub in parallel
+        self.http.reset_stats()
+        started = time.monotonic()
+        with self.tracer.span('download', files=total_files, workers=workers) as span:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download") as pool:
+                required_futures = [pool.submit(func, *args) for func, args in required_jobs]
+                optional_futures = [pool.submit(optional_job, func, *args) for func, args in optional_jobs]
+                try:
+                    try:
+                        for future in required_futures:
+                            future.result()
+                    finally:
+                        required_done.set()
+                    if not self._download_state['failed']:
+                        self._ready_to_play(optional_files, time.monotonic() - started)
+                    for future in optional_futures:
+                        future.result()
+                except (PatchCancelled, KeyboardInterrupt):
+                    # Jobs not started yet are dropped; running ones stop at their next chunk
+                    self._cancelled.set()
+                    for future in required_futures + optional_futures:
+                        future.cancel()
+                    self.hash_index.save()
+                    self.log(f"Patching cancelled after {self._download_state['done']} of {total_files} files "
+                             f"- partly downloaded files will resume next time", "WARNING")
+                    raise
+            span.update(self.http.stats())
+        
+        if not self._download_state['failed']:
+            self.hash_index.mark_clean(manifest_digest)
+        self.hash_index.save()
+        
+        stats = self.http.stats()
+        elapsed = time.monotonic() - started
+        self.log(
+            f"HTTP: {stats['requests']} requests over {stats['connections_opened']} connections "
+            f"({stats['connections_reused']} reused), {format_size(stats['bytes_received'])} in "
+            f"{format_duration(elapsed)} ({format_size(stats['bytes_received'] / max(elapsed, 0.001))}/s)"
+        )
+        
+        failed = self._download_state['failed']
+        if failed:
+            self.log(f"Patching finished, but {failed} of {total_files} files failed - patch again to retry them",
+                     "WARNING")
+        else:
+            self.log("Patching completed successfully!", "SUCCESS")
+        return {'up_to_date': False, 'files': total_files, 'failed': failed}
+    
+    def _schedule_jobs(self, bundle_jobs, single_groups):
+        """
+        Order the download jobs: required before optional, FIRST_GROUPS first.
+        
+        Returns ([(func, args)] required, [(func, args)] optional). A content
+        group is optional only if every file in it is; bundles are split
+        into their required and optional members.
+        """
+        jobs = []
+        for bundle, members in bundle_jobs:
+            for optional in (False, True):
+                part = [m for m in members if all(is_optional(f) for f in m[2]) == optional]
+                if part:
+                    jobs.append((optional, [f for m in part for f in m[2]], (self._bundle_worker, (bundle, part))))
+        for group in single_groups:
+            jobs.append((all(is_optional(f) for f in group), group, (self._download_worker, (group,))))
+        
+        def rank(files):
+            return min(FIRST_GROUPS.index(f['group']) if f.get('group') in FIRST_GROUPS else len(FIRST_GROUPS)
+                       for f in files)
+        
+        jobs.sort(key=lambda job: (job[0], rank(job[1])))
+        return [job for optional, _, job in jobs if not optional], [job for optional, _, job in jobs if optional]
+    
+    def _ready_to_play(self, optional_files, elapsed):
+        """Announce that every required file is installed"""
+        optional_bytes = sum(f['size'] for f in optional_files)
+        if optional_files:
+            self.log(
+                f"Required files installed in {format_duration(elapsed)} - the game is ready to play. "
+                f"{len(optional_files)} optional files ({format_size(optional_bytes)}) continue in the background",
+                "SUCCESS"
+            )
+        self.emit('ready', optional_files=len(optional_files), optional_bytes=optional_bytes)
+    
+    def _compare_files(self, manifest, snapshot):
+        """Compare local files (as found by _scan_game_dir) with manifest, as thorough as verify_mode"""
+        files = manifest.get('files', [])
+        if self.verify_mode == VERIFY_QUICK:
+            anomalies = self._quick_anomalies(files, snapshot)
+            if not anomalies:
+                return []
+            self.log(f"Quick check: {len(anomalies)} files missing or changed on disk "
+                     f"- verifying with the hash index", "WARNING")
+        
+        # Missing files need no hashing, and neither do files the index vouches for
+        local_hashes = {}
+        to_hash = []
+        for file_info in files:
+            st = snapshot.get(os.path.normcase(file_info['path']))
+            if st is None:
+                self.hash_index.forget(file_info['path'])
+                local_hashes[file_info['path']] = ""
+                continue
+            local_hash = self.hash_index.lookup(file_info['path'], st)
+            if local_hash is None:
+                to_hash.append((file_info['path'], st))
+            else:
+                local_hashes[file_info['path']] = local_hash
+        local_hashes.update(self._hash_files(to_hash))
+        
+        files_to_update = [f for f in files if local_hashes[f['path']] != f.get('md5', '')]
+        if files_to_update:
+            self.hash_index.mark_dirty()
+        return files_to_update
+    
+    def _quick_anomalies(self, files, snapshot):
+        """
+        Manifest files whose stat data alone shows they may not be up to date.
+        
+        A file passes if it exists with the manifest size and the hash index
+        has the manifest MD5 for its current size, mtime and inode. Text files
+        may differ in size by their line endings, so only the index counts.
+        """
+        anomalies = []
+        for file_info in files:
+            st = snapshot.get(os.path.normcase(file_info['path']))
+            if st is None or (st.st_size != file_info['size'] and not is_text_path(file_info['path'])) or \
+                    self.hash_index.lookup(file_info['path'], st) != file_info.get('md5'):
+                anomalies.append(file_info['path'])
+        return anomalies
+    
+    def _hash_files(self, to_hash):
+        """
+        Hash [(rel_path, stat)] on HASH_WORKERS threads and record them in the hash index.
+        
+        Sends verify events as files finish. Returns {rel_path: md5}, with ""
+        for files that couldn't be read.
+        """
+        if not to_hash:
+            return {}
+        state = {'done': 0, 'bytes_done': 0, 'last_emit': 0.0}
+        lock = threading.Lock()
+        total_bytes = sum(st.st_size for _, st in to_hash)
+        game_path = Path(self.game_path)
+        if len(to_hash) > 1:
+            self.log(f"Hashing {len(to_hash)} files ({format_size(total_bytes)})...")
+        
+        def hash_one(rel_path, st):
+            self._check_cancelled()
+            with self.tracer.span('hash', 'file', path=rel_path, size=st.st_size):
+                local_hash = self._calculate_md5(game_path / rel_path)
+            if local_hash:
+                self.hash_index.record(rel_path, st, local_hash)
+            # Emitting under the lock keeps the events in order
+            with lock:
+                state['done'] += 1
+                state['bytes_done'] += st.st_size
+                now = time.monotonic()
+                if now - state['last_emit'] >= PROGRESS_INTERVAL or state['done'] == len(to_hash):
+                    state['last_emit'] = now
+                    self.emit('verify', done=state['done'], total=len(to_hash),
+                              bytes_done=state['bytes_done'], bytes_total=total_bytes)
+            return local_hash
+        
+        with self.tracer.span('hash_files', files=len(to_hash), bytes=total_bytes):
+            with ThreadPoolExecutor(max_workers=min(HASH_WORKERS, len(to_hash)), thread_name_prefix="hash") as pool:
+                futures = {rel_path: pool.submit(hash_one, rel_path, st) for rel_path, st in to_hash}
+                try:
+                    return {rel_path: future.result() for rel_path, future in futures.items()}
+                except (PatchCancelled, KeyboardInterrupt):
+                    self._cancelled.set()
+                    for future in futures.values():
+                        future.cancel()
+                    # Keep the hashes finished so far for the next run
+                    self.hash_index.save()
+                    raise
+    
+    def _install_is_clean(self, manifest, manifest_digest, snapshot):
+        """
+        True if the install was verified against this manifest and no file was touched since.
+        
+        Nothing is read: every manifest file in the snapshot must still have
+        the stat data recorded in the hash index, and no deleted file may exist.
+        """
+        if not self.hash_index.is_clean_for(manifest_digest):
+            return False
+        for file_info in manifest.get('files', []):
+            st = snapshot.get(os.path.normcase(file_info['path']))
+            if st is None or self.hash_index.lookup(file_info['path'], st) != file_info.get('md5'):
+                return False
+        return not self._find_old_files(manifest, snapshot)
+    
+    def _scan_game_dir(self, manifest):
+        """
+        Stat every manifest and deleted path with one os.scandir() per folder.
+        
+        Returns {os.path.normcase(path): LocalStat} for the paths that exist,
+        so lookups follow the file system's case rules. Folders without
+        any manifest path aren't read at all.
+        """
+        folders = {}
+        for rel_path in [f['path'] for f in manifest.get('files', [])] + \
+                [entry['path'] for entry in deleted_entries(manifest)]:
+            folder, _, name = rel_path.replace("\\", "/").rpartition("/")
+            folders.setdefault(folder, set()).add(os.path.normcase(name))
+        
+        game_path = Path(self.game_path)
+        snapshot = {}
+        for folder, names in folders.items():
+            try:
+                with os.scandir(game_path / folder) as entries:
+                    for entry in entries:
+                        if os.path.normcase(entry.name) not in names or not entry.is_file():
+                            continue
+                        st = entry.stat()
+                        # Windows fills st_ino from a real stat() only; DirEntry has it on request
+                        snapshot[os.path.normcase(f"{folder}/{entry.name}" if folder else entry.name)] = \
+                            LocalStat(st.st_size, st.st_mtime_ns, st.st_ino or entry.inode())
+            except OSError:
+                continue
+        return snapshot
+    
+    def _take_session_plan(self, manifest_digest, snapshot):
+        """
+        Return the last update check's plan if it still applies, else None.
+        
+        The plan is used at most once. It is discarded if the manifest changed,
+        a different game directory is selected, a more thorough verify mode
+        was picked after the check, or any relevant file was touched since.
+        """
+        plan, self.session_plan = self.session_plan, None
+        if plan is None:
+            return None
+        if plan['manifest_digest'] != manifest_digest or plan['game_path'] != self.game_path:
+            return None
+        if VERIFY_MODES.index(self.verify_mode) > VERIFY_MODES.index(plan['verify_mode']):
+            return None
+        if snapshot != plan['stats']:
+            self.log("Game files changed since the last update check - checking again")
+            return None
+        return plan
+    
+    def _load_manifest_cache(self):
+        cache_path = Path(self.game_path) / MANIFEST_CACHE_FILE
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _save_manifest_cache(self, cache):
+        cache_path = Path(self.game_path) / MANIFEST_CACHE_FILE
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            self.log(f"Could not cache manifest: {e}", "WARNING")
+    
+    def _fetch_remote_manifest(self, manifest_url):
+        """
+        Download the manifest with a conditional request.
+        
+        The last manifest is cached in the game directory with its ETag and
+        Last-Modified headers. If the server answers 304 Not Modified, the
+        cached copy is used and no body is transferred.
+        
+        Returns (manifest text, unchanged since the cached copy)
+        """
+        cache = self._load_manifest_cache()
+        if not cache or cache.get('url') != manifest_url or 'manifest' not in cache:
+            cache = None
+        
+        headers = {}
+        if cache:
+            if cache.get('etag'):
+                headers['If-None-Match'] = cache['etag']
+            if cache.get('last_modified'):
+                headers['If-Modified-Since'] = cache['last_modified']
+        
+        with self.http.request(manifest_url, headers=headers, timeout=10) as response:
+            if response.status == 304 and cache:
+                self.log("Manifest not modified - using cached copy")
+                return cache['manifest'], True
+            manifest_data = response.read().decode()
+            etag = response.getheader('ETag')
+            last_modified = response.getheader('Last-Modified')
+        
+        # Servers without conditional request support still tell us if it changed
+        unchanged = cache is not None and cache['manifest'] == manifest_data
+        self._save_manifest_cache({
+            'url': manifest_url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'manifest': manifest_data
+        })
+        return manifest_data, unchanged
+    
+    def _open_hash_index(self):
+        """Load the hash index for the current game directory"""
+        self.hash_index = HashIndex(self.game_path)
+        with self.tracer.span('load_hash_index'):
+            self.hash_index.load()
+        if self.verify_mode == VERIFY_FULL:
+            # Rehash everything, but keep the entries of files this run doesn't touch
+            self.hash_index.trusted = False
+            self.log("Full verify enabled - rehashing all files")
+    
+    def _local_md5(self, rel_path, snapshot=None):
+        """
+        Return the MD5 of a file in the game directory, or "" if it is missing.
+        
+        Uses the hash index when the file's size, mtime and inode are unchanged
+        since it was last hashed; otherwise hashes the file and updates the index.
+        The file is looked up in snapshot (from _scan_game_dir) if given.
+        """
+        file_path = Path(self.game_path) / rel_path
+        if snapshot is not None:
+            st = snapshot.get(os.path.normcase(rel_path))
+        else:
+            try:
+                st = file_path.stat()
+            except OSError:
+                st = None
+        if st is None:
+            self.hash_index.forget(rel_path)
+            return ""
+        
+        local_hash = self.hash_index.lookup(rel_path, st)
+        if local_hash is None:
+            with self.tracer.span('hash', 'file', path=rel_path, size=st.st_size):
+                local_hash = self._calculate_md5(file_path)
+            if local_hash:
+                self.hash_index.record(rel_path, st, local_hash)
+        return local_hash
+    
+    def _calculate_md5(self, file_path):
+        """
+        Calculate MD5 hash of a file
+        
+        Uses the same hashing as the manifest generator (rngp_hashing): text
+        files are normalized to LF line endings before hashing to ensure
+        consistency across different systems and Git's line ending handling.
+        """
+        try:
+            return file_md5(file_path)
+        except Exception:
+            return ""
+    
+    def _find_old_files(self, manifest, snapshot):
+        """
+        Return the manifest's deleted files that exist locally.
+        
+        Only files present in the snapshot are looked at, and only those
+        with expected hashes are hashed (through the hash index). Paths
+        that are also manifest files are never deleted.
+        """
+        manifest_paths = {os.path.normcase(f['path']) for f in manifest.get('files', [])}
+        old_files = []
+        
+        for entry in deleted_entries(manifest):
+            key = os.path.normcase(entry['path'])
+            if key not in snapshot or key in manifest_paths:
+                continue
+            # A file with content the old releases never shipped belongs to the player
+            if entry.get('md5s') and self._local_md5(entry['path'], snapshot) not in entry['md5s']:
+                continue
+            old_files.append(entry['path'])
+        
+        return old_files
+    
+    def _delete_old_files(self, manifest, old_files=None, snapshot=None):
+        """
+        Delete the files the manifest removes before patching
+        
+        old_files can be passed in when they were already found by an update
+        check; otherwise they are looked up in snapshot.
+        """
+        game_path = Path(self.game_path)
+        deleted_count = 0
+        
+        self.log("Checking for old files to delete...")
+        if old_files is None:
+            old_files = self._find_old_files(manifest, snapshot)
+        
+        for filename in old_files:
+            file_path = game_path / filename
+            try:
+                file_path.unlink()
+                self.hash_index.forget(filename)
+                self.log(f"Deleted obsolete file: {filename}", "SUCCESS")
+                deleted_count += 1
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                self.log(f"Failed to delete {filename}: {e}", "WARNING")
+        
+        if deleted_count > 0:
+            self.log(f"Deleted {deleted_count} old files", "SUCCESS")
+        else:
+            self.log("No old files found to delete")
+    
+    def _download_worker(self, group):
+        """
+        Install one unique file content at every path in group (runs on a download pool thread).
+        
+        The content is downloaded once - or taken from an up-to-date local file
+        with the same hash - and the remaining paths are filled by local copy.
+        """
+        self._check_cancelled()
+        primary = group[0]
+        source = self._local_sources.get(primary.get('md5'))
+        
+        if source is None:
+            started = time.monotonic()
+            with self.tracer.span('download', 'file', path=primary['path'], size=primary['size']) as span:
+                ok = span['ok'] = self._download_file(primary)
+            if ok:
+                elapsed = max(time.monotonic() - started, 0.001)
+                self.log(
+                    f"Finished: {primary['path']} ({format_size(primary['size'])} in {elapsed:.1f} s, "
+                    f"{format_size(primary['size'] / elapsed)}/s)"
+                )
+            self._file_done(primary, ok)
+            if not ok:
+                for file_info in group[1:]:
+                    self.log(f"Skipped {file_info['path']} (same content as {primary['path']})", "ERROR")
+                    self._file_done(file_info, False)
+                return False
+            source, group = primary['path'], group[1:]
+        
+        return self._install_duplicates(source, group)
+    
+    def _install_duplicates(self, source, group):
+        """Fill every path in group from the verified local file source"""
+        ok = True
+        for file_info in group:
+            with self.tracer.span('copy', 'file', path=file_info['path'], source=source) as span:
+                copied = span['ok'] = self._copy_duplicate(source, file_info)
+            self._file_done(file_info, copied)
+            ok = ok and copied
+        return ok
+    
+    def _plan_bundle_jobs(self, manifest, groups):
+        """
+        Split content groups into bundle jobs and individual downloads.
+        
+        Returns ([(bundle, [(offset, size, group)])], [group]). Groups that
+        can be seeded from a local file, or aren't in any bundle, are left
+        to _download_worker.
+        """
+        members = {}
+        for bundle in manifest.get('bundles', []):
+            for member in bundle.get('members', []):
+                members[member['path']] = (bundle, member)
+        
+        jobs = {}
+        single_groups = []
+        for group in groups.values():
+            primary = group[0]
+            found = members.get(primary['path'])
+            if found is None or primary.get('md5') in self._local_sources or \
+                    found[1].get('md5') != primary.get('md5') or found[1].get('size') != primary.get('size'):
+                single_groups.append(group)
+                continue
+            bundle, member = found
+            jobs.setdefault(bundle['name'], (bundle, []))[1].append((member['offset'], member['size'], group))
+        return list(jobs.values()), single_groups
+    
+    def _bundle_worker(self, bundle, members):
+        """
+        Install the stale small files packed in one bundle (runs on a download pool thread).
+        
+        The wanted members are fetched with one request for the whole bundle
+        or a few Range slices and split out as they stream in. Anything that
+        can't be taken from the bundle is downloaded on its own.
+        """
+        pending = {id(group): group for _, _, group in members}
+        bundle_url = self.mirrors.candidates(bundle['url'])[0]
+        with self.tracer.span('bundle', 'file', bundle=bundle['name'], members=len(members)) as span:
+            try:
+                for start, end, run in plan_bundle_fetches(bundle['size'], members):
+                    for group, data in iter_bundle_members(self.http, bundle_url, start, end, run):
+                        self._check_cancelled()
+                        if id(group) in pending and self._install_bundle_member(group[0], data, bundle):
+                            if self._optional_limiter is not None and is_optional(group[0]):
+                                self._optional_limiter.wait(len(data))
+                            del pending[id(group)]
+                            self._file_done(group[0], True)
+                            self._install_duplicates(group[0]['path'], group[1:])
+            except Exception as e:
+                self.mirrors.report_failure(bundle_url)
+                self.log(
+                    f"Bundle {bundle['name']} failed ({e}) - downloading {len(pending)} files individually", "WARNING"
+                )
+            span['fallback'] = len(pending)
+        
+        for group in pending.values():
+            self._download_worker(group)
+    
+    def _install_bundle_member(self, file_info, data, bundle):
+        """Verify one file unpacked from a bundle and move it into place"""
+        local_path = Path(self.game_path) / file_info['path']
+        hasher = StreamingMD5(local_path)
+        hasher.update(data)
+        if hasher.hexdigest() != file_info['md5']:
+            self.log(f"Hash mismatch for {file_info['path']} in {bundle['name']}", "WARNING")
+            return False
+        
+        staging_path = local_path.with_name(local_path.name + ".bundle" + PART_SUFFIX)
+        try:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            self.hash_index.forget(file_info['path'])
+            with open(staging_path, 'wb') as f:
+                f.write(data)
+            os.replace(staging_path, local_path)
+            self.hash_index.record(file_info['path'], local_path.stat(), file_info['md5'])
+        except OSError as e:
+            self.log(f"Failed to write {file_info['path']}: {e}", "ERROR")
+            if staging_path.exists():
+                staging_path.unlink()
+            return False
+        
+        index = self._next_file_index()
+        self.log(
+            f"[{index}/{self._download_state['total']}] Unpacked: {file_info['path']} (from {bundle['name']})"
+        )
+        return True
+    
+    def _next_file_index(self):
+        with self._progress_lock:
+            self._download_state['started'] += 1
+            return self._download_state['started']
+    
+    def _file_done(self, file_info, ok):
+        """Update aggregate progress after a file was installed (or failed)"""
+        state = self._download_state
+        with self._progress_lock:
+            state['done'] += 1
+            if not ok:
+                state['failed'] += 1
+            # A finished file counts in full, however much of it was streamed
+            counted = state['file_bytes'].pop(file_info['path'], 0)
+            state['bytes_done'] += max(file_info['size'] - counted, 0)
+        if ok:
+            # However it was installed, an interrupted full download of it is now useless
+            try:
+                discard_partial(Path(self.game_path) / file_info['path'])
+            except OSError:
+                pass
+        self._emit_progress(force=True)
+    
+    def _progress_hasher(self, file_info, local_path):
+        """StreamingMD5 for local_path that also reports the bytes it hashes as progress"""
+        return _CountingHasher(StreamingMD5(local_path), lambda count: self._add_bytes(file_info, count))
+    
+    def _add_bytes(self, file_info, count):
+        self._check_cancelled()
+        state = self._download_state
+        with self._progress_lock:
+            # Retries (delta -> full download, resumed prefixes) don't count twice
+            counted = state['file_bytes'].get(file_info['path'], 0)
+            count = min(count, max(file_info['size'] - counted, 0))
+            state['file_bytes'][file_info['path']] = counted + count
+            state['bytes_done'] += count
+        if count and self._optional_limiter is not None and is_optional(file_info):
+            self._optional_limiter.wait(count)
+        self._emit_progress()
+    
+    def _emit_progress(self, force=False):
+        """Send a progress event with rolling throughput and ETA (throttled unless force)"""
+        state = self._download_state
+        now = time.monotonic()
+        received = self.http.stats()['bytes_received']
+        with self._progress_lock:
+            if not force and now - state['last_emit'] < PROGRESS_INTERVAL:
+                return
+            state['last_emit'] = now
+            samples = state['samples']
+            samples.append((now, received, state['bytes_done']))
+            while len(samples) > 2 and now - samples[0][0] > THROUGHPUT_WINDOW:
+                samples.popleft()
+            
+            rate = None
+            eta = None
+            span = now - samples[0][0]
+            if span > 0:
+                rate = (received - samples[0][1]) / span
+                written_rate = (state['bytes_done'] - samples[0][2]) / span
+                if written_rate > 0:
+                    eta = (state['bytes_total'] - state['bytes_done']) / written_rate
+            fields = {
+                'done': state['done'], 'failed': state['failed'], 'total': state['total'],
+                'bytes_done': state['bytes_done'], 'bytes_total': state['bytes_total'],
+                'rate': rate, 'eta': eta
+            }
+        self.emit('progress', **fields)
+    
+    def _download_file(self, file_info):
+        """Download and verify a single file"""
+        index = self._next_file_index()
+        local_path = Path(self.game_path) / file_info['path']
+        total = self._download_state['total']
+        
+        # Patch the local copy with a small binary delta when it is a known base version
+        delta_info = self._find_delta(file_info)
+        if delta_info is not None:
+            self.log(
+                f"[{index}/{total}] Patching with delta: {file_info['path']} "
+                f"({delta_info['size'] / 1024:.0f} KB instead of {file_info['size'] / 1024:.0f} KB)"
+            )
+            if self._apply_delta(file_info, delta_info, local_path):
+                return True
+        
+        # Rebuild PFS archives (.s3d/.eqg) from their unchanged local entries
+        if self._patch_archive_entries(file_info, local_path, index, total):
+            return True
+        
+        # Rebuild large files from the content-defined chunks we already have
+        if self._patch_chunks(file_info, local_path, index, total):
+            return True
+        
+        # Smaller compressed variant of the file, decompressed while it streams in
+        variant = file_info.get('compressed')
+        if variant and variant.get('encoding') in SUPPORTED_ENCODINGS and \
+                variant.get('size', file_info['size']) < file_info['size']:
+            self.log(
+                f"[{index}/{total}] Downloading: {file_info['path']} "
+                f"({variant['encoding']}, {variant['size'] / 1024:.0f} KB instead of {file_info['size'] / 1024:.0f} KB)"
+            )
+            result = self._download_compressed_variant(file_info, variant, local_path)
+            if result is not None:
+                return result
+        
+        # Large files come from several mirrors at once
+        if file_info['size'] >= MULTI_SOURCE_MIN_SIZE:
+            sources = self.mirrors.range_sources(file_info['url'])[:MULTI_SOURCE_MAX_MIRRORS]
+            if len(sources) > 1 and self._download_multi_source(file_info, sources, local_path, index, total):
+                return True
+        
+        self.log(f"[{index}/{total}] Downloading: {file_info['path']}")
+        
+        try:
+            # Create directory if needed
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # Download file from GitHub (resumes an interrupted .part file if present).
+            # The MD5 is computed as the data streams in and the file is only
+            # renamed into place once it matches the manifest.
+            self.hash_index.forget(file_info['path'])
+            
+            def fetch(url):
+                hasher = self._progress_hasher(file_info, local_path)
+                download_resumable(self.http, url, local_path, file_info.get('md5'),
+                                   file_info.get('size'), DOWNLOAD_CHUNK_SIZE, hasher)
+                return hasher
+            hasher = self._with_mirrors(file_info['url'], fetch, file_info['path'])
+            
+            # Record the verified hash so the next check doesn't reread the file
+            self.hash_index.record(file_info['path'], local_path.stat(), hasher.hexdigest())
+            ok = True
+            
+        except HashMismatchError as e:
+            self.log(f"Hash mismatch for {file_info['path']} - download rejected ({e.actual})", "ERROR")
+            ok = False
+        except Exception as e:
+            self.log(f"Failed to download {file_info['path']}: {e}", "ERROR")
+            ok = False
+        
+        return ok
+    
+    def _download_compressed_variant(self, file_info, variant, local_path):
+        """
+        Download and decompress the compressed variant of a file.
+        
+        Returns True once the file was installed, or None if the variant
+        couldn't be fetched or didn't decompress to the expected file (the
+        caller then downloads the uncompressed file).
+        """
+        try:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            self.hash_index.forget(file_info['path'])
+            
+            def fetch(url):
+                hasher = self._progress_hasher(file_info, local_path)
+                download_compressed(self.http, url, local_path, variant['encoding'],
+                                    file_info.get('md5'), hasher, DOWNLOAD_CHUNK_SIZE)
+                return hasher
+            hasher = self._with_mirrors(variant['url'], fetch, file_info['path'])
+            self.hash_index.record(file_info['path'], local_path.stat(), hasher.hexdigest())
+            return True
+        except Exception as e:
+            self.log(
+                f"Compressed download of {file_info['path']} failed ({e}) - downloading uncompressed file", "WARNING"
+            )
+            return None
+    
+    def _find_delta(self, file_info):
+        """Return the manifest delta whose base matches the local file, if any"""
+        deltas = file_info.get('deltas')
+        if not deltas or not file_info.get('md5'):
+            return None
+        local_hash = self._local_md5(file_info['path'])
+        if not local_hash:
+            return None
+        for delta_info in deltas:
+            if delta_info.get('from_md5') == local_hash:
+                return delta_info
+        return None
+    
+    def _apply_delta(self, file_info, delta_info, local_path):
+        """
+        Rebuild local_path from its current contents and a downloaded delta.
+        
+        The result is written to a staging file and only replaces the local
+        file if it matches the manifest hash. Returns False on any failure so
+        the caller can fall back to a full download.
+        """
+        staging_path = local_path.with_name(local_path.name + ".delta" + PART_SUFFIX)
+        try:
+            def fetch(url):
+                with self.http.request(url) as response:
+                    delta = response.read()
+                if delta_info.get('md5') and hashlib.md5(delta).hexdigest() != delta_info['md5']:
+                    raise DeltaError("downloaded delta is corrupt")
+                return delta
+            delta = self._with_mirrors(delta_info['url'], fetch, file_info['path'])
+            
+            hasher = self._progress_hasher(file_info, local_path)
+            with open(local_path, 'rb') as old_file, open(staging_path, 'wb') as out_file:
+                apply_delta(old_file, delta, out_file, hasher)
+            if hasher.hexdigest() != file_info['md5']:
+                raise DeltaError("patched file does not match the manifest hash")
+            
+            os.replace(staging_path, local_path)
+            self.hash_index.record(file_info['path'], local_path.stat(), hasher.hexdigest())
+            return True
+        except Exception as e:
+            self.log(f"Delta for {file_info['path']} failed ({e}) - downloading full file", "WARNING")
+            return False
+        finally:
+            # Also on cancel (PatchCancelled skips the except above); a delta can't be resumed
+            if staging_path.exists():
+                try:
+                    staging_path.unlink()
+                except OSError:
+                    pass
+    
+    def _patch_archive_entries(self, file_info, local_path, index, total):
+        """
+        Update a PFS archive by fetching only its changed entries.
+        
+        The manifest's pfs_entries list where each entry's compressed data
+        sits in the new archive. Entries whose bytes already exist in the
+        local archive are copied from it; everything else is fetched with
+        HTTP Range requests. Returns False (so the caller downloads the full
+        file) when the local archive can't be used or the server lacks Range
+        support.
+        """
+        entries = file_info.get('pfs_entries')
+        if not entries or not file_info.get('md5') or not local_path.exists():
+            return False
+        try:
+            local_index = local_segment_index(local_path)
+        except (PFSError, OSError):
+            return False
+        
+        segments = [(e['offset'], e['length'], e['md5']) for e in entries]
+        plan = plan_segments(file_info['size'], segments, local_index)
+        remote_bytes = sum(length for kind, _, length in plan if kind == "remote")
+        if remote_bytes > file_info['size'] * SEGMENT_MAX_RATIO:
+            return False
+        
+        self.log(
+            f"[{index}/{total}] Patching archive entries: {file_info['path']} "
+            f"({remote_bytes / 1024:.0f} KB of {file_info['size'] / 1024:.0f} KB)"
+        )
+        try:
+            hasher = self._with_mirrors(file_info['url'], lambda url: self._fetch_segments(file_info, url, plan),
+                                        file_info['path'])
+            self.hash_index.record(file_info['path'], local_path.stat(), hasher.hexdigest())
+            return True
+        except Exception as e:
+            self.log(f"Entry patch for {file_info['path']} failed ({e}) - downloading full file", "WARNING")
+            return False
+    
+    def _fetch_segments(self, file_info, url, plan):
+        """Rebuild the local file from plan with Range requests to url; returns the hasher"""
+        local_path = Path(self.game_path) / file_info['path']
+        hasher = self._progress_hasher(file_info, local_path)
+        download_segments(self.http, url, local_path, plan, local_path,
+                          file_info['md5'], hasher, DOWNLOAD_CHUNK_SIZE)
+        return hasher
+    
+    def _download_multi_source(self, file_info, sources, local_path, index, total):
+        """
+        Fetch a large file as Range segments from several mirrors at once.
+        
+        Returns False (so the caller downloads it from one mirror at a
+        time) if the mirrors together couldn't deliver a matching file.
+        """
+        hosts = [urllib.parse.urlsplit(url).netloc for url in sources]
+        self.log(f"[{index}/{total}] Downloading: {file_info['path']} (from {len(sources)} mirrors)")
+        try:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+            self.hash_index.forget(file_info['path'])
+            hasher = StreamingMD5(local_path)
+            fetched = download_multi_source(self.http, sources, local_path, file_info['size'], file_info.get('md5'),
+                                            hasher, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                                            on_bytes=lambda count: self._add_bytes(file_info, count))
+            self.hash_index.record(file_info['path'], local_path.stat(), hasher.hexdigest())
+        except Exception as e:
+            self.log(f"Multi-mirror download of {file_info['path']} failed ({e}) - using one mirror", "WARNING")
+            return False
+        
+        shares = [f"{host} {format_size(fetched[url])}" for host, url in zip(hosts, sources) if fetched[url]]
+        if len(shares) > 1:
+            self.log(f"{file_info['path']}: {', '.join(shares)}")
+        return True
+    
+    def _patch_chunks(self, file_info, local_path, index, total):
+        """
+        Update a large file by fetching only the chunks the local copy lacks.
+        
+        The manifest's chunks are content-defined (see rngp_chunking), so
+        any older version of the file shares most of them wherever the
+        edits are. Matching chunks are copied from the local file and the
+        rest are fetched with HTTP Range requests. Returns False (so the
+        caller downloads the full file) when too little can be reused or
+        the server lacks Range support.
+        """
+        chunks = file_info.get('chunks')
+        if not chunks or not file_info.get('md5') or not local_path.exists():
+            return False
+        try:
+            local_index = local_chunk_index(local_path)
+        except OSError:
+            return False
+        
+        segments = [(c['offset'], c['length'], c['md5']) for c in chunks]
+        plan = plan_segments(file_info['size'], segments, local_index)
+        remote_bytes = sum(length for kind, _, length in plan if kind == "remote")
+        if remote_bytes > file_info['size'] * SEGMENT_MAX_RATIO:
+            return False
+        
+        self.log(
+            f"[{index}/{total}] Patching changed chunks: {file_info['path']} "
+            f"({remote_bytes / 1024:.0f} KB of {file_info['size'] / 1024:.0f} KB)"
+        )
+        try:
+            hasher = self._with_mirrors(file_info['url'], lambda url: self._fetch_segments(file_info, url, plan),
+                                        file_info['path'])
+            self.hash_index.record(file_info['path'], local_path.stat(), hasher.hexdigest())
+            return True
+        except Exception as e:
+            self.log(f"Chunk patch for {file_info['path']} failed ({e}) - downloading full file", "WARNING")
+            return False
+    
+    def _copy_duplicate(self, source_path, file_info):
+        """Install file_info by hardlinking or copying an identical, verified local file"""
+        index = self._next_file_index()
+        game_path = Path(self.game_path)
+        src = game_path / source_path
+        dst = game_path / file_info['path']
+        tmp = dst.with_name(dst.name + ".copy" + PART_SUFFIX)
+        
+        try:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            self.hash_index.forget(file_info['path'])
+            if tmp.exists():
+                tmp.unlink()
+            
+            linked = False
+            if self.link_duplicates:
+                try:
+                    os.link(src, tmp)
+                    linked = True
+                except OSError:
+                    # Not supported here (FAT32, different drive, ...) - fall back to a copy
+                    pass
+            if not linked:
+                shutil.copyfile(src, tmp)
+            os.replace(tmp, dst)
+            
+            self.hash_index.record(file_info['path'], dst.stat(), file_info['md5'])
+            action = "Linked" if linked else "Copied"
+            self.log(
+                f"[{index}/{self._download_state['total']}] {action}: {file_info['path']} (same content as {source_path})"
+            )
+            return True
+        except OSError as e:
+            self.log(f"Failed to copy {source_path} to {file_info['path']}: {e}", "ERROR")
+            return False
@@ -0,0 +1,120 @@
+"""
+RNGP Patcher - File Hashing
+MD5 of game files, shared by the patcher and the manifest generator
+
+Text files are hashed after line ending normalization so a checkout with
+CRLF endings hashes the same as one with LF. The digest has always been
+defined by reading the file as UTF-8 text with errors="ignore" and
+universal newlines, i.e.:
+
+    1. bytes that are not valid UTF-8 are dropped
+    2. CRLF and lone CR become LF
+
+TextNormalizer reproduces exactly that on raw bytes, a bounded chunk at a
+time, so files are never loaded whole and every existing manifest hash
+stays valid. Binary files are hashed with large reads into a reused buffer.
+"""
+
+import codecs
+import hashlib
+from pathlib import Path
+
+# Extensions whose line endings are normalized before hashing
+# These are files where Git might normalize line endings
+TEXT_EXTENSIONS = {'.txt', '.md', '.cfg', '.emt', '.map', '.eff', '.ini', '.opt', '.edd', '.zon', '.xmi'}
+
+READ_SIZE = 1024 * 1024
+
+
+def is_text_path(file_path):
+    """True if file_path is hashed with line ending normalization"""
+    return Path(file_path).suffix.lower() in TEXT_EXTENSIONS
+
+
+class TextNormalizer:
+    """
+    Byte-level equivalent of reading a file as UTF-8 (errors="ignore") text
+    with universal newlines and encoding it back to UTF-8.
+
+    feed() takes chunks of any size and returns the normalized bytes so
+    far; flush() returns whatever was held back at the end of the file.
+    A CR at the end of a chunk is held back until the next chunk shows
+    whether it is half of a CRLF.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        self._pending_cr = False
+
+    def _clean_utf8(self, data, final=False):
+        # Pure ASCII (the common case) is already valid UTF-8
+        if not final and data.isascii() and not self._decoder.getstate()[0]:
+            return data
+        return self._decoder.decode(data, final).encode('utf-8')
+
+    def _newlines(self, data):
+        if self._pending_cr:
+            data = b"\r" + data
+            self._pending_cr = False
+        if data.endswith(b"\r"):
+            data = data[:-1]
+            self._pending_cr = True
+        if b"\r" in data:
+            data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        return data
+
+    def feed(self, data):
+        return self._newlines(self._clean_utf8(bytes(data)))
+
+    def flush(self):
+        data = self._newlines(self._clean_utf8(b"", final=True))
+        if self._pending_cr:
+            self._pending_cr = False
+            data += b"\n"
+        return data
+
+
+class StreamingMD5:
+    """
+    Incremental file_md5() for data arriving in chunks.
+
+    The file path only decides whether text normalization applies, so a
+    CRLF split across two chunks is still normalized exactly like a
+    whole-file read.
+    """
+
+    def __init__(self, file_path):
+        self._md5 = hashlib.md5()
+        self._digest = None
+        self._normalizer = TextNormalizer() if is_text_path(file_path) else None
+
+    def update(self, data):
+        if self._normalizer is not None:
+            data = self._normalizer.feed(data)
+        self._md5.update(data)
+
+    def hexdigest(self):
+        """Finish hashing and return the digest (no more updates after this)"""
+        if self._digest is None:
+            if self._normalizer is not None:
+                self._md5.update(self._normalizer.flush())
+            self._digest = self._md5.hexdigest()
+        return self._digest
+
+
+def file_md5(file_path, read_size=READ_SIZE):
+    """
+    MD5 of a file as recorded in the manifest (hex string).
+
+    Raises OSError if the file can't be read.
+    """
+    hasher = StreamingMD5(file_path)
+    buffer = bytearray(read_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+    return hasher.hexdigest()
@@ -0,0 +1,43 @@
+"""
+RNGP Patcher - Manifest Helpers
+Manifest rules shared by the patch engine and the manifest generator
+
+Kept free of the engine's network and threading code so that
+generate_manifest.py can use it offline.
+"""
+
+# Files removed by releases before manifests had a "deleted" section; used
+# for manifests without one (generate_manifest.py seeds the section with them)
+LEGACY_DELETED_FILES = [
+    "arena.eqg",
+    "arena2.eqg",
+    "arena2.zon",
+    "arena2_EnvironmentEmitters.txt",
+    "arena2_chr.txt",
+    "arena_EnvironmentEmitters.txt",
+    "highpasshold.eqg",
+    "highpasshold.zon",
+    "highpasshold_EnvironmentEmitters.txt",
+    "lavastorm.emt",
+    "lavastorm.eqg",
+    "lavastorm.mp3",
+    "lavastorm_EnvironmentEmitters.txt",
+    "lavastorm_chr.txt",
+    "nektulos.eqg",
+    "nektulos_EnvironmentEmitters.txt",
+    "nro_assets.txt",
+    "fieldofbone_environmentemitters.txt"
+]
+
+
+def deleted_entries(manifest):
+    """
+    The files a manifest removes, as [{"path", "md5s"}].
+
+    "md5s" lists the contents the old releases shipped; when present, a local
+    file is only deleted if it has one of them. Manifests without a
+    "deleted" section get LEGACY_DELETED_FILES.
+    """
+    if 'deleted' not in manifest:
+        return [{'path': path} for path in LEGACY_DELETED_FILES]
+    return [{'path': entry} if isinstance(entry, str) else entry for entry in manifest['deleted']]
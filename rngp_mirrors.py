@@ -0,0 +1,155 @@
+"""
+RNGP Patcher - Download Mirrors
+Pick the fastest copy of the patch files and fail over between copies
+
+A manifest can list several base URLs that serve the same release tree
+(GitHub raw, a Wasabi bucket, a CDN in front of either):
+
+    "mirrors": [
+        "https://raw.githubusercontent.com/printbeast/rngp-patcher/master/",
+        "https://s3.us-east-1.wasabisys.com/rngp-patches/"
+    ],
+    "files": [{"path": "gfaydark.s3d", "url": "patch_files/gfaydark.s3d", ...}]
+
+Relative urls (files, deltas, compressed variants, bundles) are resolved
+against every mirror; without a mirrors list they resolve against the
+manifest's own URL. Absolute urls under a mirror get the same treatment,
+so older manifests keep working and still fail over.
+
+Before downloading, each mirror is probed with a one byte Range request
+of a real file. Mirrors are then tried fastest first, a mirror that
+fails drops down the list for the rest of the session, and only mirrors
+that answered the probe with 206 take part in multi-source downloads.
+"""
+
+import threading
+import time
+import urllib.parse
+
+# Seconds to wait for a probe before treating a mirror as unreachable
+PROBE_TIMEOUT = 5
+
+# Ranking penalty (seconds of latency) per failed request on a mirror
+FAILURE_PENALTY = 2.0
+
+
+class Mirror:
+    """One base URL and what is known about it"""
+
+    def __init__(self, base):
+        self.base = base if base.endswith("/") else base + "/"
+        self.host = urllib.parse.urlsplit(self.base).netloc
+        self.latency = None         # seconds to first byte, inf if unreachable
+        self.ranges = False         # answered the probe with 206 Partial Content
+        self.failures = 0
+
+    def rank(self):
+        latency = self.latency if self.latency is not None else 0.0
+        return latency + self.failures * FAILURE_PENALTY
+
+
+class MirrorSet:
+    """The mirrors of the current manifest, ranked by probe latency and failures"""
+
+    def __init__(self):
+        self.mirrors = []
+        self.default_base = None
+        self.probe_path = None
+        self.probed = False
+        self._lock = threading.Lock()
+
+    def configure(self, bases, default_base, probe_path=None):
+        """
+        Use bases (from the manifest) and default_base (the manifest URL).
+
+        Probe results are kept while the list of bases stays the same.
+        """
+        bases = [base if base.endswith("/") else base + "/" for base in bases or []]
+        with self._lock:
+            self.default_base = default_base
+            self.probe_path = probe_path
+            if [mirror.base for mirror in self.mirrors] != bases:
+                self.mirrors = [Mirror(base) for base in bases]
+                self.probed = False
+
+    def relative(self, url):
+        """url relative to the mirror it lives on, or None if it is not under any mirror"""
+        if not urllib.parse.urlsplit(url).scheme:
+            return url.lstrip("/")
+        for mirror in self.mirrors:
+            if url.startswith(mirror.base):
+                return url[len(mirror.base):]
+        return None
+
+    def ranked(self):
+        with self._lock:
+            return sorted(self.mirrors, key=Mirror.rank)
+
+    def candidates(self, url):
+        """Absolute URLs to try for url, best mirror first"""
+        rel = self.relative(url)
+        if rel is None:
+            return [url]
+        if not self.mirrors:
+            return [urllib.parse.urljoin(self.default_base or "", rel)]
+        return [mirror.base + rel for mirror in self.ranked()]
+
+    def range_sources(self, url):
+        """Absolute URLs for url on the reachable mirrors with Range support, best first"""
+        rel = self.relative(url)
+        if rel is None:
+            return []
+        return [mirror.base + rel for mirror in self.ranked()
+                if mirror.ranges and mirror.latency != float('inf')]
+
+    def report_failure(self, url):
+        """Move the mirror that served url down the ranking"""
+        with self._lock:
+            for mirror in self.mirrors:
+                if url.startswith(mirror.base):
+                    mirror.failures += 1
+                    return
+
+    def probe(self, pool, timeout=PROBE_TIMEOUT):
+        """
+        Time a one byte Range request of probe_path on every mirror (in parallel).
+
+        Returns the mirrors, best first.
+        """
+        if not self.mirrors or self.probe_path is None:
+            self.probed = True
+            return self.ranked()
+
+        def probe_one(mirror):
+            started = time.monotonic()
+            try:
+                with pool.request(mirror.base + self.probe_path, headers={'Range': "bytes=0-0"},
+                                  timeout=timeout) as response:
+                    latency = time.monotonic() - started
+                    response.read()
+                    ranges = response.status == 206
+            except Exception:
+                latency, ranges = float('inf'), False
+            with self._lock:
+                mirror.latency = latency
+                mirror.ranges = ranges
+
+        threads = [threading.Thread(target=probe_one, args=(mirror,), daemon=True) for mirror in self.mirrors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.probed = True
+        return self.ranked()
+
+    def describe(self):
+        """One line summary of the probe results, best mirror first"""
+        parts = []
+        for mirror in self.ranked():
+            if mirror.latency is None:
+                parts.append(f"{mirror.host} (not probed)")
+            elif mirror.latency == float('inf'):
+                parts.append(f"{mirror.host} unreachable")
+            else:
+                parts.append(f"{mirror.host} {mirror.latency * 1000:.0f} ms" + ("" if mirror.ranges else " (no Range)"))
+        return ", ".join(parts)
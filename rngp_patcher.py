@@ -6,19 +6,19 @@ Author: RNGP Development Team
 This patcher connects to Wasabi S3 bucket to download and install game files.
 No installation required - just run the executable!
 
+The window is a front end for rngp_engine.PatchEngine, which does the
+actual work (rngp_cli.py drives the same engine from the command line).
+
 FIXED: MD5 hash calculation now matches the manifest generator
 """
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import json
 import os
+import queue
 import sys
-import hashlib
 import threading
-import urllib.request
 import urllib.error
-from pathlib import Path
 from datetime import datetime
 import configparser
 
@@ -28,15 +28,31 @@ try:
 except ImportError:
     PYGAME_AVAILABLE = False
 
+from rngp_engine import (DEFAULT_DOWNLOAD_WORKERS, MAX_DOWNLOAD_WORKERS, VERIFY_FULL, VERIFY_MODES, VERIFY_QUICK,
+                         VERIFY_STANDARD, ManifestError, PatchCancelled, PatchEngine, format_duration,
+                         format_size)
+
 # GitHub Configuration
 # IMPORTANT: Update these values with your GitHub repository details
 GITHUB_CONFIG = {
     "repo_owner": "printbeast",             # Your GitHub username
     "repo_name": "rngp-patcher",            # Your repository name
-    "manifest_url": "https://raw.githubusercontent.com/printbeast/rngp-patcher/master/patch_manifest.json"
-    # The manifest contains direct download URLs to your GitHub files
+    "manifest_url": "https://raw.githubusercontent.com/printbeast/rngp-patcher/master/patch_manifest.json",
+    # Other copies of the manifest (e.g. a Wasabi bucket), tried in order if GitHub can't be reached
+    "manifest_mirrors": [],
+    # The manifest contains the download URLs (or a "mirrors" list plus relative paths)
 }
 
+# How often the Tk main loop applies queued log lines / progress from worker threads
+UI_POLL_MS = 100
+
+# Oldest status log lines are dropped beyond this
+MAX_LOG_LINES = 1000
+
+# MB/s for optional files (loadscreens, music) once the game is ready to play; 0 = unlimited
+DEFAULT_OPTIONAL_RATE_LIMIT = 2.0
+
+
 class RNGPPatcher:
     def __init__(self, root):
         self.root = root
@@ -57,7 +73,27 @@ class RNGPPatcher:
         self.game_path = tk.StringVar()
         self.status_text = tk.StringVar(value="Ready to patch")
         self.progress_value = tk.DoubleVar(value=0)
+        self.transfer_text = tk.StringVar(value="")
+        self.verify_mode = tk.StringVar(value=VERIFY_QUICK)
         self.is_patching = False
+        self.download_workers = DEFAULT_DOWNLOAD_WORKERS
+        self.link_duplicates = False
+        self.trace = False
+        self.optional_rate_limit = DEFAULT_OPTIONAL_RATE_LIMIT
+        
+        # Worker threads never touch Tk directly: log lines, progress and
+        # message boxes are queued here and applied by _drain_ui_events
+        self.ui_events = queue.Queue()
+        
+        # Checks and patches run one after another on a single engine thread
+        # (the engine starts its own download/hash pools)
+        self.engine_jobs = queue.Queue()
+        self.exiting = False
+        threading.Thread(target=self._run_engine_jobs, name="engine", daemon=True).start()
+        
+        # Does the patching; keeps the last "Check for Updates" result for "Start Patching"
+        self.engine = PatchEngine(manifest_url=GITHUB_CONFIG['manifest_url'],
+                                  manifest_mirrors=GITHUB_CONFIG['manifest_mirrors'], on_event=self._on_engine_event)
         
         # Load saved settings
         self.config_file = "patcher_config.ini"
@@ -68,6 +104,7 @@ class RNGPPatcher:
         
         # Build UI
         self.create_ui()
+        self.root.after(UI_POLL_MS, self._drain_ui_events)
         
     def center_window(self):
         """Center the window on the screen"""
@@ -156,6 +193,11 @@ class RNGPPatcher:
         )
         self.status_display.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
         
+        # Color coding
+        self.status_display.tag_config("error", foreground="red")
+        self.status_display.tag_config("success", foreground="green")
+        self.status_display.tag_config("warning", foreground="orange")
+        
         # Scrollbar for status
         scrollbar = tk.Scrollbar(status_frame, command=self.status_display.yview)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
@@ -174,6 +216,33 @@ class RNGPPatcher:
         )
         self.progress_bar.pack(fill=tk.X)
         
+        # Downloaded / total size, speed and time left while patching
+        transfer_label = tk.Label(
+            progress_frame,
+            textvariable=self.transfer_text,
+            font=("Arial", 8),
+            bg="#f0f0f0",
+            anchor=tk.W
+        )
+        transfer_label.pack(fill=tk.X)
+        
+        # Quick only looks at file sizes/dates (and checks further if anything is off),
+        # full ignores the local hash cache and rehashes every file
+        verify_frame = tk.Frame(progress_frame, bg="#f0f0f0")
+        verify_frame.pack(anchor=tk.W)
+        tk.Label(verify_frame, text="Verify:", font=("Arial", 8), bg="#f0f0f0").pack(side=tk.LEFT)
+        for mode, label in ((VERIFY_QUICK, "Quick"), (VERIFY_STANDARD, "Standard"),
+                            (VERIFY_FULL, "Full (repair install, rehash all files)")):
+            tk.Radiobutton(
+                verify_frame,
+                text=label,
+                value=mode,
+                variable=self.verify_mode,
+                command=self.save_config,
+                font=("Arial", 8),
+                bg="#f0f0f0"
+            ).pack(side=tk.LEFT)
+        
         # Buttons Frame
         button_frame = tk.Frame(content_frame, bg="#f0f0f0")
         button_frame.pack(fill=tk.X)
@@ -275,15 +344,33 @@ class RNGPPatcher:
                     saved_path = config['Settings'].get('game_path', '')
                     if saved_path and os.path.exists(saved_path):
                         self.game_path.set(saved_path)
+                    workers = config['Settings'].getint('download_workers', DEFAULT_DOWNLOAD_WORKERS)
+                    self.download_workers = max(1, min(workers, MAX_DOWNLOAD_WORKERS))
+                    self.link_duplicates = config['Settings'].getboolean('link_duplicates', False)
+                    self.trace = config['Settings'].getboolean('trace', False)
+                    verify_mode = config['Settings'].get('verify_mode', VERIFY_QUICK)
+                    if verify_mode in VERIFY_MODES:
+                        self.verify_mode.set(verify_mode)
+                    self.optional_rate_limit = max(0.0, config['Settings'].getfloat(
+                        'optional_rate_limit', DEFAULT_OPTIONAL_RATE_LIMIT))
             except Exception as e:
                 self.log_message(f"Could not load config: {e}", "WARNING")
     
     def save_config(self):
         """Save configuration"""
         config = configparser.ConfigParser()
-        config['Settings'] = {
-            'game_path': self.game_path.get()
-        }
+        # Keep any other settings the user has added to the file
+        config.read(self.config_file)
+        if 'Settings' not in config:
+            config['Settings'] = {}
+        config['Settings']['game_path'] = self.game_path.get()
+        config['Settings']['download_workers'] = str(self.download_workers)
+        config['Settings']['link_duplicates'] = str(self.link_duplicates).lower()
+        config['Settings']['trace'] = str(self.trace).lower()
+        # A repair is a one-off; don't make every launch rehash everything
+        config['Settings']['verify_mode'] = self.verify_mode.get() if self.verify_mode.get() != VERIFY_FULL \
+            else config['Settings'].get('verify_mode', VERIFY_QUICK)
+        config['Settings']['optional_rate_limit'] = f"{self.optional_rate_limit:g}"
         try:
             with open(self.config_file, 'w') as f:
                 config.write(f)
@@ -302,27 +389,108 @@ class RNGPPatcher:
             self.log_message(f"Game directory set to: {directory}")
     
     def log_message(self, message, level="INFO"):
-        """Add message to status display"""
+        """Add message to status display (safe to call from any thread)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        formatted_message = f"[{timestamp}] [{level}] {message}\n"
+        self.ui_events.put(('log', f"[{timestamp}] [{level}] {message}\n", level))
+    
+    def _in_ui(self, func, *args):
+        """Run func(*args) on the Tk main loop (for message boxes etc. from worker threads)"""
+        self.ui_events.put(('call', func, args))
+    
+    def _drain_ui_events(self):
+        """
+        Apply everything queued by worker threads since the last poll.
         
-        self.status_display.config(state=tk.NORMAL)
-        self.status_display.insert(tk.END, formatted_message)
+        Bursts of log lines are inserted together and only the newest progress
+        value is shown, so downloads never wait on Tk redraws.
+        """
+        lines = []
+        progress = None
+        calls = []
+        while True:
+            try:
+                item = self.ui_events.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] == 'log':
+                lines.append(item[1:])
+            elif item[0] == 'progress':
+                progress = item[1:]
+            else:
+                calls.append(item[1:])
         
-        # Color coding
-        if level == "ERROR":
-            self.status_display.tag_add("error", "end-2l", "end-1l")
-            self.status_display.tag_config("error", foreground="red")
-        elif level == "SUCCESS":
-            self.status_display.tag_add("success", "end-2l", "end-1l")
-            self.status_display.tag_config("success", foreground="green")
-        elif level == "WARNING":
-            self.status_display.tag_add("warning", "end-2l", "end-1l")
-            self.status_display.tag_config("warning", foreground="orange")
-        
-        self.status_display.see(tk.END)
-        self.status_display.config(state=tk.DISABLED)
-        self.root.update()
+        if lines:
+            self.status_display.config(state=tk.NORMAL)
+            for text, level in lines:
+                if level in ("ERROR", "SUCCESS", "WARNING"):
+                    self.status_display.insert(tk.END, text, level.lower())
+                else:
+                    self.status_display.insert(tk.END, text)
+            
+            # Keep the log bounded (the Text widget has an empty last line)
+            excess = int(self.status_display.index('end-1c').split('.')[0]) - 1 - MAX_LOG_LINES
+            if excess > 0:
+                self.status_display.delete('1.0', f'{excess + 1}.0')
+            
+            self.status_display.see(tk.END)
+            self.status_display.config(state=tk.DISABLED)
+        
+        if progress is not None:
+            self.progress_value.set(progress[0])
+            self.transfer_text.set(progress[1])
+        
+        try:
+            for func, args in calls:
+                func(*args)
+        finally:
+            self.root.after(UI_POLL_MS, self._drain_ui_events)
+    
+    def _on_engine_event(self, event):
+        """Show engine log messages and progress (called from worker threads)"""
+        if event['event'] == 'log':
+            self.log_message(event['message'], event['level'])
+        elif event['event'] == 'progress':
+            if event['bytes_total']:
+                percent = event['bytes_done'] / event['bytes_total'] * 100
+            else:
+                percent = event['done'] / event['total'] * 100
+            self.ui_events.put(('progress', percent, self._transfer_summary(event)))
+        elif event['event'] == 'verify':
+            percent = event['bytes_done'] / event['bytes_total'] * 100 if event['bytes_total'] else 100
+            self.ui_events.put(('progress', percent, f"Verifying: {event['done']} of {event['total']} files "
+                                f"({format_size(event['bytes_done'])} of {format_size(event['bytes_total'])})"))
+        elif event['event'] == 'ready' and event['optional_files']:
+            self._in_ui(self._ready_to_play)
+    
+    def _transfer_summary(self, event):
+        """Progress line such as: 45.2 MB of 125.7 MB - 6.3 MB/s - about 0:13 left"""
+        parts = [f"{format_size(event['bytes_done'])} of {format_size(event['bytes_total'])}"]
+        if event['rate']:
+            parts.append(f"{format_size(event['rate'])}/s")
+        if event['eta'] is not None and event['done'] < event['total']:
+            parts.append(f"about {format_duration(event['eta'])} left")
+        return " - ".join(parts)
+    
+    def _engine_settings(self):
+        """
+        Current settings for the next engine run (UI thread).
+        
+        They are applied by the job itself on the engine thread, so a
+        setting changed while another job runs doesn't leak into it.
+        """
+        return {
+            'game_path': self.game_path.get(),
+            'verify_mode': self.verify_mode.get(),
+            'download_workers': self.download_workers,
+            'link_duplicates': self.link_duplicates,
+            'trace': self.trace,
+            'optional_rate_limit': self.optional_rate_limit * 1024 * 1024 or None
+        }
+    
+    def _apply_engine_settings(self, settings):
+        """Engine thread: pass the settings taken when the job was queued to the engine"""
+        for name, value in settings.items():
+            setattr(self.engine, name, value)
     
     def check_updates(self):
         """Check for available updates"""
@@ -330,151 +498,67 @@ class RNGPPatcher:
             messagebox.showwarning("No Directory", "Please select your game directory first.")
             return
         
+        if self.is_patching:
+            messagebox.showinfo("Patching", "Patching is in progress - check again when it has finished.")
+            return
+        
         self.log_message("Checking for updates...")
+        settings = self._engine_settings()
         
-        # Run check in thread to avoid freezing UI
-        thread = threading.Thread(target=self._check_updates_thread)
-        thread.daemon = True
-        thread.start()
+        # Run check on the engine thread to avoid freezing UI
+        self.engine.reset_cancel()
+        self.engine_jobs.put(lambda: self._check_updates_thread(settings))
+    
+    def _run_engine_jobs(self):
+        """Engine thread: run queued checks/patches in order"""
+        while True:
+            job = self.engine_jobs.get()
+            try:
+                job()
+            except BaseException as e:
+                # Keep the thread alive for the jobs queued after this one
+                self.log_message(f"Engine job failed: {type(e).__name__}: {e}", "ERROR")
     
-    def _check_updates_thread(self):
-        """Thread worker for checking updates"""
+    def _check_updates_thread(self, settings):
+        """Engine thread job for checking updates"""
         try:
-            # Download manifest file from GitHub
-            self.log_message(f"Fetching manifest...")
+            self._apply_engine_settings(settings)
+            result = self.engine.check()
             
-            manifest_url = GITHUB_CONFIG['manifest_url']
-            
-            # Check if manifest is local file or remote URL
-            if manifest_url == "patch_manifest.json":
-                # Load local manifest file
-                try:
-                    with open(manifest_url, 'r') as f:
-                        manifest_data = f.read()
-                    manifest = json.loads(manifest_data)
-                except Exception as e:
-                    self.log_message(f"Failed to load local manifest: {e}", "ERROR")
-                    messagebox.showerror("Error", f"Could not load local manifest:\n{e}")
-                    return
-            else:
-                # Load from remote URL
-                with urllib.request.urlopen(manifest_url, timeout=10) as response:
-                    manifest_data = response.read().decode()
-                manifest = json.loads(manifest_data)
-            
-            # Check for old files that will be deleted (smart check with hashes)
-            files_to_check = [
-                "arena.eqg", "arena2.eqg", "arena2.zon", "arena2_EnvironmentEmitters.txt",
-                "arena2_chr.txt", "arena_EnvironmentEmitters.txt", "highpasshold.eqg",
-                "highpasshold.zon", "highpasshold_EnvironmentEmitters.txt", "lavastorm.emt",
-                "lavastorm.eqg", "lavastorm.mp3", "lavastorm_EnvironmentEmitters.txt",
-                "lavastorm_chr.txt", "nektulos.eqg", "nektulos_EnvironmentEmitters.txt",
-                "nro_assets.txt", "fieldofbone_environmentemitters.txt"
-            ]
-            
-            game_path = Path(self.game_path.get())
-            manifest_files = {f['path']: f for f in manifest.get('files', [])}
-            found_old_files = []
-            
-            for filename in files_to_check:
-                file_path = game_path / filename
-                if file_path.exists():
-                    if filename in manifest_files:
-                        # Check hash
-                        local_hash = self._calculate_md5(file_path)
-                        manifest_hash = manifest_files[filename].get('md5', '')
-                        if local_hash != manifest_hash:
-                            found_old_files.append(filename)
-                    else:
-                        # Not in manifest - obsolete
-                        found_old_files.append(filename)
-            
-            if found_old_files:
-                self.log_message(f"Found {len(found_old_files)} old files that will be deleted during patching", "WARNING")
-            
-            # Get list of files that need updating
-            files_to_update = self._compare_files(manifest)
-            
-            if not files_to_update and not found_old_files:
-                self.log_message("Your game is up to date!", "SUCCESS")
-                messagebox.showinfo("Up to Date", "Your game files are already up to date!")
+            if result['up_to_date']:
+                self._in_ui(messagebox.showinfo, "Up to Date", "Your game files are already up to date!")
             else:
                 message_parts = []
                 
-                if found_old_files:
-                    message_parts.append(f"{len(found_old_files)} old files will be deleted")
+                if result['old_files']:
+                    message_parts.append(f"{len(result['old_files'])} old files will be deleted")
                 
-                if files_to_update:
-                    total_size = sum(f['size'] for f in files_to_update)
-                    size_mb = total_size / (1024 * 1024)
-                    message_parts.append(f"{len(files_to_update)} files to update ({size_mb:.2f} MB)")
-                    self.log_message(f"Found {len(files_to_update)} files to update ({size_mb:.2f} MB)", "SUCCESS")
+                if result['files_to_update']:
+                    size_mb = result['download_bytes'] / (1024 * 1024)
+                    message_parts.append(f"{len(result['files_to_update'])} files to update ({size_mb:.2f} MB)")
                 
                 message = "\n".join(message_parts)
                 message += "\n\nClick 'Start Patching' to begin."
-                messagebox.showinfo("Updates Available", message)
+                self._in_ui(messagebox.showinfo, "Updates Available", message)
                 
+        except PatchCancelled:
+            # Cancel Patching was clicked while this check was still running
+            self.log_message("Update check cancelled", "WARNING")
+        except ManifestError as e:
+            self.log_message(str(e), "ERROR")
+            self._in_ui(messagebox.showerror, "Error", str(e))
         except urllib.error.HTTPError as e:
             self.log_message(f"HTTP Error: {e.code} - {e.reason}", "ERROR")
             if e.code == 404:
-                messagebox.showerror("Error", "Patch manifest not found on GitHub.\n\nMake sure:\n1. Your repository exists\n2. patch_manifest.json is uploaded\n3. The URL in GITHUB_CONFIG is correct")
+                self._in_ui(messagebox.showerror, "Error", "Patch manifest not found on GitHub.\n\nMake sure:\n1. Your repository exists\n2. patch_manifest.json is uploaded\n3. The URL in GITHUB_CONFIG is correct")
             else:
-                messagebox.showerror("Error", f"Could not download manifest:\n{e.reason}")
+                self._in_ui(messagebox.showerror, "Error", f"Could not download manifest:\n{e.reason}")
         except urllib.error.URLError as e:
             self.log_message(f"Connection error: {e.reason}", "ERROR")
-            messagebox.showerror("Connection Error", f"Could not connect to GitHub:\n{e.reason}\n\nCheck your internet connection.")
+            self._in_ui(messagebox.showerror, "Connection Error", f"Could not connect to GitHub:\n{e.reason}\n\nCheck your internet connection.")
         except Exception as e:
             self.log_message(f"Error checking updates: {e}", "ERROR")
-            messagebox.showerror("Error", f"An error occurred:\n{e}\n\nPlease check your connection and try again.")
-    
-    def _compare_files(self, manifest):
-        """Compare local files with manifest"""
-        files_to_update = []
-        game_path = Path(self.game_path.get())
-        
-        for file_info in manifest.get('files', []):
-            file_path = game_path / file_info['path']
-            
-            # Check if file exists
-            if not file_path.exists():
-                files_to_update.append(file_info)
-                continue
-            
-            # Check file hash
-            local_hash = self._calculate_md5(file_path)
-            if local_hash != file_info.get('md5', ''):
-                files_to_update.append(file_info)
-        
-        return files_to_update
-    
-    def _calculate_md5(self, file_path):
-        """
-        Calculate MD5 hash of a file
-        
-        FIXED: Now matches the manifest generator's hash calculation method.
-        Text files are normalized to LF line endings before hashing to ensure
-        consistency across different systems and Git's line ending handling.
-        """
-        # For text files, normalize line endings to match manifest generation
-        text_extensions = {'.txt', '.md', '.cfg', '.emt', '.map', '.eff', '.ini', '.opt', '.edd', '.zon', '.xmi'}
-        
-        md5_hash = hashlib.md5()
-        try:
-            ext = Path(file_path).suffix.lower()
-            if ext in text_extensions:
-                # Read as text, replace CRLF with LF, encode as UTF-8
-                # This matches what the manifest generator does
-                with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                    content = f.read().replace('\r\n', '\n')
-                    md5_hash.update(content.encode('utf-8'))
-            else:
-                # Binary mode for everything else (images, executables, etc.)
-                with open(file_path, "rb") as f:
-                    for chunk in iter(lambda: f.read(4096), b""):
-                        md5_hash.update(chunk)
-            return md5_hash.hexdigest()
-        except Exception:
-            return ""
+            self._in_ui(messagebox.showerror, "Error", f"An error occurred:\n{e}\n\nPlease check your connection and try again.")
     
     def start_patching(self):
         """Start the patching process"""
@@ -496,166 +580,62 @@ class RNGPPatcher:
             return
         
         self.is_patching = True
-        self.patch_btn.config(state=tk.DISABLED, text="Patching...")
+        self.patch_btn.config(text="Cancel Patching", command=self.cancel_patching)
         self.log_message("Starting patch process...")
+        settings = self._engine_settings()
         
-        # Run patching in thread
-        thread = threading.Thread(target=self._patch_thread)
-        thread.daemon = True
-        thread.start()
+        # Run patching on the engine thread. A cancel from here on stops it,
+        # even while it is still queued behind a check.
+        self.engine.reset_cancel()
+        self.engine_jobs.put(lambda: self._patch_thread(settings))
     
-    def _delete_old_files(self, manifest):
-        """Delete specific old files before patching if they don't match the manifest"""
-        # Files that were replaced/updated and should be checked
-        files_to_check = [
-            "arena.eqg",
-            "arena2.eqg",
-            "arena2.zon",
-            "arena2_EnvironmentEmitters.txt",
-            "arena2_chr.txt",
-            "arena_EnvironmentEmitters.txt",
-            "highpasshold.eqg",
-            "highpasshold.zon",
-            "highpasshold_EnvironmentEmitters.txt",
-            "lavastorm.emt",
-            "lavastorm.eqg",
-            "lavastorm.mp3",
-            "lavastorm_EnvironmentEmitters.txt",
-            "lavastorm_chr.txt",
-            "nektulos.eqg",
-            "nektulos_EnvironmentEmitters.txt",
-            "nro_assets.txt",
-            "fieldofbone_environmentemitters.txt"
-        ]
-        
-        game_path = Path(self.game_path.get())
-        deleted_count = 0
-        
-        # Build a dict of manifest files for quick lookup
-        manifest_files = {f['path']: f for f in manifest.get('files', [])}
-        
-        self.log_message("Checking for old files to delete...")
-        
-        for filename in files_to_check:
-            file_path = game_path / filename
-            if file_path.exists():
-                # Check if this file is in the manifest
-                if filename in manifest_files:
-                    # File is in manifest - check if hash matches
-                    local_hash = self._calculate_md5(file_path)
-                    manifest_hash = manifest_files[filename].get('md5', '')
-                    
-                    if local_hash != manifest_hash:
-                        # Hash doesn't match - delete the old version
-                        try:
-                            file_path.unlink()
-                            self.log_message(f"Deleted old version: {filename}", "SUCCESS")
-                            deleted_count += 1
-                        except Exception as e:
-                            self.log_message(f"Failed to delete {filename}: {e}", "WARNING")
-                    # else: Hash matches - this is the correct version, keep it silently
-                else:
-                    # File not in manifest - it's obsolete, delete it
-                    self.log_message(f"File {filename} not in manifest - deleting obsolete file")
-                    try:
-                        file_path.unlink()
-                        self.log_message(f"Deleted obsolete file: {filename}", "SUCCESS")
-                        deleted_count += 1
-                    except Exception as e:
-                        self.log_message(f"Failed to delete {filename}: {e}", "WARNING")
-        
-        if deleted_count > 0:
-            self.log_message(f"Deleted {deleted_count} old files", "SUCCESS")
-        else:
-            self.log_message("No old files found to delete")
+    def cancel_patching(self):
+        """Stop the running patch; finished files stay and partial downloads resume next time"""
+        if not self.is_patching:
+            return
+        self.patch_btn.config(state=tk.DISABLED, text="Cancelling...")
+        self.log_message("Cancelling patch...", "WARNING")
+        self.engine.cancel()
     
-    def _patch_thread(self):
-        """Thread worker for patching"""
+    def _patch_thread(self, settings):
+        """Engine thread job for patching"""
         try:
-            # Download manifest from GitHub
-            self.log_message(f"Downloading manifest...")
-            
-            manifest_url = GITHUB_CONFIG['manifest_url']
-            
-            # Check if manifest is local file or remote URL
-            if manifest_url == "patch_manifest.json":
-                # Load local manifest file
-                try:
-                    with open(manifest_url, 'r') as f:
-                        manifest_data = f.read()
-                    manifest = json.loads(manifest_data)
-                except Exception as e:
-                    self.log_message(f"Failed to load local manifest: {e}", "ERROR")
-                    messagebox.showerror("Error", f"Could not load local manifest:\n{e}")
-                    self._patching_complete(False)
-                    return
-            else:
-                # Load from remote URL
-                with urllib.request.urlopen(manifest_url, timeout=10) as response:
-                    manifest_data = response.read().decode()
-                manifest = json.loads(manifest_data)
-            
-            # Delete old files first (now checks hashes before deleting)
-            self._delete_old_files(manifest)
-            
-            # Get files to update
-            files_to_update = self._compare_files(manifest)
-            
-            if not files_to_update:
-                self.log_message("No files need updating!", "SUCCESS")
-                self._patching_complete(True)
-                return
-            
-            total_files = len(files_to_update)
-            self.log_message(f"Downloading {total_files} files from GitHub...")
-            
-            # Download each file from GitHub
-            for index, file_info in enumerate(files_to_update, 1):
-                file_url = file_info['url']  # Direct GitHub URL
-                local_path = Path(self.game_path.get()) / file_info['path']
-                
-                self.log_message(f"[{index}/{total_files}] Downloading: {file_info['path']}")
-                
-                # Create directory if needed
-                local_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Download file from GitHub
-                try:
-                    urllib.request.urlretrieve(file_url, local_path)
-                    
-                    # Verify hash
-                    if 'md5' in file_info:
-                        local_hash = self._calculate_md5(local_path)
-                        if local_hash != file_info['md5']:
-                            self.log_message(f"Hash mismatch for {file_info['path']}", "WARNING")
-                    
-                except Exception as e:
-                    self.log_message(f"Failed to download {file_info['path']}: {e}", "ERROR")
-                    continue
-                
-                # Update progress
-                progress = (index / total_files) * 100
-                self.progress_value.set(progress)
-                self.root.update()
-            
-            self.log_message("Patching completed successfully!", "SUCCESS")
-            self._patching_complete(True)
-            
+            self._apply_engine_settings(settings)
+            result = self.engine.patch()
+            # Files that failed (e.g. rejected for a hash mismatch) need another run
+            self._in_ui(self._patching_complete, not result['failed'])
+        except PatchCancelled:
+            self._in_ui(self._patching_complete, None)
+        except ManifestError as e:
+            self.log_message(str(e), "ERROR")
+            self._in_ui(messagebox.showerror, "Error", str(e))
+            self._in_ui(self._patching_complete, False)
         except Exception as e:
             self.log_message(f"Patching failed: {e}", "ERROR")
-            messagebox.showerror("Patching Failed", f"An error occurred:\n{e}\n\nPlease try again or contact support.")
-            self._patching_complete(False)
+            self._in_ui(messagebox.showerror, "Patching Failed", f"An error occurred:\n{e}\n\nPlease try again or contact support.")
+            self._in_ui(self._patching_complete, False)
+    
+    def _ready_to_play(self):
+        """Required files are in place; optional ones are still downloading"""
+        if self.is_patching and self.patch_btn['state'] != tk.DISABLED:
+            self.patch_btn.config(text="Ready to Play - Cancel optional files")
     
     def _patching_complete(self, success):
-        """Handle patching completion"""
+        """Handle patching completion (success is None if it was cancelled)"""
         self.is_patching = False
-        self.patch_btn.config(state=tk.NORMAL, text="Start Patching")
+        self.patch_btn.config(state=tk.NORMAL, text="Start Patching", command=self.start_patching)
         self.progress_value.set(100 if success else 0)
+        self.transfer_text.set("")
         
-        if success:
+        if self.exiting:
+            self._exit_now()
+        elif success is None:
+            return
+        elif success:
             messagebox.showinfo("Success", "Patching completed successfully!\nYour game is now up to date.")
         else:
-            messagebox.showerror("Failed", "Patching failed. Check the status log for details.")
+            messagebox.showerror("Failed", "Patching failed. Check the status log for details,\n"
+                                           "then click 'Start Patching' to try again.")
     
     def exit_patcher(self):
         """Exit the application"""
@@ -666,8 +646,16 @@ class RNGPPatcher:
             )
             if not result:
                 return
+            # Let the engine stop cleanly (.part files kept for resume); quit when it has
+            self.exiting = True
+            self.cancel_patching()
+            return
         
+        self._exit_now()
+    
+    def _exit_now(self):
         self.stop_music()
+        self.engine.close()
         self.root.quit()
 
 def main():
@@ -0,0 +1,221 @@
+"""
+RNGP Patcher - PFS Archives
+Reader for the PFS container format used by .s3d/.eqg files
+
+Layout of a PFS archive:
+    header      directory offset (u32), b"PFS ", version (u32)
+    entry data  per entry, a chain of blocks until the uncompressed size
+                is reached: deflated size (u32), inflated size (u32), zlib data
+    directory   entry count (u32), then crc/offset/size (3 x u32) per entry,
+                sorted by crc
+    footer      optional b"STEVE" + timestamp (u32)
+
+File names are stored in a special entry (crc 0x61580AC9) listing the names
+of all other entries in the order of their data offsets. Entries are looked
+up by a CRC of the lower-cased, NUL-terminated name.
+
+Only the header, the directory, the block headers and the name table are
+read to list an archive; entry data is streamed when it is hashed, so
+memory use doesn't grow with the archive size.
+
+The manifest generator records where each entry's compressed blocks sit in
+the new archive together with their MD5 (see entry_segments). The patcher
+can then copy unchanged entries byte-for-byte out of the player's current
+archive and fetch only the changed ones with HTTP Range requests.
+"""
+
+import hashlib
+import os
+import struct
+import zlib
+
+MAGIC = b"PFS "
+NAMES_CRC = 0x61580AC9
+
+# Archive extensions that use the PFS container
+PFS_EXTENSIONS = {'.s3d', '.eqg', '.pfs', '.pak'}
+
+# Read size when hashing entry data
+READ_SIZE = 256 * 1024
+
+_HEADER = struct.Struct("<I4sI")
+_DIR_ENTRY = struct.Struct("<III")
+_BLOCK_HEADER = struct.Struct("<II")
+_U32 = struct.Struct("<I")
+
+
+class PFSError(Exception):
+    """The file is not a valid PFS archive"""
+
+
+class PFSEntry:
+    """One file stored in a PFS archive"""
+
+    def __init__(self, name, crc, offset, size, end):
+        self.name = name
+        self.crc = crc
+        self.offset = offset        # first block header
+        self.size = size            # uncompressed size
+        self.end = end              # end of the last compressed block
+
+    @property
+    def length(self):
+        """Bytes occupied by the entry's compressed blocks in the archive"""
+        return self.end - self.offset
+
+    def __repr__(self):
+        return f"PFSEntry({self.name!r}, offset={self.offset}, size={self.size})"
+
+
+class PFSArchive:
+    """
+    Directory of a PFS archive, read from an open binary file.
+
+    entries lists the named files in data order; names_entry is the hidden
+    entry holding the file names. Use PFSArchive.open(path) as a context
+    manager to have the file closed afterwards.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.file_size = os.fstat(f.fileno()).st_size
+        header = self._read_at(0, _HEADER.size)
+        if len(header) < _HEADER.size:
+            raise PFSError("file too small")
+        dir_offset, magic, version = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise PFSError("missing PFS magic")
+        self.version = version
+        self.dir_offset = dir_offset
+
+        try:
+            (count,) = _U32.unpack(self._read_at(dir_offset, _U32.size))
+            directory = self.f.read(count * _DIR_ENTRY.size)
+            raw_entries = [_DIR_ENTRY.unpack_from(directory, i * _DIR_ENTRY.size) for i in range(count)]
+        except struct.error:
+            raise PFSError("truncated directory")
+
+        entries = []
+        self.names_entry = None
+        for crc, offset, size in sorted(raw_entries, key=lambda e: e[1]):
+            entry = PFSEntry(None, crc, offset, size, self._block_chain_end(offset, size))
+            if crc == NAMES_CRC:
+                self.names_entry = entry
+            else:
+                entries.append(entry)
+
+        if self.names_entry is not None:
+            names = self._read_names(self.read(self.names_entry))
+            if len(names) == len(entries):
+                for entry, name in zip(entries, names):
+                    entry.name = name
+        self.entries = entries
+
+    @classmethod
+    def open(cls, path):
+        f = open(path, 'rb')
+        try:
+            return cls(f)
+        except BaseException:
+            f.close()
+            raise
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_at(self, offset, length):
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def _block_chain_end(self, offset, size):
+        pos = offset
+        inflated = 0
+        try:
+            while inflated < size:
+                deflated_len, inflated_len = _BLOCK_HEADER.unpack(self._read_at(pos, _BLOCK_HEADER.size))
+                pos += _BLOCK_HEADER.size + deflated_len
+                inflated += inflated_len
+        except struct.error:
+            raise PFSError(f"truncated entry at offset {offset}")
+        if pos > self.file_size:
+            raise PFSError(f"entry at offset {offset} runs past the end of the file")
+        return pos
+
+    @staticmethod
+    def _read_names(data):
+        try:
+            (count,) = _U32.unpack_from(data, 0)
+            names = []
+            pos = 4
+            for _ in range(count):
+                (length,) = _U32.unpack_from(data, pos)
+                names.append(data[pos + 4:pos + 4 + length].rstrip(b"\0").decode('latin-1'))
+                pos += 4 + length
+            return names
+        except struct.error:
+            raise PFSError("corrupt file name table")
+
+    def read(self, entry):
+        """Return the uncompressed contents of entry (used for the small name table)"""
+        out = bytearray()
+        pos = entry.offset
+        try:
+            while len(out) < entry.size:
+                deflated_len, _ = _BLOCK_HEADER.unpack(self._read_at(pos, _BLOCK_HEADER.size))
+                out += zlib.decompress(self.f.read(deflated_len))
+                pos += _BLOCK_HEADER.size + deflated_len
+        except (struct.error, zlib.error) as e:
+            raise PFSError(f"corrupt data for {entry.name}: {e}")
+        return bytes(out)
+
+    def raw_md5(self, entry):
+        """MD5 of the compressed block bytes of entry exactly as stored, read in READ_SIZE pieces"""
+        digest = hashlib.md5()
+        self.f.seek(entry.offset)
+        remaining = entry.length
+        while remaining:
+            data = self.f.read(min(READ_SIZE, remaining))
+            if not data:
+                raise PFSError(f"truncated data for {entry.name}")
+            digest.update(data)
+            remaining -= len(data)
+        return digest.hexdigest()
+
+    def all_entries(self):
+        """Named entries plus the name table, in data order"""
+        entries = list(self.entries)
+        if self.names_entry is not None:
+            entries.append(self.names_entry)
+        return sorted(entries, key=lambda e: e.offset)
+
+
+def entry_segments(path):
+    """
+    Manifest description of an archive's entries.
+
+    Returns a list of {"name", "offset", "length", "md5"} dicts (in data
+    order) where offset/length locate the entry's compressed blocks and md5
+    is the hash of those raw bytes.
+    """
+    with PFSArchive.open(path) as archive:
+        return [{
+            "name": entry.name if entry.name is not None else "",
+            "offset": entry.offset,
+            "length": entry.length,
+            "md5": archive.raw_md5(entry)
+        } for entry in archive.all_entries()]
+
+
+def local_segment_index(path):
+    """Map MD5 of each entry's compressed blocks -> (offset, length) in a local archive"""
+    with PFSArchive.open(path) as archive:
+        index = {}
+        for entry in archive.all_entries():
+            index.setdefault(archive.raw_md5(entry), (entry.offset, entry.length))
+        return index
@@ -0,0 +1,172 @@
+"""
+RNGP Patcher - Timing Trace
+Per-phase and per-file timings written to a rotating JSON-lines file
+
+Tracing is off unless "trace = true" is set in patcher_config.ini (or
+--trace is passed to rngp_cli.py). When on, every check/patch run appends
+its spans to rngp_trace.jsonl in the game directory, one finished span per
+line:
+
+    {"session": "20240101-120000-4242-1", "name": "compare", "cat": "phase",
+     "start": 1704106800.123, "dur": 0.532, "thread": "MainThread", "args": {}}
+
+start is the wall clock time in seconds, dur the duration in seconds. The
+file rotates at TRACE_MAX_BYTES, keeping TRACE_BACKUPS older copies, so it
+can be left on and attached to a bug report as is.
+
+To look at a trace in chrome://tracing or https://ui.perfetto.dev:
+    python rngp_trace.py GAME_DIR/rngp_trace.jsonl -o trace.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+TRACE_FILE = "rngp_trace.jsonl"
+TRACE_MAX_BYTES = 2 * 1024 * 1024
+TRACE_BACKUPS = 2
+
+_session_numbers = itertools.count(1)
+
+
+class Tracer:
+    """
+    Times spans and appends them to a trace file.
+
+    Tracer() without a path is disabled and span() costs next to nothing,
+    so callers never need to check whether tracing is on.
+    """
+
+    def __init__(self, trace_path=None, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS):
+        self.enabled = trace_path is not None
+        self.session = None
+        self._handler = None
+        if self.enabled:
+            self.session = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{next(_session_numbers)}"
+            self._handler = RotatingFileHandler(trace_path, maxBytes=max_bytes, backupCount=backups,
+                                                encoding='utf-8', delay=True)
+
+    @contextmanager
+    def span(self, name, cat="phase", **args):
+        """
+        Time the with block as one span.
+
+        Yields the args dict so results (bytes, ok, ...) can be added to it
+        before the span is written.
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = type(e).__name__
+            raise
+        finally:
+            self.record(name, cat, start, time.perf_counter() - started, args)
+
+    def record(self, name, cat, start, duration, args=None):
+        """Write one finished span"""
+        if not self.enabled:
+            return
+        line = json.dumps({
+            'session': self.session,
+            'name': name,
+            'cat': cat,
+            'start': round(start, 6),
+            'dur': round(duration, 6),
+            'thread': threading.current_thread().name,
+            'args': args or {}
+        }, default=str)
+        # The handler locks around writes and rotation, so pool threads can share it
+        self._handler.handle(logging.makeLogRecord({'msg': line}))
+
+    def close(self):
+        if self._handler is not None:
+            self._handler.close()
+
+
+def read_trace(trace_path):
+    """All spans in trace_path and its rotated copies, oldest first"""
+    trace_path = Path(trace_path)
+    paths = [trace_path.with_name(f"{trace_path.name}.{n}") for n in range(TRACE_BACKUPS, 0, -1)]
+    paths.append(trace_path)
+    spans = []
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+    return spans
+
+
+def export_chrome(spans, session=None):
+    """
+    Convert spans to the Chrome trace event format.
+
+    Only one session is exported: the given one, or the last in the trace.
+    """
+    if session is None and spans:
+        session = spans[-1]['session']
+    spans = [span for span in spans if span['session'] == session]
+
+    thread_ids = {}
+    events = []
+    for span in spans:
+        tid = thread_ids.setdefault(span['thread'], len(thread_ids) + 1)
+        events.append({
+            'name': span['name'],
+            'cat': span['cat'],
+            'ph': 'X',
+            'ts': span['start'] * 1e6,
+            'dur': span['dur'] * 1e6,
+            'pid': 1,
+            'tid': tid,
+            'args': span['args']
+        })
+    for thread, tid in thread_ids.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}})
+    events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': f"RNGP Patcher {session}"}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an RNGP Patcher trace for chrome://tracing or Perfetto")
+    parser.add_argument("trace", help=f"path to {TRACE_FILE}")
+    parser.add_argument("-o", "--output", default="rngp_trace.json", help="Chrome trace file to write")
+    parser.add_argument("--session", help="session to export (default: the last one)")
+    parser.add_argument("--list", action="store_true", help="list the sessions in the trace")
+    args = parser.parse_args()
+
+    spans = read_trace(args.trace)
+    if args.list:
+        sessions = {}
+        for span in spans:
+            sessions[span['session']] = sessions.get(span['session'], 0) + 1
+        for session, count in sessions.items():
+            print(f"{session}  {count} spans")
+        return
+
+    trace = export_chrome(spans, args.session)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(trace, f)
+    print(f"Wrote {len(trace['traceEvents'])} events to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,871 @@
+"""
+RNGP Patcher - HTTP Transport
+Keep-alive connection pooling for manifest and file downloads
+
+Every urllib.request.urlopen() call opens a fresh TCP (and TLS) connection.
+For patches made of hundreds of small files the handshakes cost more than
+the payload, so the patcher sends all of its requests through a
+ConnectionPool that keeps idle HTTP/1.1 connections open per host and hands
+them to the next request.
+
+download_resumable() stages each file in a .part file so interrupted
+downloads can pick up where they left off, hashes it while it streams in and
+only moves it into place once the hash has been verified.
+
+plan_segments()/download_segments() rebuild a file from byte ranges that
+are already on disk plus Range requests for the rest.
+
+download_compressed() fetches a gzip/zstd variant of a file and
+decompresses it to disk as it arrives.
+
+download_multi_source() fetches a large file as Range segments from
+several mirrors at once.
+
+plan_bundle_fetches()/iter_bundle_members() pull the wanted members out of
+a bundle of small files, with one request for the whole bundle or a few
+Range slices.
+"""
+
+import http.client
+import json
+import os
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from collections import deque
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+USER_AGENT = "RNGP-Patcher/1.0"
+
+# Responses with less than this left unread are drained so the connection
+# can still be reused; bigger leftovers just close the connection.
+MAX_DRAIN_BYTES = 64 * 1024
+
+MAX_REDIRECTS = 5
+
+# Compressed variants (see download_compressed) this build can decode
+SUPPORTED_ENCODINGS = {"gzip", "zstd"} if ZSTD_AVAILABLE else {"gzip"}
+
+# Suffix of the staging file used by download_resumable()
+PART_SUFFIX = ".part"
+MULTI_SOURCE_SUFFIX = ".multi" + PART_SUFFIX
+
+# plan_segments() fetches reusable local regions shorter than this when
+# they would otherwise split a download into two Range requests
+MERGE_GAP = 16 * 1024
+
+# Fetch a whole bundle instead of slices once this share of it is wanted
+BUNDLE_FULL_FETCH_RATIO = 0.5
+
+# download_multi_source() splits files into Range segments of this size and
+# stops using a mirror after this many failed segments
+MULTI_SOURCE_SEGMENT_SIZE = 1024 * 1024
+MULTI_SOURCE_MAX_FAILURES = 2
+
+# Errors that mean a kept-alive connection was closed by the server while
+# it sat idle. The request is retried once on a fresh connection.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    ConnectionAbortedError,
+    BrokenPipeError,
+)
+
+
+class PooledResponse:
+    """
+    File-like wrapper around http.client.HTTPResponse.
+
+    Closing the response returns its connection to the pool when the body
+    was fully read and the server allows keep-alive.
+    """
+
+    def __init__(self, pool, key, conn, response, url):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self._truncated = False
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def read(self, amt=None):
+        remaining = self._response.length
+        data = self._response.read(amt)
+        self._pool._count_bytes(len(data))
+        if not data and amt:
+            self._check_complete(remaining)
+        return data
+
+    def readinto(self, buffer):
+        remaining = self._response.length
+        count = self._response.readinto(buffer)
+        self._pool._count_bytes(count)
+        if not count and len(buffer):
+            self._check_complete(remaining)
+        return count
+
+    def _check_complete(self, remaining):
+        # http.client returns b"" for partial reads when the connection drops
+        # before Content-Length bytes arrived; that must not look like the end
+        if remaining:
+            self._truncated = True
+            raise http.client.IncompleteRead(b"", remaining)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        response = self._response
+        try:
+            if not response.isclosed():
+                length = response.length
+                if length is not None and length <= MAX_DRAIN_BYTES:
+                    response.read()
+        except (OSError, http.client.HTTPException):
+            pass
+        if response.isclosed() and not response.will_close and not self._truncated:
+            self._pool._release(self._key, conn)
+        else:
+            response.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of persistent HTTP/HTTPS connections, keyed by host.
+
+    request() has the same error behaviour as urllib.request.urlopen():
+    HTTP error statuses raise urllib.error.HTTPError and connection failures
+    raise urllib.error.URLError, so existing handlers keep working.
+    """
+
+    def __init__(self, timeout=30, max_idle_per_host=16):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+        self._proxies = urllib.request.getproxies()
+        self._stats = {'requests': 0, 'connections_opened': 0, 'connections_reused': 0, 'bytes_received': 0}
+
+    def stats(self):
+        """Return a copy of the request/connection/body byte counters"""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self._stats:
+                self._stats[key] = 0
+
+    def _count_bytes(self, count):
+        with self._lock:
+            self._stats['bytes_received'] += count
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def request(self, url, headers=None, method="GET", timeout=None):
+        """Send a request and return a PooledResponse (follows redirects)"""
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._request_once(url, headers, method, timeout)
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader('Location')
+                response.close()
+                if not location:
+                    break
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if response.status >= 400:
+                try:
+                    response.read()
+                finally:
+                    response.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+            return response
+        raise urllib.error.URLError(f"Too many redirects for {url}")
+
+    def _request_once(self, url, headers, method, timeout):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise urllib.error.URLError(f"Unsupported URL scheme: {parts.scheme}")
+
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        request_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}
+        request_headers.update(headers or {})
+
+        with self._lock:
+            self._stats['requests'] += 1
+
+        conn, reused = self._acquire(key)
+        conn.timeout = timeout or self.timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(conn.timeout)
+        try:
+            try:
+                self._send(conn, key, parts, target, method, request_headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped the idle connection - retry on a new one
+                conn = self._connect(key)
+                conn.timeout = timeout or self.timeout
+                self._send(conn, key, parts, target, method, request_headers)
+                response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            raise urllib.error.URLError(e)
+
+        return PooledResponse(self, key, conn, response, url)
+
+    def _send(self, conn, key, parts, target, method, headers):
+        # Plain HTTP through a proxy needs the absolute URL as request target
+        if key[0] == 'http' and self._proxy_for(key) is not None:
+            target = urllib.parse.urlunsplit((parts.scheme, parts.netloc, target, '', ''))
+        conn.request(method, target, headers=headers)
+
+    def _proxy_for(self, key):
+        scheme, host, _ = key
+        proxy = self._proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        return urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._stats['connections_reused'] += 1
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = self._proxy_for(key)
+        with self._lock:
+            self._stats['connections_opened'] += 1
+
+        if proxy is not None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(proxy.hostname, proxy.port or 8080,
+                                                   timeout=self.timeout, context=self._ssl_context)
+                conn.set_tunnel(host, port or 443)
+            else:
+                conn = http.client.HTTPConnection(proxy.hostname, proxy.port or 8080, timeout=self.timeout)
+        elif scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn
+
+
+class RateLimiter:
+    """Bytes-per-second budget shared by several download threads"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_free = 0.0
+
+    def wait(self, count):
+        """Block until count more bytes fit in the budget"""
+        with self._lock:
+            now = time.monotonic()
+            self._next_free = max(now, self._next_free) + count / self.rate
+            delay = self._next_free - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HashMismatchError(Exception):
+    """A downloaded file did not match its expected hash and was discarded"""
+
+    def __init__(self, path, expected, actual):
+        super().__init__(f"{path}: expected MD5 {expected}, got {actual}")
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+
+
+def _read_part_info(info_path):
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _discard_part(part_path, info_path):
+    for path in (part_path, info_path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def discard_partial(dest_path):
+    """Delete the resumable staging files (.part, .multi.part and their sidecars) left for dest_path, if any"""
+    for suffix in (PART_SUFFIX, MULTI_SOURCE_SUFFIX):
+        part_path = str(dest_path) + suffix
+        _discard_part(part_path, part_path + ".json")
+
+
+def download_resumable(pool, url, dest_path, expected_md5=None, expected_size=None,
+                       chunk_size=256 * 1024, hasher=None):
+    """
+    Download url to dest_path via a .part staging file, resuming if possible.
+
+    The .part file sits next to dest_path together with a small .part.json
+    sidecar recording the expected MD5 and size. If a previous attempt was
+    interrupted and the sidecar still matches, the download continues with
+    an HTTP Range request; servers that ignore the Range header (200 reply)
+    get a full download instead. The finished file is renamed over
+    dest_path, so a dropped connection never leaves a truncated file in
+    place. The .part file is kept on error so the next run can resume; a
+    .part that is already complete is verified and installed without a
+    request.
+
+    If a hasher (hashlib-style update()/hexdigest() object) is given, every
+    byte is fed to it as it is written. When expected_md5 is set and the
+    final digest differs, the staged file is deleted and HashMismatchError
+    is raised; dest_path is left untouched.
+
+    Returns the number of bytes transferred in this call.
+    """
+    dest_path = str(dest_path)
+    part_path = dest_path + PART_SUFFIX
+    info_path = part_path + ".json"
+    info = {'md5': expected_md5, 'size': expected_size}
+
+    offset = 0
+    saved = _read_part_info(info_path)
+    if saved == info and os.path.exists(part_path):
+        offset = os.path.getsize(part_path)
+        if offset == expected_size and hasher is not None and expected_md5:
+            # The previous attempt got every byte - install it if it verifies
+            _install_complete_part(part_path, info_path, dest_path, expected_md5, chunk_size, hasher)
+            return 0
+        if expected_size is not None and offset >= expected_size:
+            # Oversized (or unverifiable) leftovers can't be trusted
+            offset = 0
+    if offset == 0:
+        _discard_part(part_path, info_path)
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+
+    headers = {'Range': f"bytes={offset}-"} if offset else None
+    try:
+        response = pool.request(url, headers=headers)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable - the staged data is unusable, start over
+        _discard_part(part_path, info_path)
+        return download_resumable(pool, url, dest_path, expected_md5, expected_size, chunk_size, hasher)
+
+    transferred = 0
+    with response:
+        if offset and not _range_starts_at(response, offset):
+            # Server sent the whole file (no Range support) - rewrite from scratch
+            offset = 0
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            if hasher is not None and offset:
+                # Hash the bytes kept from the previous attempt
+                remaining = offset
+                while remaining:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    remaining -= len(chunk)
+            f.seek(offset)
+            f.truncate()
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+                transferred += len(chunk)
+
+    if hasher is not None and expected_md5:
+        actual = hasher.hexdigest()
+        if actual != expected_md5:
+            _discard_part(part_path, info_path)
+            raise HashMismatchError(dest_path, expected_md5, actual)
+
+    os.replace(part_path, dest_path)
+    _discard_part(part_path, info_path)
+    return transferred
+
+
+def _install_complete_part(part_path, info_path, dest_path, expected_md5, chunk_size, hasher):
+    """Hash a fully downloaded .part file and rename it over dest_path (HashMismatchError if it differs)"""
+    with open(part_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    actual = hasher.hexdigest()
+    if actual != expected_md5:
+        _discard_part(part_path, info_path)
+        raise HashMismatchError(dest_path, expected_md5, actual)
+    os.replace(part_path, dest_path)
+    _discard_part(part_path, info_path)
+
+
+def _range_starts_at(response, offset):
+    """True if response is a 206 partial reply starting at offset"""
+    if response.status != 206:
+        return False
+    content_range = response.getheader('Content-Range', '')
+    # e.g. "bytes 1048576-31457279/31457280"
+    try:
+        start = int(content_range.split()[1].split('-')[0])
+    except (IndexError, ValueError):
+        return False
+    return start == offset
+
+
+class RangeNotSupportedError(Exception):
+    """The server answered a Range request with something other than the requested bytes"""
+
+
+def plan_segments(size, segments, local_index, merge_gap=MERGE_GAP):
+    """
+    Work out how to build a file from local data plus HTTP Range fetches.
+
+    segments is a list of (offset, length, md5) regions of the new file
+    (sorted, non-overlapping); local_index maps md5 -> (offset, length) of
+    identical data already on disk. Bytes not covered by a reusable
+    segment are fetched. Reusable regions shorter than merge_gap that sit
+    between two fetches are fetched too, saving a request.
+
+    Returns a list of ("local", local_offset, length) and
+    ("remote", offset, length) operations in file order.
+    """
+    plan = []
+
+    def add(kind, source_offset, length):
+        if length <= 0:
+            return
+        if plan and kind == "remote" and plan[-1][0] == "remote" and \
+                plan[-1][1] + plan[-1][2] == source_offset:
+            plan[-1] = ("remote", plan[-1][1], plan[-1][2] + length)
+        else:
+            plan.append((kind, source_offset, length))
+
+    pos = 0
+    for offset, length, md5 in segments:
+        add("remote", pos, offset - pos)
+        local = local_index.get(md5)
+        if local is not None and local[1] == length:
+            plan.append(("local", local[0], length))
+        else:
+            add("remote", offset, length)
+        pos = offset + length
+    add("remote", pos, size - pos)
+
+    # Fold short local copies between two fetches into a single fetch
+    merged = []
+    new_offset = 0
+    for kind, source_offset, length in plan:
+        if kind == "remote" and len(merged) >= 2 and merged[-1][0] == "local" and \
+                merged[-1][2] < merge_gap and merged[-2][0] == "remote":
+            local_len = merged.pop()[2]
+            prev = merged.pop()
+            merged.append(("remote", prev[1], prev[2] + local_len + length))
+        else:
+            merged.append((kind, new_offset if kind == "remote" else source_offset, length))
+        new_offset += length
+    return merged
+
+
+def download_segments(pool, url, dest_path, plan, local_path, expected_md5=None,
+                      hasher=None, chunk_size=256 * 1024):
+    """
+    Build dest_path from a plan made by plan_segments().
+
+    "local" ranges are copied from local_path (which may be dest_path
+    itself) and "remote" ranges are fetched from url with Range requests.
+    The result is staged next to dest_path, verified against expected_md5
+    if a hasher is given, and renamed into place. Raises
+    RangeNotSupportedError if the server ignores Range, or
+    HashMismatchError; dest_path is untouched in both cases.
+
+    Returns the number of bytes downloaded.
+    """
+    dest_path = str(dest_path)
+    staging_path = dest_path + ".segments" + PART_SUFFIX
+    transferred = 0
+
+    try:
+        with open(local_path, 'rb') as local, open(staging_path, 'wb') as out:
+            def write(data):
+                out.write(data)
+                if hasher is not None:
+                    hasher.update(data)
+
+            for kind, offset, length in plan:
+                if kind == "local":
+                    local.seek(offset)
+                    remaining = length
+                    while remaining:
+                        data = local.read(min(chunk_size, remaining))
+                        if not data:
+                            raise OSError(f"{local_path} is shorter than expected")
+                        write(data)
+                        remaining -= len(data)
+                    continue
+
+                headers = {'Range': f"bytes={offset}-{offset + length - 1}"}
+                with pool.request(url, headers=headers) as response:
+                    if not _range_starts_at(response, offset):
+                        raise RangeNotSupportedError(f"{url} does not support Range requests")
+                    remaining = length
+                    while remaining:
+                        data = response.read(min(chunk_size, remaining))
+                        if not data:
+                            raise OSError(f"connection closed during range {offset}-{offset + length - 1}")
+                        write(data)
+                        remaining -= len(data)
+                        transferred += len(data)
+
+        if hasher is not None and expected_md5:
+            actual = hasher.hexdigest()
+            if actual != expected_md5:
+                raise HashMismatchError(dest_path, expected_md5, actual)
+        os.replace(staging_path, dest_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    return transferred
+
+
+def download_multi_source(pool, urls, dest_path, size, expected_md5=None, hasher=None,
+                          segment_size=MULTI_SOURCE_SEGMENT_SIZE, chunk_size=256 * 1024, on_bytes=None):
+    """
+    Download dest_path as Range segments spread over several mirrors at once.
+
+    Every url gets a thread that keeps taking the next segment nobody has
+    fetched yet, so a fast mirror ends up serving most of the file and a
+    slow or rate-limited one only a few segments. Once no segment is left
+    to hand out, idle threads also fetch segments still in flight on
+    another mirror and whichever copy arrives first wins, so the last
+    segments don't wait on the slowest mirror. A failed segment goes back
+    to the queue; a mirror that ignores Range or fails
+    MULTI_SOURCE_MAX_FAILURES times stops taking work. The last error is
+    raised only if every mirror gave up.
+
+    on_bytes(count) is called as data arrives; an exception it raises that
+    isn't an Exception (e.g. a cancellation) stops every mirror and is
+    re-raised once they have all finished. The finished file is fed to
+    hasher in order, checked against expected_md5 (HashMismatchError) and
+    renamed into place; dest_path is untouched on any error.
+
+    Segments are written to a .multi.part file whose .json sidecar lists
+    the finished ones. After a cancel or failure both are kept, and the
+    next call for the same file and MD5 only fetches the missing segments
+    (reporting the kept bytes to on_bytes first).
+
+    Returns {url: bytes of finished segments fetched from it}.
+    """
+    dest_path = str(dest_path)
+    staging_path = dest_path + MULTI_SOURCE_SUFFIX
+    info_path = staging_path + ".json"
+    info = {'md5': expected_md5, 'size': size, 'segment_size': segment_size}
+    segments = {offset: min(segment_size, size - offset) for offset in range(0, size, segment_size)}
+    total = len(segments)
+
+    # Segments finished by an earlier, interrupted call
+    completed = set()
+    saved = _read_part_info(info_path)
+    if isinstance(saved, dict) and all(saved.get(key) == value for key, value in info.items()) and \
+            os.path.exists(staging_path) and os.path.getsize(staging_path) == size:
+        completed = {offset for offset in saved.get('completed', ()) if offset in segments}
+    pending = deque((offset, length) for offset, length in segments.items() if offset not in completed)
+    inflight = {}           # offset -> (length, set of urls fetching it)
+    fetched = {url: 0 for url in urls}
+    failures = {url: 0 for url in urls}
+    errors = []
+    aborted = []
+    cond = threading.Condition()
+
+    def next_segment(url):
+        with cond:
+            while len(completed) < total and not aborted:
+                if pending:
+                    offset, length = pending.popleft()
+                else:
+                    # Endgame: help with a segment only one other mirror is on
+                    offset = next((o for o, (_, owners) in inflight.items()
+                                   if url not in owners and len(owners) == 1), None)
+                    if offset is None:
+                        cond.wait()
+                        continue
+                    length = inflight[offset][0]
+                inflight.setdefault(offset, (length, set()))[1].add(url)
+                return offset, length
+            return None
+
+    def fetch(url, out, offset, length):
+        headers = {'Range': f"bytes={offset}-{offset + length - 1}"}
+        with pool.request(url, headers=headers) as response:
+            if not _range_starts_at(response, offset):
+                raise RangeNotSupportedError(f"{url} does not support Range requests")
+            out.seek(offset)
+            remaining = length
+            while remaining:
+                if offset in completed or aborted:
+                    # Another mirror delivered this segment first, or the download was stopped
+                    return False
+                data = response.read(min(chunk_size, remaining))
+                if not data:
+                    raise OSError(f"connection closed during range {offset}-{offset + length - 1}")
+                out.write(data)
+                remaining -= len(data)
+                if on_bytes is not None:
+                    on_bytes(len(data))
+        return True
+
+    def worker(url):
+        with open(staging_path, 'r+b') as out:
+            while True:
+                segment = next_segment(url)
+                if segment is None:
+                    return
+                offset, length = segment
+                try:
+                    finished = fetch(url, out, offset, length)
+                    out.flush()
+                except Exception as e:
+                    with cond:
+                        owners = inflight.get(offset, (length, set()))[1]
+                        owners.discard(url)
+                        if offset not in completed and not owners:
+                            inflight.pop(offset, None)
+                            pending.appendleft((offset, length))
+                        errors.append(e)
+                        failures[url] += 1
+                        cond.notify_all()
+                    if isinstance(e, RangeNotSupportedError) or failures[url] >= MULTI_SOURCE_MAX_FAILURES:
+                        return
+                    continue
+                except BaseException as e:
+                    # on_bytes asked to stop (e.g. the patch was cancelled): stop every mirror
+                    with cond:
+                        aborted.append(e)
+                        cond.notify_all()
+                    return
+                with cond:
+                    if finished and offset not in completed:
+                        completed.add(offset)
+                        fetched[url] += length
+                        inflight.pop(offset, None)
+                    elif offset in inflight:
+                        inflight[offset][1].discard(url)
+                    cond.notify_all()
+
+    def save_progress():
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(info, completed=sorted(completed)), f)
+
+    installed = False
+    try:
+        if completed:
+            if on_bytes is not None:
+                on_bytes(sum(segments[offset] for offset in completed))
+        else:
+            _discard_part(staging_path, info_path)
+            with open(staging_path, 'wb') as f:
+                f.truncate(size)
+        save_progress()
+        threads = [threading.Thread(target=worker, args=(url,), daemon=True) for url in urls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if aborted:
+            raise aborted[0]
+        if len(completed) < total:
+            raise errors[-1] if errors else OSError(f"{dest_path}: download incomplete")
+
+        if hasher is not None:
+            with open(staging_path, 'rb') as f:
+                for data in iter(lambda: f.read(chunk_size), b""):
+                    hasher.update(data)
+            if expected_md5:
+                actual = hasher.hexdigest()
+                if actual != expected_md5:
+                    # Some kept segment is bad; don't resume from any of them
+                    completed.clear()
+                    raise HashMismatchError(dest_path, expected_md5, actual)
+        os.replace(staging_path, dest_path)
+        installed = True
+    finally:
+        if installed or not completed:
+            _discard_part(staging_path, info_path)
+        else:
+            save_progress()
+
+    return fetched
+
+
+def _decompressor(encoding):
+    if encoding == "gzip":
+        return zlib.decompressobj(wbits=31)
+    if encoding == "zstd" and ZSTD_AVAILABLE:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def download_compressed(pool, url, dest_path, encoding, expected_md5=None, hasher=None,
+                        chunk_size=256 * 1024):
+    """
+    Download a compressed variant of a file and decompress it on the fly.
+
+    The decompressed bytes are written to a staging file and fed to hasher,
+    so verification is against the hash of the original file. On success
+    the staging file is renamed over dest_path; on a hash mismatch it is
+    deleted and HashMismatchError is raised. Compressed streams can't be
+    resumed part-way, so an interrupted download starts over next time.
+
+    Returns the number of (compressed) bytes transferred.
+    """
+    dest_path = str(dest_path)
+    staging_path = dest_path + "." + encoding + PART_SUFFIX
+    decompressor = _decompressor(encoding)
+    transferred = 0
+
+    try:
+        with pool.request(url) as response, open(staging_path, 'wb') as out:
+            def write(data):
+                if data:
+                    out.write(data)
+                    if hasher is not None:
+                        hasher.update(data)
+
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                transferred += len(chunk)
+                write(decompressor.decompress(chunk))
+            if encoding == "gzip":
+                write(decompressor.flush())
+                if not decompressor.eof:
+                    raise OSError(f"{url}: compressed stream ended early")
+
+        if hasher is not None and expected_md5:
+            actual = hasher.hexdigest()
+            if actual != expected_md5:
+                raise HashMismatchError(dest_path, expected_md5, actual)
+        os.replace(staging_path, dest_path)
+    except zlib.error as e:
+        raise OSError(f"{url}: corrupt compressed data ({e})")
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    return transferred
+
+
+def plan_bundle_fetches(bundle_size, members, merge_gap=MERGE_GAP, full_ratio=BUNDLE_FULL_FETCH_RATIO):
+    """
+    Group the wanted members of a bundle into byte ranges to fetch.
+
+    members is a list of (offset, size, item) tuples. Members closer than
+    merge_gap are fetched in one range; if most of the bundle is wanted it
+    is fetched whole. Returns a list of (start, end, [(offset, size, item)])
+    in bundle order.
+    """
+    members = sorted(members, key=lambda m: m[0])
+    if not members:
+        return []
+    if sum(size for _, size, _ in members) >= bundle_size * full_ratio:
+        return [(0, bundle_size, members)]
+
+    runs = []
+    for offset, size, item in members:
+        if runs and offset - runs[-1][1] < merge_gap:
+            start, end, run_members = runs[-1]
+            run_members.append((offset, size, item))
+            runs[-1] = (start, max(end, offset + size), run_members)
+        else:
+            runs.append((offset, offset + size, [(offset, size, item)]))
+    return runs
+
+
+def iter_bundle_members(pool, url, start, end, members, chunk_size=256 * 1024):
+    """
+    Stream bytes [start, end) of a bundle and yield (item, data) per member.
+
+    members comes from plan_bundle_fetches(). Only the bytes up to the
+    current member are held in memory, so bundle members are expected to
+    be small. A server that ignores Range sends the whole bundle; the
+    bytes before start are skipped.
+    """
+    headers = {'Range': f"bytes={start}-{end - 1}"}
+    with pool.request(url, headers=headers) as response:
+        pos = start if _range_starts_at(response, start) else 0
+        if response.status not in (200, 206) or (response.status == 206 and pos != start):
+            raise RangeNotSupportedError(f"{url} answered {response.status} to a Range request")
+
+        buffer = bytearray()
+        for offset, size, item in members:
+            # Members can share an offset (identical files are stored once)
+            if offset < pos - len(buffer):
+                raise OSError(f"{url}: bundle members out of order")
+            skip = offset - (pos - len(buffer))
+            while pos < offset + size:
+                data = response.read(min(chunk_size, offset + size - pos))
+                if not data:
+                    raise OSError(f"{url}: connection closed at byte {pos}")
+                buffer += data
+                pos += len(data)
+            del buffer[:skip]
+            yield item, bytes(buffer[:size])
@@ -0,0 +1,73 @@
+"""
+RNGP Patcher - Chunking Tests
+Chunk boundaries of rngp_chunking on synthetic data
+"""
+
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import rngp_chunking
+from rngp_chunking import BOUNDARY_MARKER, MAX_CHUNK_SIZE, MIN_CHUNK_SIZE, file_chunks, iter_chunks
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).randbytes(size)
+
+
+def chunk_list(data):
+    return [(offset, bytes(chunk)) for offset, chunk in iter_chunks(io.BytesIO(data))]
+
+
+class IterChunksTest(unittest.TestCase):
+
+    def test_chunks_cover_the_file_within_size_limits(self):
+        data = random_bytes(3 * 1024 * 1024 + 123, seed=1)
+        chunks = chunk_list(data)
+        self.assertEqual(b"".join(chunk for _, chunk in chunks), data)
+        offset = 0
+        for n, (chunk_offset, chunk) in enumerate(chunks):
+            self.assertEqual(chunk_offset, offset)
+            offset += len(chunk)
+            self.assertLessEqual(len(chunk), MAX_CHUNK_SIZE)
+            if n + 1 < len(chunks):
+                self.assertGreaterEqual(len(chunk), MIN_CHUNK_SIZE)
+                # A chunk ends right after a marker unless it hit the maximum size
+                self.assertTrue(chunk.endswith(BOUNDARY_MARKER) or len(chunk) == MAX_CHUNK_SIZE)
+
+    def test_empty_file(self):
+        self.assertEqual(chunk_list(b""), [])
+
+    def test_boundaries_survive_an_insertion(self):
+        old = random_bytes(4 * 1024 * 1024, seed=2)
+        new = old[:1000000] + random_bytes(5000, seed=3) + old[1000000:]
+        old_chunks = {chunk for _, chunk in chunk_list(old)}
+        new_chunks = chunk_list(new)
+        shared = sum(len(chunk) for _, chunk in new_chunks if chunk in old_chunks)
+        self.assertGreater(shared / len(new), 0.9)
+        # Everything after the edit lines up again within a chunk or two
+        self.assertIn(new_chunks[-1][1], old_chunks)
+
+    def test_boundaries_do_not_depend_on_the_read_size(self):
+        data = random_bytes(2 * 1024 * 1024, seed=4)
+        expected = chunk_list(data)
+        for read_size in (MAX_CHUNK_SIZE - 1, 300001, 5 * 1024 * 1024):
+            with mock.patch.object(rngp_chunking, 'READ_SIZE', read_size):
+                self.assertEqual(chunk_list(data), expected)
+
+    def test_file_chunks_matches_iter_chunks(self):
+        data = random_bytes(1024 * 1024, seed=5)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "music.mp3")
+            with open(path, 'wb') as f:
+                f.write(data)
+            chunks = file_chunks(path)
+        self.assertEqual([(c['offset'], c['length']) for c in chunks],
+                         [(offset, len(chunk)) for offset, chunk in chunk_list(data)])
+
+
+if __name__ == "__main__":
+    unittest.main()
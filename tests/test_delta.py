@@ -0,0 +1,59 @@
+"""
+RNGP Patcher - Delta Tests
+make_delta/apply_delta round trips of rngp_delta
+"""
+
+import hashlib
+import io
+import random
+import unittest
+
+from rngp_delta import DeltaError, apply_delta, make_delta
+
+
+def apply(old, delta, hasher=None):
+    out = io.BytesIO()
+    apply_delta(io.BytesIO(old), delta, out, hasher)
+    return out.getvalue()
+
+
+class DeltaRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.old = rng.randbytes(300000)
+        # Insert, overwrite, delete and append
+        self.new = (self.old[:1000] + rng.randbytes(777) + self.old[1000:50000] + b"x" * 100 +
+                    self.old[50100:200000] + self.old[210000:] + rng.randbytes(4096))
+
+    def test_round_trip(self):
+        delta = make_delta(self.old, self.new)
+        self.assertEqual(apply(self.old, delta), self.new)
+        # Mostly copies: far smaller than the new file
+        self.assertLess(len(delta), len(self.new) // 10)
+
+    def test_hasher_sees_the_new_file(self):
+        hasher = hashlib.md5()
+        apply(self.old, make_delta(self.old, self.new), hasher)
+        self.assertEqual(hasher.hexdigest(), hashlib.md5(self.new).hexdigest())
+
+    def test_edge_cases(self):
+        unrelated = random.Random(8).randbytes(5000)
+        for old, new in ((self.old, b""), (b"", self.new), (self.old, self.old), (self.old, unrelated),
+                         (b"short", b"shorter")):
+            self.assertEqual(apply(old, make_delta(old, new)), new)
+
+    def test_wrong_base_file(self):
+        delta = make_delta(self.old, self.new)
+        with self.assertRaises(DeltaError):
+            apply(self.old[:-1], delta)
+
+    def test_corrupt_delta(self):
+        delta = make_delta(self.old, self.new)
+        for bad in (b"not a delta", delta[:len(delta) // 2], delta[:20] + bytes(len(delta) - 20)):
+            with self.assertRaises(DeltaError):
+                apply(self.old, bad)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+RNGP Patcher - PFS Tests
+Directory parsing of rngp_pfs on small archives built by the test
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+from rngp_pfs import NAMES_CRC, PFSArchive, PFSError, entry_segments, local_segment_index
+
+BLOCK_SIZE = 8192
+
+PATCH_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "patch_files")
+
+
+def build_pfs(files):
+    """PFS archive bytes holding files ({name: data}), data in the given order"""
+    body = bytearray()
+    directory = []
+
+    def add_entry(crc, data):
+        offset = 12 + len(body)
+        for start in range(0, len(data), BLOCK_SIZE):
+            block = data[start:start + BLOCK_SIZE]
+            packed = zlib.compress(block)
+            body.extend(struct.pack("<II", len(packed), len(block)) + packed)
+        directory.append((crc, offset, len(data)))
+
+    for n, data in enumerate(files.values()):
+        # Any CRC will do except the name table's; the reader doesn't check them
+        add_entry(0x1000 + n, data)
+    names = struct.pack("<I", len(files))
+    for name in files:
+        encoded = name.encode('latin-1') + b"\0"
+        names += struct.pack("<I", len(encoded)) + encoded
+    add_entry(NAMES_CRC, names)
+
+    dir_offset = 12 + len(body)
+    out = struct.pack("<I4sI", dir_offset, b"PFS ", 0x20000) + bytes(body)
+    out += struct.pack("<I", len(directory))
+    for entry in sorted(directory):
+        out += struct.pack("<III", *entry)
+    return out + b"STEVE" + struct.pack("<I", 0)
+
+
+class PFSTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.files = {
+            "gfaydark.wld": os.urandom(20000),
+            "tree.bmp": b"\0" * 30000,
+            "empty.txt": b"",
+            "small.txt": b"hello",
+        }
+
+    def write(self, data, name="test.s3d"):
+        path = os.path.join(self.folder.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_directory(self):
+        path = self.write(build_pfs(self.files))
+        with PFSArchive.open(path) as archive:
+            self.assertEqual([entry.name for entry in archive.entries], list(self.files))
+            for entry in archive.entries:
+                self.assertEqual(entry.size, len(self.files[entry.name]))
+                self.assertEqual(archive.read(entry), self.files[entry.name])
+            self.assertEqual(archive.names_entry.crc, NAMES_CRC)
+
+    def test_entry_segments_locate_the_raw_blocks(self):
+        data = build_pfs(self.files)
+        segments = entry_segments(self.write(data))
+        self.assertEqual([s['name'] for s in segments], list(self.files) + [""])
+        # Segments are back to back from the end of the header to the directory
+        self.assertEqual(segments[0]['offset'], 12)
+        for segment, following in zip(segments, segments[1:]):
+            self.assertEqual(segment['offset'] + segment['length'], following['offset'])
+        for segment in segments:
+            raw = data[segment['offset']:segment['offset'] + segment['length']]
+            self.assertEqual(segment['md5'], hashlib.md5(raw).hexdigest())
+
+    def test_unchanged_entries_are_found_in_another_version(self):
+        old_path = self.write(build_pfs(self.files), "old.s3d")
+        changed = dict(self.files, **{"gfaydark.wld": os.urandom(25000)})
+        new_segments = entry_segments(self.write(build_pfs(changed), "new.s3d"))
+        local_index = local_segment_index(old_path)
+        reusable = {s['name'] for s in new_segments if s['md5'] in local_index}
+        # The name table ("") didn't change either
+        self.assertEqual(reusable, {"tree.bmp", "empty.txt", "small.txt", ""})
+
+    def test_invalid_archives(self):
+        data = build_pfs(self.files)
+        dir_offset = struct.unpack_from("<I", data)[0]
+        for bad in (b"", b"PFS", data[:4] + b"ZIP " + data[8:], data[:dir_offset + 10],
+                    data[:12] + data[200:]):
+            with self.assertRaises(PFSError):
+                PFSArchive.open(self.write(bad)).close()
+
+    @unittest.skipUnless(os.path.isdir(PATCH_FILES), "patch_files/ not present")
+    def test_release_archives(self):
+        archives = [entry.path for entry in os.scandir(PATCH_FILES)
+                    if entry.name.endswith('.s3d') and 1024 < entry.stat().st_size < 2 * 1024 * 1024]
+        for path in archives:
+            with self.subTest(path=path), PFSArchive.open(path) as archive:
+                self.assertTrue(archive.entries)
+                for entry in archive.entries:
+                    self.assertTrue(entry.name)
+                    self.assertEqual(len(archive.read(entry)), entry.size)
+
+
+if __name__ == "__main__":
+    unittest.main()
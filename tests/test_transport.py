@@ -0,0 +1,72 @@
+"""
+RNGP Patcher - Transport Tests
+Range planning of rngp_transport.plan_segments
+"""
+
+import unittest
+
+from rngp_transport import plan_segments
+
+KB = 1024
+
+
+def segments_of(*lengths):
+    """Back to back (offset, length, md5) segments named s0, s1, ..."""
+    segments = []
+    offset = 0
+    for n, length in enumerate(lengths):
+        segments.append((offset, length, f"s{n}"))
+        offset += length
+    return segments
+
+
+def covered(plan):
+    return sum(length for _, _, length in plan)
+
+
+class PlanSegmentsTest(unittest.TestCase):
+
+    def test_everything_local(self):
+        segments = segments_of(100 * KB, 100 * KB)
+        local_index = {"s0": (0, 100 * KB), "s1": (100 * KB, 100 * KB)}
+        self.assertEqual(plan_segments(200 * KB, segments, local_index),
+                         [("local", 0, 100 * KB), ("local", 100 * KB, 100 * KB)])
+
+    def test_nothing_local_is_one_fetch(self):
+        segments = segments_of(100 * KB, 100 * KB, 50 * KB)
+        self.assertEqual(plan_segments(250 * KB, segments, {}), [("remote", 0, 250 * KB)])
+
+    def test_moved_and_changed_segments(self):
+        segments = segments_of(100 * KB, 100 * KB, 100 * KB)
+        # s0 moved in the old file, s1 changed, s2 unchanged
+        local_index = {"s0": (500 * KB, 100 * KB), "s2": (200 * KB, 100 * KB)}
+        self.assertEqual(plan_segments(300 * KB, segments, local_index),
+                         [("local", 500 * KB, 100 * KB), ("remote", 100 * KB, 100 * KB),
+                          ("local", 200 * KB, 100 * KB)])
+
+    def test_length_mismatch_is_fetched(self):
+        segments = segments_of(100 * KB)
+        self.assertEqual(plan_segments(100 * KB, segments, {"s0": (0, 99 * KB)}), [("remote", 0, 100 * KB)])
+
+    def test_gaps_and_tail_are_fetched(self):
+        # Bytes outside any segment (e.g. the PFS header and directory)
+        segments = [(12, 100 * KB, "s0"), (100 * KB + 50, 100 * KB, "s1")]
+        local_index = {"s0": (12, 100 * KB), "s1": (100 * KB + 12, 100 * KB)}
+        plan = plan_segments(210 * KB, segments, local_index)
+        self.assertEqual(plan, [("remote", 0, 12), ("local", 12, 100 * KB), ("remote", 100 * KB + 12, 38),
+                                ("local", 100 * KB + 12, 100 * KB), ("remote", 200 * KB + 50, 10 * KB - 50)])
+        self.assertEqual(covered(plan), 210 * KB)
+
+    def test_short_local_copy_between_fetches_is_merged(self):
+        segments = segments_of(100 * KB, 4 * KB, 100 * KB, 100 * KB)
+        local_index = {"s1": (0, 4 * KB), "s3": (300 * KB, 100 * KB)}
+        self.assertEqual(plan_segments(304 * KB, segments, local_index),
+                         [("remote", 0, 204 * KB), ("local", 300 * KB, 100 * KB)])
+        # A long one is kept
+        self.assertEqual(plan_segments(304 * KB, segments, local_index, merge_gap=4 * KB),
+                         [("remote", 0, 100 * KB), ("local", 0, 4 * KB), ("remote", 104 * KB, 100 * KB),
+                          ("local", 300 * KB, 100 * KB)])
+
+
+if __name__ == "__main__":
+    unittest.main()